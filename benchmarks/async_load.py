@@ -0,0 +1,163 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright 2011-2019 by Dirk Gorissen, Stephen Rauch and Contributors
+# All rights reserved.
+# This file is part of the Pycel Library, Licensed under GPLv3 (the 'License')
+# You may not use this work except in compliance with the License.
+# You may obtain a copy of the Licence at:
+#   https://www.gnu.org/licenses/gpl-3.0.en.html
+
+"""
+Load test `AsyncModel` with concurrent clients on a synthetic workbook
+
+Run from the repo root with:
+
+    python benchmarks/async_load.py --workbook fill_down --size 2000 --clients 50
+
+Each client sends requests one after another, with inputs drawn from a pool
+of `--distinct` values so that some requests can be coalesced.  The requests
+are also evaluated one by one without `AsyncModel` for comparison.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+import networkx as nx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from pycel import ExcelCompiler  # noqa: E402
+from pycel.asyncmodel import AsyncModel, evaluate_batch  # noqa: E402
+
+import workbooks  # noqa: E402, I100
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def summary(latencies, elapsed):
+    return dict(
+        requests=len(latencies),
+        seconds=round(elapsed, 4),
+        requests_per_second=round(len(latencies) / elapsed, 1),
+        p50_ms=round(percentile(latencies, 0.5) * 1000, 3),
+        p95_ms=round(percentile(latencies, 0.95) * 1000, 3),
+        p99_ms=round(percentile(latencies, 0.99) * 1000, 3),
+    )
+
+
+def make_requests(input_address, outputs, count, distinct, seed=0):
+    rng = random.Random(seed)
+    values = [rng.randint(1, 1000) for _ in range(distinct)]
+    return [({input_address: rng.choice(values)}, outputs) for _ in range(count)]
+
+
+def run_serial(excel_compiler, requests):
+    latencies = []
+    start = time.perf_counter()
+    for request in requests:
+        request_start = time.perf_counter()
+        evaluate_batch(excel_compiler, [request])
+        latencies.append(time.perf_counter() - request_start)
+    return summary(latencies, time.perf_counter() - start)
+
+
+async def run_clients(model, requests, clients):
+    latencies = []
+    todo = iter(requests)
+
+    async def client():
+        for inputs, outputs in todo:
+            request_start = time.perf_counter()
+            await model.evaluate(inputs, outputs)
+            latencies.append(time.perf_counter() - request_start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+    await model.close()
+    return summary(latencies, elapsed)
+
+
+def run_async(excel_compiler, requests, clients, **kwargs):
+    model = AsyncModel(excel_compiler, **kwargs)
+    loop = asyncio.new_event_loop()
+    try:
+        result = loop.run_until_complete(run_clients(model, requests, clients))
+    finally:
+        loop.close()
+    result.update(batches=model.batches, coalesced=model.coalesced)
+    return result
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--workbook', default='fill_down', choices=sorted(workbooks.WORKBOOKS))
+    parser.add_argument('--size', type=int, default=2000,
+                        help='about how many formula cells in the workbook')
+    parser.add_argument('--outputs', type=int, default=10,
+                        help='how many of the formula cells which depend on the input '
+                             'each request evaluates')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--clients', type=int, default=50,
+                        help='concurrent clients sending requests')
+    parser.add_argument('--distinct', type=int, default=100,
+                        help='how many different input values the requests use')
+    parser.add_argument('--batch-sizes', default='1,8,32',
+                        help='comma separated max_batch_size values to run')
+    parser.add_argument('--max-delay', type=float, default=0.002)
+    parser.add_argument('--executors', default='thread,process',
+                        help='comma separated executors to run')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--output', help='JSON file for the results, default: stdout')
+    args = parser.parse_args(args)
+
+    wb, input_address = workbooks.WORKBOOKS[args.workbook](args.size)
+    excel_compiler = ExcelCompiler(excel=wb)
+    formula_cells = [address.address for sheet in wb.sheetnames
+                     for address in excel_compiler.formula_cells(sheet)]
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10 * len(formula_cells)))
+    excel_compiler.evaluate(formula_cells)
+
+    # outputs which depend on the input
+    dependants = {cell.address.address for cell in nx.descendants(
+        excel_compiler.dep_graph, excel_compiler.cell_map[input_address])}
+    outputs = tuple(address for address in formula_cells
+                    if address in dependants)[-args.outputs:]
+
+    requests = make_requests(input_address, outputs, args.requests, args.distinct)
+    results = dict(
+        workbook=args.workbook,
+        size=args.size,
+        clients=args.clients,
+        distinct=args.distinct,
+        serial=run_serial(excel_compiler, requests),
+        runs=[],
+    )
+    print(f'serial: {json.dumps(results["serial"])}', file=sys.stderr, flush=True)
+
+    for executor in args.executors.split(','):
+        for batch_size in map(int, args.batch_sizes.split(',')):
+            run = run_async(
+                excel_compiler, requests, args.clients, executor=executor,
+                workers=args.workers, max_batch_size=batch_size, max_delay=args.max_delay)
+            run.update(executor=executor, max_batch_size=batch_size)
+            results['runs'].append(run)
+            print(json.dumps(run), file=sys.stderr, flush=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
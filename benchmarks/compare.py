@@ -0,0 +1,93 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright 2011-2019 by Dirk Gorissen, Stephen Rauch and Contributors
+# All rights reserved.
+# This file is part of the Pycel Library, Licensed under GPLv3 (the 'License')
+# You may not use this work except in compliance with the License.
+# You may obtain a copy of the Licence at:
+#   https://www.gnu.org/licenses/gpl-3.0.en.html
+
+"""
+Compare two benchmark results from `run_benchmarks.py`
+
+    python benchmarks/compare.py before.json after.json --threshold 1.2
+
+Prints the ratio after / before of each timing, file size and peak memory,
+and exits non-zero if any ratio is larger than the threshold.
+"""
+import argparse
+import json
+import sys
+
+# timings shorter than this are too noisy to flag as regressions
+MIN_SECONDS = 0.01
+
+
+def _metrics(result):
+    """ Flatten a workbook result into {metric name: (value, is_timing)} """
+    metrics = {name: (value, True) for name, value in result['timings'].items()}
+    metrics.update((f'size.{name}', (value, False))
+                   for name, value in result['file_sizes'].items())
+    if result.get('peak_rss_increase_mb') is not None:
+        metrics['peak_rss_increase_mb'] = result['peak_rss_increase_mb'], False
+    return metrics
+
+
+def compare(before, after, threshold=1.2):
+    """ Compare the results of two benchmark runs
+
+    :param before: results dict of the baseline run
+    :param after: results dict of the run to check
+    :param threshold: ratio after / before which is a regression
+    :return: (lines of the report, list of the regressions)
+    """
+    lines = [f'before: {before.get("git_commit")}  after: {after.get("git_commit")}']
+    if before.get('size') != after.get('size'):
+        lines.append(f'WARNING: sizes differ: {before.get("size")} vs {after.get("size")}')
+
+    regressions = []
+    for name, after_result in after['workbooks'].items():
+        before_result = before['workbooks'].get(name)
+        if before_result is None:
+            lines.append(f'{name}: not in the baseline')
+            continue
+
+        lines.append(name)
+        before_metrics = _metrics(before_result)
+        for metric, (value, is_timing) in _metrics(after_result).items():
+            if metric not in before_metrics:
+                continue
+            base = before_metrics[metric][0]
+            ratio = value / base if base else float('inf') if value else 1.0
+            regressed = ratio > threshold and not (
+                is_timing and max(base, value) < MIN_SECONDS)
+            if regressed:
+                regressions.append((name, metric, ratio))
+            lines.append(f'  {metric:<24} {base:>14.6g} {value:>14.6g} {ratio:>8.2f}'
+                         f'{"  REGRESSION" if regressed else ""}')
+    return lines, regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1].strip())
+    parser.add_argument('before', help='JSON results of the baseline')
+    parser.add_argument('after', help='JSON results to compare to the baseline')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='ratio after / before flagged as a regression, default: 1.2')
+    args = parser.parse_args(args)
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    lines, regressions = compare(before, after, threshold=args.threshold)
+    print('\n'.join(lines))
+    if regressions:
+        print(f'\n{len(regressions)} regression(s) over {args.threshold}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,220 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright 2011-2019 by Dirk Gorissen, Stephen Rauch and Contributors
+# All rights reserved.
+# This file is part of the Pycel Library, Licensed under GPLv3 (the 'License')
+# You may not use this work except in compliance with the License.
+# You may obtain a copy of the Licence at:
+#   https://www.gnu.org/licenses/gpl-3.0.en.html
+
+"""
+Time pycel on synthetic workbooks and save the results as JSON
+
+Run from the repo root with:
+
+    python benchmarks/run_benchmarks.py --size 2000 --output results.json
+
+Each workbook is benchmarked in a fresh process, so the peak memory is for
+that workbook only.  Compare the results of two runs with `compare.py`.
+"""
+import argparse
+import concurrent.futures
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from pycel import ExcelCompiler  # noqa: E402
+from pycel.version import __version__  # noqa: E402
+
+import workbooks  # noqa: E402, I100
+
+FILE_TYPES = ('pkl', 'yml', 'json', 'pycel')
+
+
+def peak_rss_mb():
+    """ Peak resident memory of this process in MiB, if available """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KiB elsewhere
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+class Timer:
+    """ Accumulate named timings """
+
+    def __init__(self):
+        self.timings = {}
+
+    def __call__(self, name):
+        timer = self
+
+        class _Timing:
+            def __enter__(self):
+                self.start = time.perf_counter()
+
+            def __exit__(self, *args):
+                timer.timings[name] = round(time.perf_counter() - self.start, 6)
+
+        return _Timing()
+
+
+def benchmark_workbook(filename, input_address):
+    """ Time the stages of using pycel on one workbook
+
+    :return: dict of the cell counts, timings, file sizes and peak memory
+    """
+    timer = Timer()
+    baseline_rss = peak_rss_mb()
+
+    with timer('load'):
+        excel_compiler = ExcelCompiler(filename=filename)
+
+    outputs = [address for sheet in excel_compiler.excel.workbook.sheetnames
+               for address in excel_compiler.formula_cells(sheet)]
+
+    with timer('gen_graph'):
+        excel_compiler._gen_graph(outputs)
+
+    with timer('evaluate'):
+        excel_compiler.evaluate(outputs)
+
+    with timer('recalculate'):
+        excel_compiler.set_value(input_address, 3)
+        excel_compiler.evaluate(outputs)
+
+    file_sizes = {}
+    for file_type in FILE_TYPES:
+        saved_name = f'{filename}.{file_type}'
+        with timer(f'to_file.{file_type}'):
+            excel_compiler.to_file(saved_name, file_types=(file_type, ))
+        file_sizes[file_type] = os.path.getsize(saved_name)
+
+        with timer(f'from_file.{file_type}'):
+            loaded = ExcelCompiler.from_file(saved_name)
+        with timer(f'evaluate.{file_type}'):
+            loaded.evaluate(outputs)
+        os.unlink(saved_name)
+
+    peak_rss = peak_rss_mb()
+    return dict(
+        cells=len(excel_compiler.cell_map),
+        formulas=len(outputs),
+        edges=excel_compiler.dep_graph.number_of_edges(),
+        timings=timer.timings,
+        file_sizes=file_sizes,
+        peak_rss_mb=peak_rss and round(peak_rss, 1),
+        peak_rss_increase_mb=peak_rss and round(peak_rss - baseline_rss, 1),
+    )
+
+
+def _run_in_thread(func, *args):
+    """ Run with a large stack, the evaluation recurses through the precedents """
+    sys.setrecursionlimit(10 ** 6)
+    threading.stack_size(2 ** 29)
+    result = {}
+
+    def target():
+        try:
+            result['value'] = func(*args)
+        except BaseException as exc:
+            result['exc'] = exc
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join()
+    if 'exc' in result:
+        raise result['exc']
+    return result['value']
+
+
+def run_workbook(name, size, directory):
+    """ Generate and benchmark one workbook, run in a worker process """
+    filename, input_address = workbooks.generate(name, size, directory)
+    try:
+        return _run_in_thread(benchmark_workbook, filename, input_address)
+    finally:
+        os.unlink(filename)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(names, size, in_process=False):
+    """ Benchmark the named workbooks
+
+    :param names: keys of `workbooks.WORKBOOKS`
+    :param size: about how many formula cells in each workbook
+    :param in_process: run in this process, the peak memory is then
+        the peak for all of the workbooks so far
+    :return: the results as a dict for JSON
+    """
+    results = dict(
+        pycel_version=__version__,
+        git_commit=git_commit(),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        timestamp=datetime.datetime.now().isoformat(timespec='seconds'),
+        size=size,
+        workbooks={},
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        for name in names:
+            print(f'{name} ({size})...', file=sys.stderr, flush=True)
+            if in_process:
+                result = run_workbook(name, size, directory)
+            else:
+                with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+                    result = executor.submit(run_workbook, name, size, directory).result()
+            results['workbooks'][name] = result
+            print(json.dumps(result['timings']), file=sys.stderr, flush=True)
+    return results
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--size', type=int, default=1000,
+                        help='about how many formula cells in each workbook')
+    parser.add_argument('--workbooks', default=','.join(workbooks.WORKBOOKS),
+                        help='comma separated workbooks to run, default: all')
+    parser.add_argument('--output', help='JSON file for the results, default: stdout')
+    parser.add_argument('--in-process', action='store_true',
+                        help='do not start a process for each workbook')
+    args = parser.parse_args(args)
+
+    names = args.workbooks.split(',')
+    unknown = set(names) - set(workbooks.WORKBOOKS)
+    if unknown:
+        parser.error(f'Unknown workbooks: {", ".join(sorted(unknown))}')
+
+    results = run(names, args.size, in_process=args.in_process)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
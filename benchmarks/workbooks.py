@@ -0,0 +1,156 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright 2011-2019 by Dirk Gorissen, Stephen Rauch and Contributors
+# All rights reserved.
+# This file is part of the Pycel Library, Licensed under GPLv3 (the 'License')
+# You may not use this work except in compliance with the License.
+# You may obtain a copy of the Licence at:
+#   https://www.gnu.org/licenses/gpl-3.0.en.html
+
+"""
+Synthetic workbooks for the benchmarks
+
+Each generator takes a size, which is roughly the number of formula cells,
+and returns an openpyxl `Workbook` along with the address of an input cell
+which the benchmarks change to time a recalculation.
+"""
+import os
+
+from openpyxl import Workbook
+from openpyxl.workbook.properties import CalcProperties
+
+
+def chain(size):
+    """ Each cell depends on the cell above it """
+    wb = Workbook()
+    ws = wb.active
+    ws.title = 'Chain'
+    ws['A1'] = 1
+    for row in range(2, size + 1):
+        ws[f'A{row}'] = f'=A{row - 1} + 1'
+    return wb, 'Chain!A1'
+
+
+def fill_down(size):
+    """ A block of formulas copied down, referring to their own row """
+    wb = Workbook()
+    ws = wb.active
+    ws.title = 'Fill'
+    rows = max(size // 4, 1)
+    for row in range(1, rows + 1):
+        ws[f'A{row}'] = row
+        ws[f'B{row}'] = row % 7
+        ws[f'C{row}'] = f'=A{row} * B{row}'
+        ws[f'D{row}'] = f'=C{row} + A{row} / 2'
+        ws[f'E{row}'] = f'=IF(D{row} > 10, D{row} - 10, D{row} * 2)'
+        ws[f'F{row}'] = f'=ROUND(E{row} / 3, 2)'
+    ws['H1'] = f'=SUM(F1:F{rows})'
+    return wb, 'Fill!A1'
+
+
+def lookup(size):
+    """ VLOOKUP() and INDEX()/MATCH() into a table on another sheet """
+    wb = Workbook()
+    data = wb.active
+    data.title = 'Data'
+    for row in range(1, size + 1):
+        data[f'A{row}'] = f'key{row}'
+        data[f'B{row}'] = row * 10
+        data[f'C{row}'] = row % 13
+    ws = wb.create_sheet('Lookup')
+    table = f'Data!$A$1:$C${size}'
+    for row in range(1, size + 1):
+        key = (row * 7919) % size + 1
+        ws[f'A{row}'] = f'key{key}'
+        if row % 2:
+            ws[f'B{row}'] = f'=VLOOKUP(A{row}, {table}, 2, FALSE)'
+        else:
+            ws[f'B{row}'] = (f'=INDEX(Data!$C$1:$C${size}, '
+                             f'MATCH(A{row}, Data!$A$1:$A${size}, 0))')
+    return wb, 'Data!B1'
+
+
+def sum_ifs(size):
+    """ SUMIFS() and COUNTIFS() summarizing a table """
+    wb = Workbook()
+    data = wb.active
+    data.title = 'Data'
+    categories = max(size // 10, 1)
+    for row in range(1, size + 1):
+        data[f'A{row}'] = f'cat{row % categories}'
+        data[f'B{row}'] = row % 5
+        data[f'C{row}'] = row
+    ws = wb.create_sheet('Summary')
+    column_a, column_b, column_c = (f'Data!${col}$1:${col}${size}' for col in 'ABC')
+    for row in range(1, categories + 1):
+        ws[f'A{row}'] = f'cat{row - 1}'
+        ws[f'B{row}'] = f'=SUMIFS({column_c}, {column_a}, A{row}, {column_b}, ">1")'
+        ws[f'C{row}'] = f'=COUNTIFS({column_a}, A{row}, {column_b}, "<3")'
+    return wb, 'Data!C1'
+
+
+def circular(size):
+    """ Pairs of cells which refer to each other, needing iterative calculation """
+    wb = Workbook()
+    wb.calculation = CalcProperties(iterate=True, iterateCount=100, iterateDelta=0.001)
+    ws = wb.active
+    ws.title = 'Circular'
+    ws['A1'] = 10
+    for row in range(1, max(size // 2, 1) + 1):
+        ws[f'B{row}'] = f'=$A$1 + C{row} / 2'
+        ws[f'C{row}'] = f'=B{row} / 2 + {row % 3}'
+    return wb, 'Circular!A1'
+
+
+def many_sheets(size, cells_per_sheet=100):
+    """ Sheets which each refer to the sheet before """
+    wb = Workbook()
+    ws = wb.active
+    ws.title = 'Sheet0'
+    for row in range(1, cells_per_sheet + 1):
+        ws[f'A{row}'] = row
+    for sheet in range(1, max(size // cells_per_sheet, 1) + 1):
+        ws = wb.create_sheet(f'Sheet{sheet}')
+        for row in range(1, cells_per_sheet + 1):
+            ws[f'A{row}'] = f"=Sheet{sheet - 1}!A{row} + 'Sheet{sheet - 1}'!A1"
+    return wb, 'Sheet0!A1'
+
+
+def unbounded_ranges(size):
+    """ Formulas over entire columns """
+    wb = Workbook()
+    ws = wb.active
+    ws.title = 'Columns'
+    for row in range(1, size + 1):
+        ws[f'A{row}'] = row % 17
+        ws[f'B{row}'] = f'k{row % 11}'
+    for row in range(1, max(size // 100, 1) + 1):
+        ws[f'D{row}'] = f'=SUMIF(B:B, "k{row % 11}", A:A)'
+        ws[f'E{row}'] = f'=COUNTIF(A:A, ">{row % 17}")'
+        ws[f'F{row}'] = '=MAX(A:A) - MIN(A:A) + SUM(A:A)'
+    return wb, 'Columns!A1'
+
+
+WORKBOOKS = {
+    'chain': chain,
+    'fill_down': fill_down,
+    'lookup': lookup,
+    'sum_ifs': sum_ifs,
+    'circular': circular,
+    'many_sheets': many_sheets,
+    'unbounded_ranges': unbounded_ranges,
+}
+
+
+def generate(name, size, directory):
+    """ Save a synthetic workbook
+
+    :param name: key in `WORKBOOKS`
+    :param size: about how many formula cells to generate
+    :param directory: where to save the workbook
+    :return: (filename, input address)
+    """
+    wb, input_address = WORKBOOKS[name](size)
+    filename = os.path.join(directory, f'{name}-{size}.xlsx')
+    wb.save(filename)
+    return filename, input_address
@@ -0,0 +1,234 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright 2011-2019 by Dirk Gorissen, Stephen Rauch and Contributors
+# All rights reserved.
+# This file is part of the Pycel Library, Licensed under GPLv3 (the 'License')
+# You may not use this work except in compliance with the License.
+# You may obtain a copy of the Licence at:
+#   https://www.gnu.org/licenses/gpl-3.0.en.html
+
+"""
+    Evaluate a compiled workbook from asyncio, in batches on a worker pool
+
+    Used like:
+
+        model = AsyncModel(excel_compiler, max_batch_size=64)
+        result = await model.evaluate({'Sheet1!A1': 5}, 'Sheet1!B1')
+        ...
+        await model.close()
+
+    Requests which arrive close together are coalesced into one batch for a
+    worker, and identical requests in a batch are only evaluated once.
+"""
+
+import asyncio
+import concurrent.futures
+
+# the compiler in a worker process
+_worker_compiler = None
+
+
+def _init_worker(excel_compiler):
+    global _worker_compiler
+    _worker_compiler = excel_compiler
+
+
+def _worker_evaluate_batch(requests):
+    return evaluate_batch(_worker_compiler, requests)
+
+
+def evaluate_batch(excel_compiler, requests):
+    """ Evaluate requests, each in its own `ValueContext`
+
+    :param excel_compiler: the `ExcelCompiler` to evaluate
+    :param requests: list of (inputs, outputs), inputs being a dict of
+        address to value, and outputs the addresses for `evaluate()`
+    :return: list of (is_exception, result or exception)
+    """
+    results = []
+    for inputs, outputs in requests:
+        try:
+            context = excel_compiler.value_context()
+            for address, value in inputs.items():
+                context.set_value(address, value)
+            results.append((False, context.evaluate(outputs)))
+        except Exception as exc:
+            results.append((True, exc))
+    return results
+
+
+def _request_key(inputs, outputs):
+    """ Key to find identical requests, or None if not hashable """
+    try:
+        key = (tuple(sorted(inputs.items())), outputs)
+        hash(key)
+        return key
+    except TypeError:
+        return None
+
+
+class AsyncModel:
+    """ Queue evaluate requests and evaluate them in batches
+
+    The outputs should have been evaluated with the compiler before the
+    model is used, so that all of the cells are loaded, and so that each
+    request only calculates the cells which depend on its inputs.
+
+    :param excel_compiler: the `ExcelCompiler` to evaluate
+    :param max_batch_size: most requests in one batch
+    :param max_delay: seconds to wait for more requests to fill a batch
+    :param max_pending: most requests waiting for a batch, more requests
+        wait in `evaluate()` until there is room
+    :param max_concurrent_batches: most batches being evaluated at once,
+        defaults to the number of workers
+    :param executor: a `concurrent.futures.Executor` or 'thread' or 'process'.
+        A process pool gets a pickled copy of the compiler in each worker.
+    :param workers: number of workers if creating the executor
+    """
+
+    def __init__(self, excel_compiler, max_batch_size=32, max_delay=0.002,
+                 max_pending=1024, max_concurrent_batches=None,
+                 executor='thread', workers=1):
+        # fail now for workbooks which can not be evaluated in contexts
+        excel_compiler.value_context()
+
+        self.excel_compiler = excel_compiler
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.max_concurrent_batches = max_concurrent_batches or workers
+
+        self._owns_executor = isinstance(executor, str)
+        if executor == 'thread':
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        elif executor == 'process':
+            executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_worker,
+                initargs=(excel_compiler, ))
+        elif isinstance(executor, str):
+            raise ValueError(f'Unknown executor: {executor}')
+        self.executor = executor
+        self._evaluate_batch = (
+            _worker_evaluate_batch if isinstance(executor, concurrent.futures.ProcessPoolExecutor)
+            else lambda requests: evaluate_batch(excel_compiler, requests))
+
+        self._queue = None
+        self._dispatcher = None
+        self._closed = False
+        self._batches = set()
+
+        # counters of the work done
+        self.requests = 0
+        self.batches = 0
+        self.coalesced = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def evaluate(self, inputs, outputs):
+        """ Evaluate outputs with some inputs set
+
+        :param inputs: dict of address to value
+        :param outputs: address, or tuple or list of addresses
+        :return: the value(s) of the outputs
+        """
+        if self._closed:
+            raise RuntimeError('AsyncModel is closed')
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_pending)
+            self._semaphore = asyncio.Semaphore(self.max_concurrent_batches)
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((inputs, outputs, future))
+        self.requests += 1
+        return await future
+
+    async def close(self):
+        """ Finish the queued requests, and shut down the executor """
+        if self._closed:
+            return
+        self._closed = True
+        if self._dispatcher is not None:
+            await self._queue.put(None)
+            await self._dispatcher
+        if self._owns_executor:
+            self.executor.shutdown()
+
+    async def _next_batch(self):
+        """ Wait for a request, then gather more for up to max_delay """
+        loop = asyncio.get_running_loop()
+        request = await self._queue.get()
+        if request is None:
+            return None
+        batch = [request]
+        deadline = loop.time() + self.max_delay
+        while len(batch) < self.max_batch_size:
+            if self._queue.empty():
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    request = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            else:
+                request = self._queue.get_nowait()
+            if request is None:
+                # finish this batch, then stop
+                self._queue.put_nowait(None)
+                break
+            batch.append(request)
+        return batch
+
+    async def _dispatch(self):
+        while True:
+            await self._semaphore.acquire()
+            batch = await self._next_batch()
+            if batch is None:
+                self._semaphore.release()
+                break
+            task = asyncio.ensure_future(self._run_batch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+        if self._batches:
+            await asyncio.wait(self._batches)
+
+    async def _run_batch(self, batch):
+        try:
+            # evaluate each distinct request once
+            requests = []
+            futures_by_key = {}
+            futures = []
+            for inputs, outputs, future in batch:
+                key = _request_key(inputs, outputs)
+                if key is not None and key in futures_by_key:
+                    futures_by_key[key].append(future)
+                    self.coalesced += 1
+                else:
+                    requests.append((inputs, outputs))
+                    futures.append([future])
+                    if key is not None:
+                        futures_by_key[key] = futures[-1]
+
+            self.batches += 1
+            try:
+                results = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, self._evaluate_batch, requests)
+            except Exception as exc:
+                results = [(True, exc)] * len(requests)
+
+            for request_futures, (is_exception, result) in zip(futures, results):
+                for future in request_futures:
+                    if future.cancelled():
+                        continue
+                    if is_exception:
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+        finally:
+            self._semaphore.release()
@@ -0,0 +1,208 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright 2011-2019 by Dirk Gorissen, Stephen Rauch and Contributors
+# All rights reserved.
+# This file is part of the Pycel Library, Licensed under GPLv3 (the 'License')
+# You may not use this work except in compliance with the License.
+# You may obtain a copy of the Licence at:
+#   https://www.gnu.org/licenses/gpl-3.0.en.html
+
+"""
+    Versioned binary container used to save compiled models
+
+    The file is a fixed header, a json encoded metadata block and then a
+    sequence of named sections.  Each section is the raw bytes of a typed
+    array (or a byte string), 8 byte aligned, so that it can be used in
+    place with `memoryview.cast()` from a single read or a memory map.
+"""
+
+import array
+import collections.abc
+import hashlib
+import json
+import struct
+import sys
+
+from pycel.excelutil import PyCelException
+
+MAGIC = b'PYCELBIN'
+FORMAT_VERSION = 2
+
+# magic, format version, metadata length
+HEADER = struct.Struct('<8sIQ')
+ALIGNMENT = 8
+
+
+class BinaryFormatError(PyCelException):
+    """The file is not a (compatible) pycel binary file"""
+
+
+def _aligned(size):
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+def _as_bytes(data):
+    """The raw bytes and the array typecode of a section"""
+    view = memoryview(data)
+    return view.cast('B'), getattr(data, 'typecode', 'B')
+
+
+def content_hash(meta, sections, exclude=()):
+    """ Hash of the metadata and sections, for change detection
+
+    :param meta: json serializable metadata dict
+    :param sections: dict of section name to array or bytes
+    :param exclude: names of sections which are derived from the others
+        and do not need to be part of the hash
+    """
+    hasher = hashlib.md5(json.dumps(meta, sort_keys=True).encode())
+    for name, data in sections.items():
+        if name not in exclude:
+            hasher.update(name.encode())
+            hasher.update(_as_bytes(data)[0])
+    return hasher.hexdigest()
+
+
+def write(f, meta, sections):
+    """ Write metadata and sections to a binary file object
+
+    :param f: file opened for binary writing
+    :param meta: json serializable metadata dict
+    :param sections: dict of section name to array or bytes
+    """
+    layout = []
+    raw_sections = []
+    offset = 0
+    for name, data in sections.items():
+        raw, typecode = _as_bytes(data)
+        layout.append((name, typecode, offset, raw.nbytes))
+        raw_sections.append(raw)
+        offset += _aligned(raw.nbytes)
+
+    meta = dict(meta, byteorder=sys.byteorder, sections=layout)
+    meta_bytes = json.dumps(meta).encode()
+
+    f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(meta_bytes)))
+    f.write(meta_bytes)
+    f.write(bytes(_aligned(HEADER.size + len(meta_bytes)) -
+                  HEADER.size - len(meta_bytes)))
+    for raw in raw_sections:
+        f.write(raw)
+        f.write(bytes(_aligned(raw.nbytes) - raw.nbytes))
+
+
+def read_meta(buffer):
+    """ Read the metadata from the start of a binary file
+
+    :param buffer: bytes like object with (at least) the start of the file
+    :return: metadata dict, offset of the first section
+    """
+    if len(buffer) < HEADER.size:
+        raise BinaryFormatError('File is too short for a pycel binary file')
+
+    magic, version, meta_size = HEADER.unpack_from(buffer)
+    if magic != MAGIC:
+        raise BinaryFormatError('Not a pycel binary file')
+    if version != FORMAT_VERSION:
+        raise BinaryFormatError(
+            f'Unsupported pycel binary file version: {version}, '
+            f'expected: {FORMAT_VERSION}')
+
+    meta = json.loads(bytes(buffer[HEADER.size:HEADER.size + meta_size]))
+    if meta['byteorder'] != sys.byteorder:
+        raise BinaryFormatError(
+            f"Binary file is {meta['byteorder']} endian, "
+            f"this machine is {sys.byteorder} endian")
+    return meta, _aligned(HEADER.size + meta_size)
+
+
+def read(buffer):
+    """ Read the metadata and the sections from a binary file
+
+    The sections are views on the buffer and are not copied.
+
+    :param buffer: bytes like object with the entire file
+    :return: metadata dict, dict of section name to memoryview
+    """
+    meta, start = read_meta(buffer)
+    view = memoryview(buffer)
+    sections = {
+        name: view[start + offset:start + offset + size].cast(typecode)
+        for name, typecode, offset, size in meta['sections']
+    }
+    return meta, sections
+
+
+def read_header(filename):
+    """ Read only the metadata from a binary file, or None if not readable """
+    try:
+        with open(filename, 'rb') as f:
+            header = f.read(HEADER.size)
+            if len(header) == HEADER.size:
+                header += f.read(HEADER.unpack(header)[2])
+        return read_meta(header)[0]
+    except (OSError, BinaryFormatError, struct.error, ValueError):
+        return None
+
+
+class StringTable:
+    """ Collect unique strings, saved as one utf-8 section and their offsets
+
+    The strings are delimited by their offsets, not by a separator, so any
+    string, including ones with nul, can be saved.  Lone surrogates are
+    saved with ``surrogatepass``.
+    """
+
+    def __init__(self):
+        self.strings = {}
+
+    def __len__(self):
+        return len(self.strings)
+
+    def add(self, string):
+        """ Return the index of the string, adding it if needed """
+        index = self.strings.get(string)
+        if index is None:
+            index = self.strings[string] = len(self.strings)
+        return index
+
+    def sections(self):
+        """ The string table as byte and offset array sections """
+        encoded = tuple(s.encode('utf-8', 'surrogatepass') for s in self.strings)
+        offsets = array.array('Q', [0])
+        for string in encoded:
+            offsets.append(offsets[-1] + len(string))
+        return dict(
+            strings=b''.join(encoded),
+            string_offsets=offsets,
+        )
+
+    @staticmethod
+    def decode(strings, offsets):
+        """ Decode the entire string table section to a list of str """
+        strings = bytes(strings)
+        return [strings[start:end].decode('utf-8', 'surrogatepass')
+                for start, end in zip(offsets, offsets[1:])]
+
+
+class StringTableView(collections.abc.Sequence):
+    """ Sequence which decodes strings from the string table on access
+
+    :param strings: the strings section
+    :param offsets: the string_offsets section
+    :param size: limit the view to the first `size` strings
+    """
+
+    def __init__(self, strings, offsets, size=None):
+        self.strings = strings
+        self.offsets = offsets
+        self.size = len(offsets) - 1 if size is None else size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.size:
+            raise IndexError(f'string table index out of range: {index}')
+        return bytes(self.strings[self.offsets[index]:self.offsets[index + 1]]).decode(
+            'utf-8', 'surrogatepass')
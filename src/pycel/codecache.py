@@ -0,0 +1,152 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright 2011-2019 by Dirk Gorissen, Stephen Rauch and Contributors
+# All rights reserved.
+# This file is part of the Pycel Library, Licensed under GPLv3 (the 'License')
+# You may not use this work except in compliance with the License.
+# You may obtain a copy of the Licence at:
+#   https://www.gnu.org/licenses/gpl-3.0.en.html
+
+"""
+    Persistent on disk cache of compiled formula code
+
+    Compiling the python code of a formula is one of the slower steps of the
+    first evaluation of a cell.  Workbook versions tend to share most of their
+    formulas, so the marshalled code objects are saved in a directory with a
+    file per formula, named by a hash of the python code and of the pycel and
+    python versions.
+"""
+
+import hashlib
+import importlib.util
+import marshal
+import os
+import tempfile
+
+from pycel.version import __version__
+
+CACHE_FILE_SUFFIX = '.code'
+
+
+class CodeCache:
+    """ Content addressed directory of marshalled formula code
+
+    :param directory: where to keep the cache files, created if needed
+    :param max_size: maximum total size of the cache files in bytes.  When
+        exceeded, the least recently used files are removed.
+    """
+
+    def __init__(self, directory, max_size=2 ** 28):
+        self.directory = os.fspath(directory)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+        os.makedirs(self.directory, exist_ok=True)
+
+    def __repr__(self):
+        return f'CodeCache({self.directory!r})'
+
+    @staticmethod
+    def key(python_code):
+        """ The cache key for the python code of a formula
+
+        The filename and line number of the code are not part of the key,
+        so the same formula is found wherever it is loaded from.  They are
+        set on the code object after it is loaded from the cache.
+        """
+        hasher = hashlib.md5()
+        for part in (__version__, importlib.util.MAGIC_NUMBER.hex(), python_code):
+            hasher.update(part.encode('utf-8', 'surrogatepass'))
+            hasher.update(b'\0')
+        return hasher.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key[2:] + CACHE_FILE_SUFFIX)
+
+    def get(self, key):
+        """ The marshalled code and the needed names, or None if not cached """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                marshalled, names = marshal.load(f)
+            # mark as recently used
+            os.utime(path)
+        except (OSError, EOFError, ValueError, TypeError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return marshalled, set(names)
+
+    def __setitem__(self, key, value):
+        """ Save the marshalled code and the needed names
+
+        The file is written to a temporary name and then moved in place, so
+        several processes can share the cache directory.
+        """
+        marshalled, names = value
+        data = marshal.dumps((marshalled, tuple(sorted(names))))
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            replaced_size = os.path.getsize(path)
+        except OSError:
+            replaced_size = 0
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+        if self._size is not None:
+            self._size += len(data) - replaced_size
+        if self.size > self.max_size:
+            self.evict()
+
+    def _files(self):
+        """ (mtime, size, path) of each of the cache files """
+        for sub_dir in os.scandir(self.directory):
+            if sub_dir.is_dir():
+                for entry in os.scandir(sub_dir.path):
+                    if entry.name.endswith(CACHE_FILE_SUFFIX):
+                        try:
+                            stat = entry.stat()
+                        except FileNotFoundError:  # pragma: no cover
+                            continue
+                        yield stat.st_mtime, stat.st_size, entry.path
+
+    @property
+    def size(self):
+        """ Total size in bytes of the cache files """
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._files())
+        return self._size
+
+    def evict(self, max_size=None):
+        """ Remove the least recently used files
+
+        :param max_size: size to shrink to, defaults to 3/4 of `max_size`
+            so that the eviction is not needed on every write
+        """
+        if max_size is None:
+            max_size = self.max_size * 3 // 4
+        files = sorted(self._files())
+        size = sum(size for _, size, _ in files)
+        for _, file_size, path in files:
+            if size <= max_size:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:  # pragma: no cover
+                pass
+            size -= file_size
+        self._size = size
+
+    def clear(self):
+        """ Remove all of the cache files """
+        self.evict(max_size=0)
+        self.hits = self.misses = 0
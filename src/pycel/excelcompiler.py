@@ -7,22 +7,33 @@
 # You may obtain a copy of the Licence at:
 #   https://www.gnu.org/licenses/gpl-3.0.en.html
 
+import array
+import bisect
 import collections
+import contextlib
+import gc
 import hashlib
+import importlib.util
 import itertools as it
 import json
 import logging
 import math
+import mmap
 import os
 import pickle
+import threading
+from concurrent.futures import as_completed, ProcessPoolExecutor, ThreadPoolExecutor
 from numbers import Number
 
 import networkx as nx
 import numpy as np
 from ruamel.yaml import YAML
 
-from pycel.excelformula import ExcelFormula
+from pycel import binaryformat, montecarlo
+from pycel.codecache import CodeCache
+from pycel.excelformula import ExcelFormula, parse_cache
 from pycel.excelutil import (
+    address_cache,
     AddressCell,
     AddressRange,
     ERROR_CODES,
@@ -30,8 +41,16 @@ from pycel.excelutil import (
     is_address,
     iterative_eval_tracker,
     list_like,
+    uniqueify,
 )
-from pycel.excelwrapper import ExcelOpxWrapper, ExcelOpxWrapperNoData
+from pycel.excelwrapper import (
+    ExcelOpxWrapper,
+    ExcelOpxWrapperNoData,
+    ExcelStreamWrapper,
+    ExcelWrapper,
+)
+from pycel.profiler import EvalStats, Profiler
+from pycel.tracing import LoggingTracer
 
 REF_START = '=_REF_("'
 REF_END = '")'
@@ -39,24 +58,49 @@ REF_FORMAT = REF_START + '{}' + REF_END
 
 Mismatch = collections.namedtuple('Mismatch', 'original calced formula')
 
+# cell kinds and value types in the binary file format
+BINARY_IS_RANGE = 1
+BINARY_IS_NODE = 2
+(BINARY_NONE, BINARY_FALSE, BINARY_TRUE, BINARY_INT, BINARY_FLOAT,
+ BINARY_STR, BINARY_OTHER) = range(7)
+BINARY_INT_RANGE = (-2 ** 63, 2 ** 63)
+
 pycel_logger = logging.getLogger('pycel')
 
 
+class _ValueContextState(threading.local):
+    # the `ValueContext` evaluating in this thread
+    context = None
+
+
+_value_context = _ValueContextState()
+
+
 class ExcelCompiler:
     """Class responsible for taking an Excel spreadsheet and compiling it
     to an instance that can be serialized to disk, and executed
     independently of excel.
     """
 
-    save_file_extensions = ('pkl', 'pickle', 'yml', 'yaml', 'json')
+    save_file_extensions = ('pkl', 'pickle', 'yml', 'yaml', 'json', 'pycel')
+    binary_file_extensions = ('pycel', )
+    pickle_file_extensions = ('pkl', 'pickle')
+
+    # called with (cells connected, cells queued) while building the graph
+    graph_progress = None
 
-    def __init__(self, filename=None, excel=None, plugins=None, cycles=None):
+    _profiler = None
+
+    def __init__(self, filename=None, excel=None, plugins=None, cycles=None,
+                 code_cache=None):
         """ Build a compiler instance to organize the formula for a workbook
 
         :param filename: Excel filename to load from (xlsx or `to_file`)
         :param excel: Opened instance of ExcelWrapper or openpyxl workbook
         :param plugins: module paths for plugin lib functions
         :param cycles: Override workbook iterative calculation settings
+        :param code_cache: directory or `codecache.CodeCache` to share
+            compiled formula code between workbooks and processes
         """
 
         self._eval = None
@@ -77,9 +121,11 @@ class ExcelCompiler:
         self._excel_file_md5_digest = self._compute_excel_file_md5_digest
 
         self.log = pycel_logger
+        self._tracer = LoggingTracer(self.log)
 
         # directed graph for cell dependencies
         self.dep_graph = nx.DiGraph()
+        self._graph_lock = threading.RLock()
 
         # cell address to Cell mapping, cells and ranges already built
         self.cell_map = {}
@@ -92,6 +138,8 @@ class ExcelCompiler:
         self.conditional_formats = {}
         self._formula_cells_dict = {}
         self._plugin_modules = plugins
+        self.code_cache = code_cache
+        self._stats = EvalStats(self._stats_caches)
 
         # Setup to be able to evaluate circular references
         self.cycles = cycles
@@ -124,7 +172,8 @@ class ExcelCompiler:
         # code objects are not serializable
         state = dict(self.__dict__)
         to_removes = '_eval excel log graph_todos range_todos ' \
-                     'conditional_formats'.split()
+                     'conditional_formats _code_cache graph_progress _profiler ' \
+                     '_stats _tracer _graph_lock'.split()
         for to_remove in to_removes:
             if to_remove in state:    # pragma: no branch
                 state[to_remove] = None
@@ -133,6 +182,112 @@ class ExcelCompiler:
     def __setstate__(self, d):
         self.__dict__.update(d)
         self.log = pycel_logger
+        self._tracer = LoggingTracer(self.log)
+        self._code_cache = None
+        self._graph_lock = threading.RLock()
+        self._stats = EvalStats(self._stats_caches)
+
+    @property
+    def code_cache(self):
+        """ `codecache.CodeCache` for the compiled formula code, or None """
+        return self._code_cache
+
+    @code_cache.setter
+    def code_cache(self, code_cache):
+        if code_cache is not None and not isinstance(code_cache, CodeCache):
+            code_cache = CodeCache(code_cache)
+        self._code_cache = code_cache
+        self._eval = None
+
+    @property
+    def profiler(self):
+        """ `profiler.Profiler` recording the cell evaluations, or None """
+        return self._profiler
+
+    @profiler.setter
+    def profiler(self, profiler):
+        """ Turn on per cell profiling with True or a `profiler.Profiler` """
+        if profiler is True:
+            profiler = Profiler()
+        self._profiler = profiler or None
+        self._reload_lambdas()
+
+    @property
+    def count_function_calls(self):
+        """ Count the calls per library function in `stats()`
+
+        Off by default, since every library function call then goes through
+        a counting wrapper.  `stats_context()` turns it on while it is open.
+        """
+        return self._stats.count_functions
+
+    @count_function_calls.setter
+    def count_function_calls(self, count_function_calls):
+        if bool(count_function_calls) != self._stats.count_functions:
+            self._stats.count_functions = bool(count_function_calls)
+            self._reload_lambdas()
+
+    def _reload_lambdas(self):
+        """ Reload the formulas to add or remove the library function wrappers """
+        self._eval = None
+        for cell in self.cell_map.values():
+            if cell.formula is not None:
+                cell.formula.compiled_lambda = None
+
+    @property
+    def tracer(self):
+        """ `tracing.Tracer` called while evaluating, or None for no tracing
+
+        Defaults to a `tracing.LoggingTracer` of the pycel logger
+        """
+        return self._tracer
+
+    @tracer.setter
+    def tracer(self, tracer):
+        self._tracer = tracer
+        self._eval = None
+
+    def stats(self):
+        """ Counters of the evaluation work since the last reset
+
+        :return: dict of the number of cells evaluated, ranges evaluated,
+            calls to build the graph during evaluation, lambdas compiled,
+            calls per library function (see `count_function_calls`),
+            iterations per evaluation with cycles and the hits and misses
+            of the caches
+        """
+        return self._stats.as_dict()
+
+    def reset_stats(self):
+        """ Zero the evaluation counters """
+        self._stats.reset()
+
+    @contextlib.contextmanager
+    def stats_context(self, count_function_calls=True):
+        """ Zero the evaluation counters, and yield the `profiler.EvalStats`
+
+        Used like:
+
+            with excel_compiler.stats_context() as stats:
+                excel_compiler.evaluate('Sheet1!A1')
+            print(stats.as_dict())
+
+        :param count_function_calls: count the calls per library function
+            while the context is open
+        """
+        previous = self.count_function_calls
+        self.count_function_calls = count_function_calls
+        self._stats.reset()
+        try:
+            yield self._stats
+        finally:
+            self.count_function_calls = previous
+
+    def _stats_caches(self):
+        caches = dict(address_cache=address_cache, parse_cache=parse_cache)
+        if self._code_cache is not None:
+            caches['code_cache'] = self._code_cache
+        return caches
 
     @staticmethod
     def _compute_file_md5_digest(filename):
@@ -159,7 +314,9 @@ class ExcelCompiler:
         if self._eval is None:
             eval_ctx = ExcelFormula.build_eval_context(
                 self._evaluate, self._evaluate_range,
-                self.log, plugins=self._plugin_modules)
+                self.log, plugins=self._plugin_modules,
+                code_cache=self._code_cache, profiler=self._profiler,
+                stats=self._stats, tracer=self._tracer or False)
 
             if self.cycles:
                 def _eval(cell, cse_array_address=None):
@@ -172,6 +329,17 @@ class ExcelCompiler:
                     return eval_ctx(
                         cell.formula, cse_array_address=cse_array_address)
 
+            if self._profiler is not None:
+                profiler = self._profiler
+                eval_cell = _eval
+
+                def _eval(cell, cse_array_address=None):
+                    profiler.enter(cell.address.address)
+                    try:
+                        return eval_cell(cell, cse_array_address=cse_array_address)
+                    finally:
+                        profiler.exit()
+
             self._eval = _eval
 
         return self._eval
@@ -279,11 +447,296 @@ class ExcelCompiler:
         excel_compiler.excel = None
         return excel_compiler
 
+    def _to_binary(self, filename=None, binary=None):
+        """Serialize to a binary file, return True if the file changed
+
+        :param binary: (meta, sections) from `_binary_sections()`, if they
+            have already been built
+        """
+        if not filename:
+            filename = self.filename + '.pycel'
+        meta, sections = binary or self._binary_sections()
+
+        existing = binaryformat.read_header(filename)
+        if existing is not None and existing.get('content_hash') == meta['content_hash']:
+            return False
+
+        with open(filename, 'wb') as f:
+            binaryformat.write(f, meta, sections)
+        return True
+
+    def _binary_sections(self):
+        """The metadata and the typed array sections of the binary format"""
+        # every cell in the map and any (empty) cells they need, in sorted
+        # order so that an address can be found with a binary search
+        cells = dict(self.cell_map)
+        for cell in self.cell_map.values():
+            if isinstance(cell, _CellRange) or cell.formula:
+                for addr in cell.needed_addresses:
+                    if addr.address not in cells:
+                        cells[addr.address] = None
+        addresses = sorted(cells)
+        index = {address: i for i, address in enumerate(addresses)}
+
+        # the first strings in the table are the addresses, in order
+        strings = binaryformat.StringTable()
+        for address in addresses:
+            strings.add(address)
+
+        # cell addresses are saved pre-parsed, other addresses have col 0
+        address_sheets = array.array('I')
+        address_cols = array.array('I')
+        address_rows = array.array('I')
+        kinds = array.array('B')
+        formulas = array.array('i')
+        value_types = array.array('B')
+        value_ints = array.array('q')
+        value_floats = array.array('d')
+        edges = array.array('I')
+        code = bytearray()
+        code_offsets = array.array('Q', [0])
+        code_names = array.array('I')
+        code_name_offsets = array.array('I', [0])
+        others = []
+
+        for i, address in enumerate(addresses):
+            cell = cells[address]
+            is_range = isinstance(cell, _CellRange)
+
+            addr = AddressRange(address) if cell is None else cell.address
+            if addr.is_range:
+                address_sheets.append(0)
+                address_cols.append(0)
+                address_rows.append(0)
+            else:
+                address_sheets.append(strings.add(addr.sheet))
+                address_cols.append(addr.col_idx)
+                address_rows.append(addr.row)
+
+            has_formula = cell is not None and bool(cell.formula)
+            kinds.append(is_range * BINARY_IS_RANGE |
+                         (is_range or has_formula) * BINARY_IS_NODE)
+
+            if has_formula:
+                formulas.append(strings.add(cell.formula.python_code))
+                edges.extend(it.chain.from_iterable(
+                    (index[addr.address], i) for addr in cell.needed_addresses))
+                try:
+                    cell.formula.compiled_python
+                    marshalled, names = cell.formula._marshalled_python
+                except Exception:
+                    # this will be reported if and when it is evaluated
+                    marshalled, names = b'', ()
+                code.extend(marshalled)
+                code_names.extend(strings.add(name) for name in sorted(names))
+            else:
+                formulas.append(-1)
+                if is_range:
+                    edges.extend(it.chain.from_iterable(
+                        (index[addr.address], i) for addr in cell.needed_addresses))
+            code_offsets.append(len(code))
+            code_name_offsets.append(len(code_names))
+
+            # formulas and ranges are saved without values, so need calcs
+            value = None if cell is None or is_range or has_formula else cell.value
+            value_int, value_float = 0, 0.0
+            if value is None:
+                value_type = BINARY_NONE
+            elif isinstance(value, bool):
+                value_type = BINARY_TRUE if value else BINARY_FALSE
+            elif isinstance(value, int) and (
+                    BINARY_INT_RANGE[0] <= value < BINARY_INT_RANGE[1]):
+                value_type, value_int = BINARY_INT, value
+            elif isinstance(value, float):
+                value_type, value_float = BINARY_FLOAT, value
+            elif isinstance(value, str):
+                value_type, value_int = BINARY_STR, strings.add(value)
+            else:
+                value_type, value_int = BINARY_OTHER, len(others)
+                others.append(value)
+            value_types.append(value_type)
+            value_ints.append(value_int)
+            value_floats.append(value_float)
+
+        meta = dict(
+            cell_count=len(addresses),
+            cycles=self.cycles,
+            excel_hash=self._excel_file_md5_digest,
+            # serialize the workbook filename (not the serialization path)
+            filename=self.filename,
+        )
+        sections = dict(
+            strings.sections(),
+            address_sheets=address_sheets,
+            address_cols=address_cols,
+            address_rows=address_rows,
+            kinds=kinds,
+            formulas=formulas,
+            value_types=value_types,
+            value_ints=value_ints,
+            value_floats=value_floats,
+            others=pickle.dumps(others),
+            extra_data=pickle.dumps(self.extra_data),
+            edges=edges,
+            code=code,
+            code_offsets=code_offsets,
+            code_names=code_names,
+            code_name_offsets=code_name_offsets,
+        )
+
+        # the marshalled code is derived from the python code
+        meta['content_hash'] = binaryformat.content_hash(
+            meta, sections, exclude=('code', 'code_offsets'))
+        meta['python_magic'] = importlib.util.MAGIC_NUMBER.hex()
+        return meta, sections
+
+    def _to_pickle(self, filename, binary=None):
+        """Serialize to a pickle file, return True if the file changed
+
+        The pickle is a small header dict with the content hash, followed by
+        a clean copy of the compiler, which is built from the binary format
+        sections, so that no evaluation state or excel references are saved.
+
+        :param binary: (meta, sections) from `_binary_sections()`, if they
+            have already been built
+        """
+        meta, sections = binary or self._binary_sections()
+
+        if self._read_pickle_header(filename).get('content_hash') == meta['content_hash']:
+            return False
+
+        # like a load from text, the formulas are compiled on first use
+        excel_compiler = self._from_binary_sections(
+            self.filename, dict(meta, python_magic=None), sections)
+        with open(filename, 'wb') as f:
+            pickle.dump(dict(content_hash=meta['content_hash']), f)
+            pickle.dump(excel_compiler, f)
+        return True
+
+    @staticmethod
+    def _read_pickle_header(filename):
+        """The header dict of a pickle file, empty if none or not readable"""
+        try:
+            with open(filename, 'rb') as f:
+                header = pickle.load(f)
+        except Exception:
+            return {}
+        return header if isinstance(header, dict) else {}
+
+    @classmethod
+    def _from_pickle(cls, filename):
+        """deserialize from a pickle file, with or without a header"""
+        with open(filename, 'rb') as f:
+            excel_compiler = pickle.load(f)
+            if isinstance(excel_compiler, dict):
+                excel_compiler = pickle.load(f)
+        return excel_compiler
+
+    @classmethod
+    def _from_binary(cls, filename, lazy=False):
+        """deserialize from a binary file
+
+        :param lazy: memory map the file and only build the cells that an
+            evaluation reaches, instead of reading and building all of them
+        """
+        with open(filename, 'rb') as f:
+            if lazy:
+                meta, sections = binaryformat.read(
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            else:
+                meta, sections = binaryformat.read(f.read())
+        return cls._from_binary_sections(filename, meta, sections, lazy=lazy)
+
+    @classmethod
+    def _from_binary_sections(cls, filename, meta, sections, lazy=False):
+        """build a compiler from binary format metadata and sections"""
+        if lazy:
+            excel = _BinaryImporter(filename, meta, sections)
+        else:
+            excel = _CompiledImporter(filename, dict(filename=meta['filename'], cell_map={}))
+        excel_compiler = cls(excel=excel, cycles=meta['cycles'])
+        excel.compiler = excel_compiler
+        excel_compiler._excel_file_md5_digest = meta['excel_hash']
+        excel_compiler.extra_data = pickle.loads(sections['extra_data'])
+        if lazy:
+            return excel_compiler
+
+        strings = binaryformat.StringTable.decode(
+            sections['strings'], sections['string_offsets'])
+
+        # no garbage can be made while bulk building, so skip collections
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            excel_compiler._load_binary_cells(meta, sections, strings)
+        finally:
+            if gc_enabled:  # pragma: no branch
+                gc.enable()
+
+        # remove "excel" file references for GC
+        excel_compiler.excel = None
+        return excel_compiler
+
+    def _load_binary_cells(self, meta, sections, strings):
+        """Build the cell map and the dependency graph from binary sections"""
+        excel = self.excel
+        others = pickle.loads(sections['others'])
+        code_is_usable = meta['python_magic'] == importlib.util.MAGIC_NUMBER.hex()
+        code, code_offsets = sections['code'], sections['code_offsets']
+        code_names = sections['code_names']
+        code_name_offsets = sections['code_name_offsets']
+        value_ints, value_floats = sections['value_ints'], sections['value_floats']
+        make_cell = self.Cell
+        constants = {BINARY_NONE: None, BINARY_FALSE: False, BINARY_TRUE: True}
+
+        cells = []
+        for i, (address, sheet, col_idx, row, kind, formula, value_type) in enumerate(zip(
+                strings[:meta['cell_count']], sections['address_sheets'],
+                sections['address_cols'], sections['address_rows'],
+                sections['kinds'], sections['formulas'], sections['value_types'])):
+            formula = formula >= 0 and '=' + strings[formula] or None
+            if col_idx:
+                sheet = strings[sheet]
+                address = AddressCell(address, sheet, col_idx, row,
+                                      address[len(sheet) + 1:] if sheet else address)
+
+            if kind & BINARY_IS_RANGE:
+                cell = _CellRange(ExcelOpxWrapper.RangeData(
+                    AddressRange(address), formula, None), excel=excel)
+            else:
+                if value_type in constants:
+                    value = constants[value_type]
+                elif value_type == BINARY_INT:
+                    value = value_ints[i]
+                elif value_type == BINARY_FLOAT:
+                    value = value_floats[i]
+                elif value_type == BINARY_STR:
+                    value = strings[value_ints[i]]
+                else:
+                    value = others[value_ints[i]]
+                cell = make_cell(address, value=value, formula=formula, excel=excel)
+
+            if formula and code_is_usable and code_offsets[i] != code_offsets[i + 1]:
+                cell.formula._marshalled_python = (
+                    bytes(code[code_offsets[i]:code_offsets[i + 1]]),
+                    {strings[n] for n in
+                     code_names[code_name_offsets[i]:code_name_offsets[i + 1]]})
+            cells.append(cell)
+
+        self.cell_map = dict(zip(strings[:meta['cell_count']], cells))
+        self.dep_graph.add_nodes_from(
+            (cell, dict(sheet=cell.sheet, label=cell.address.coordinate))
+            for cell, kind in zip(cells, sections['kinds']) if kind & BINARY_IS_NODE)
+        edges = sections['edges']
+        self.dep_graph.add_edges_from(
+            (cells[precedent], cells[dependant])
+            for precedent, dependant in zip(edges[::2], edges[1::2]))
+
     def to_file(self, filename=None, file_types=('pkl', 'yml')):
         """ Save the spreadsheet to a file so it can be loaded later w/o excel
 
         :param filename: filename to save as, defaults to xlsx_name + file_type
-        :param file_types: one or more of: pkl, pickle, yml, yaml, json
+        :param file_types: one or more of: pycel, pkl, pickle, yml, yaml, json
 
         If the filename has one of the expected extensions, then this
         parameter is ignored.
@@ -298,6 +751,14 @@ class ExcelCompiler:
         The pickle file format provides the benefits of:
             1. Much faster to load (5x to 10x)
             2. ...  (no #2, speed is the thing)
+
+        The pycel binary file format provides the benefits of:
+            1. Faster to load than pickle, the cells are read from a
+                handful of typed arrays and the compiled code is saved
+            2. Saved directly, without a round trip through the text format
+
+        The pickle and binary files are only rewritten when a hash of their
+        content changes.
         """
 
         filename = filename or self.filename
@@ -312,45 +773,54 @@ class ExcelCompiler:
         if unknown_types:
             raise ValueError(f"Unknown file types: {' '.join(unknown_types)}")
 
+        binary_extension = next((ft for ft in file_types
+                                 if ft in self.binary_file_extensions), None)
         pickle_extension = next((ft for ft in file_types
-                                 if ft.startswith('p')), None)
-        non_pickle_extension = next((ft for ft in file_types
-                                     if not ft.startswith('p')), None)
+                                 if ft in self.pickle_file_extensions), None)
+        non_pickle_extension = next((ft for ft in file_types if ft not in (
+            self.binary_file_extensions + self.pickle_file_extensions)), None)
         extra_extensions = tuple(ft for ft in file_types if ft not in (
-            pickle_extension, non_pickle_extension))
+            binary_extension, pickle_extension, non_pickle_extension))
 
         if extra_extensions:
             raise ValueError(
                 'Only allowed one pickle extension and one text extension. '
                 f'Extras: {extra_extensions}')
 
-        is_json = non_pickle_extension and non_pickle_extension[0] == 'j'
+        if non_pickle_extension:
+            text_name = filename
+            if not text_name.endswith(non_pickle_extension):
+                text_name += '.' + non_pickle_extension
+            self._to_text(text_name, is_json=non_pickle_extension[0] == 'j')
+
+        # pycel and pickle files are both saved from the binary sections
+        binary = None
+        if binary_extension or pickle_extension:
+            binary = self._binary_sections()
 
-        # round trip through yaml/json to strip out junk
-        text_name = filename
-        if not text_name.endswith(non_pickle_extension or '.yml'):
-            text_name += '.' + (non_pickle_extension or 'yml')
-        text_changed = self._to_text(text_name, is_json=is_json)
+        if binary_extension:
+            binary_name = filename
+            if not binary_name.endswith(binary_extension):
+                binary_name += '.' + binary_extension
+            self._to_binary(binary_name, binary=binary)
 
         # save pickle file if requested and has changed
         if pickle_extension:
             if not filename.endswith(pickle_extension):
                 filename += '.' + pickle_extension
-
-            if text_changed or not os.path.exists(filename):
-                excel_compiler = self._from_text(text_name, is_json=is_json)
-                if non_pickle_extension not in file_types:
-                    os.unlink(text_name)
-
-                with open(filename, 'wb') as f:
-                    pickle.dump(excel_compiler, f)
+            self._to_pickle(filename, binary=binary)
 
     @classmethod
-    def from_file(cls, filename, plugins=None):
+    def from_file(cls, filename, plugins=None, lazy=False, code_cache=None):
         """ Load the spreadsheet saved by `to_file`
 
         :param filename: filename to load from, can be xlsx_name
         :param plugins: module paths for plugin lib functions
+        :param code_cache: directory or `codecache.CodeCache` to share
+            compiled formula code between workbooks and processes
+        :param lazy: for pycel binary files, memory map the file and only
+            build cells when an evaluation needs them.  Processes which
+            load the same file share its pages via the OS page cache.
         """
 
         extension = cls._filename_has_extension(filename) or next(
@@ -363,21 +833,27 @@ class ExcelCompiler:
         if not filename.endswith(extension):
             filename += '.' + extension
 
-        if extension[0] == 'p':
-            with open(filename, 'rb') as f:
-                excel_compiler = pickle.load(f)
+        if lazy and extension not in cls.binary_file_extensions:
+            raise ValueError(f"Lazy loading needs a binary file, not '{extension}'")
+
+        if extension in cls.binary_file_extensions:
+            excel_compiler = cls._from_binary(filename, lazy=lazy)
+        elif extension in cls.pickle_file_extensions:
+            excel_compiler = cls._from_pickle(filename)
         else:
             excel_compiler = cls._from_text(
                 filename, is_json=extension == 'json')
 
-        excel_compiler.excel = _CompiledImporter('', {
-            'filename': excel_compiler.filename,
-            'cell_map': excel_compiler.cell_map,
-        })
+        if excel_compiler.excel is None:
+            excel_compiler.excel = _CompiledImporter('', {
+                'filename': excel_compiler.filename,
+                'cell_map': excel_compiler.cell_map,
+            })
         excel_compiler.range_todos = []
         excel_compiler.graph_todos = []
 
         excel_compiler._plugin_modules = plugins
+        excel_compiler.code_cache = code_cache
         return excel_compiler
 
     def export_to_dot(self, filename=None):
@@ -419,7 +895,20 @@ class ExcelCompiler:
         :param set_as_range: With a single range address and a list like value,
             set to true to set the entire range to the inserted list.
         """
+        for cell_or_range, value in self._cells_to_set(address, value, set_as_range):
+            if cell_or_range.value != value:  # pragma: no branch
+                # need to be able to 'set' an empty cell, set to not None
+                cell_or_range.value = value
+
+                # reset the node + its dependencies
+                if not self.cycles:
+                    self._reset(cell_or_range)
 
+                # set the value
+                cell_or_range.value = value
+
+    def _cells_to_set(self, address, value, set_as_range):
+        """ The (cell or range, value) pairs to set for `set_value()` """
         if list_like(value) and not set_as_range:
             value = tuple(flatten(value))
             if list_like(address):
@@ -429,7 +918,7 @@ class ExcelCompiler:
             address = tuple(address)
             assert len(address) == len(value)
             for addr, val in zip(address, value):
-                self.set_value(addr, val)
+                yield from self._cells_to_set(addr, val, False)
             return
 
         elif address not in self.cell_map:
@@ -442,18 +931,7 @@ class ExcelCompiler:
                 value and list_like(value[0])):
             value = (value, )
 
-        cell_or_range = self.cell_map[address]
-
-        if cell_or_range.value != value:  # pragma: no branch
-            # need to be able to 'set' an empty cell, set to not None
-            cell_or_range.value = value
-
-            # reset the node + its dependencies
-            if not self.cycles:
-                self._reset(cell_or_range)
-
-            # set the value
-            cell_or_range.value = value
+        yield self.cell_map[address], value
 
     def _reset(self, cell):
         if cell.needs_calc:
@@ -466,6 +944,48 @@ class ExcelCompiler:
                 if child_cell.value is not None:
                     self._reset(child_cell)
 
+    def _precedents(self, node):
+        """ The nodes of the cell map which a cell or range reads directly
+
+        Unlike the dependency graph this includes the bounded range read by
+        an unbounded range.
+        """
+        if isinstance(node, _CellRange) and node.formula is None:
+            addresses = (addr.address for addr in node)
+        elif node.formula is None or not node.formula.base_formula:
+            addresses = ()
+        elif node.formula.base_formula.startswith(REF_START):
+            addresses = (node.formula.base_formula[len(REF_START):-len(REF_END)], )
+        else:
+            addresses = (addr.address for addr in node.needed_addresses)
+        cell_map = self.cell_map
+        return tuple(cell_map[address] for address in addresses if address in cell_map)
+
+    def value_context(self):
+        """ A `ValueContext` to set and evaluate values without changing this compiler
+
+        Many threads can each evaluate their own inputs in their own
+        context, while sharing the formulas of this compiler.
+        """
+        if self.cycles:
+            raise NotImplementedError(
+                'Value contexts for workbooks with iterative calculation')
+        return ValueContext(self)
+
+    def simulate(self, distributions, outputs, n, seed=None, chunk_size=10000,
+                 percentiles=(5, 50, 95)):
+        """ Monte Carlo simulation of outputs, for n samples of some inputs
+
+        The formulas which depend on the inputs are evaluated with numpy on
+        arrays of the samples where possible, see `montecarlo.simulate()`
+        for the parameters.
+
+        :return: a `montecarlo.Simulation` with the samples, the values of
+            the outputs and their summary statistics
+        """
+        return montecarlo.simulate(self, distributions, outputs, n, seed=seed,
+                                   chunk_size=chunk_size, percentiles=percentiles)
+
     def value_tree_str(self, address, indent=0):
         iterative_eval_tracker.inc_iteration_number()
         yield from self._value_tree_str(address)
@@ -484,14 +1004,297 @@ class ExcelCompiler:
                 yield from self._value_tree_str(
                     children.address.address, indent + 1)
 
-    def recalculate(self):
-        """Recalculate all of the known cells"""
+    def recalculate(self, workers=None, executor='process', chunk_size=1000):
+        """Recalculate all of the known cells
+
+        With `workers` the cells are evaluated one topological level of the
+        dependency graph at a time, since the cells in a level only depend on
+        cells in earlier levels.  The levels with more than `chunk_size` cells
+        are split into chunks for the workers.  Workbooks with iterative
+        calculation are always recalculated in this process.
+
+        :param workers: number of workers, None or 1 to recalculate in this
+            process
+        :param executor: 'process' to evaluate in a pool of processes, which
+            are sent the cells of each chunk and the values of their
+            precedents, or 'thread' for a pool of threads sharing this
+            compiler, which is better when the formulas mostly run in numpy.
+            The processes do not have the workbook, so the formulas which
+            use `INDIRECT()` or `OFFSET()` are evaluated in this process.
+        :param chunk_size: number of cells to send to a worker at a time
+        """
         for cell in self.cell_map.values():
             if isinstance(cell, _CellRange) or cell.formula:
                 cell.value = None
 
+        if (workers or 1) <= 1 or self.cycles:
+            for cell in self.cell_map.values():
+                self.evaluate(cell.address.address)
+            return
+
+        if executor == 'process':
+            pool = ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_recalc_worker,
+                initargs=(self._recalc_worker_compiler(),
+                          self._code_cache and self._code_cache.directory))
+        elif executor == 'thread':
+            pool = ThreadPoolExecutor(max_workers=workers)
+        else:
+            raise ValueError(f'Unknown executor: {executor}')
+
+        with pool:
+            for level in self._recalc_levels():
+                if len(level) <= chunk_size:
+                    for cell in level:
+                        self._evaluate(cell.address.address)
+                    continue
+
+                if executor == 'thread':
+                    chunks = (tuple(cell.address.address for cell in level[i:i + chunk_size])
+                              for i in range(0, len(level), chunk_size))
+                    tuple(pool.map(self._evaluate_cells, chunks))
+                    continue
+
+                # ranges without formulas only gather values, and references
+                # can need cells built from the workbook, so do them here
+                cells = []
+                for cell in level:
+                    if isinstance(cell, _CellRange) and cell.formula is None:
+                        self._evaluate_range(cell.address.address)
+                    elif _has_reference_function(cell):
+                        self._evaluate(cell.address.address)
+                    else:
+                        cells.append(cell)
+
+                chunks = tuple(cells[i:i + chunk_size] for i in range(0, len(cells), chunk_size))
+                items = (self._recalc_chunk_item(chunk) for chunk in chunks)
+                for chunk, values in zip(chunks, pool.map(_recalc_cells, items)):
+                    for cell, value in zip(chunk, values):
+                        cell.value = value
+
+    def _recalc_levels(self):
+        """ The cells needing calculation, in topological levels """
+        graph = self.dep_graph
+        precedent_counts = dict.fromkeys(
+            cell for cell in self.cell_map.values() if cell.needs_calc)
+        for cell in precedent_counts:
+            precedent_counts[cell] = sum(
+                precedent in precedent_counts for precedent in graph.pred[cell]
+            ) if cell in graph else 0
+
+        levels = []
+        level = [cell for cell, count in precedent_counts.items() if count == 0]
+        while level:
+            levels.append(level)
+            next_level = []
+            for cell in level:
+                for dependant in graph.succ[cell] if cell in graph else ():
+                    if dependant in precedent_counts:
+                        precedent_counts[dependant] -= 1
+                        if precedent_counts[dependant] == 0:
+                            next_level.append(dependant)
+            level = next_level
+        return levels
+
+    def _evaluate_cells(self, addresses):
+        for address in addresses:
+            self._evaluate(address)
+
+    def _recalc_worker_compiler(self):
+        """ Copy of this compiler without its cells or workbook, for workers """
+        state = self.__getstate__()
+        state.update(cell_map={}, dep_graph=nx.DiGraph(), excel=None,
+                     _formula_cells_dict={})
+        worker_compiler = ExcelCompiler.__new__(ExcelCompiler)
+        worker_compiler.__setstate__(state)
+        return worker_compiler
+
+    def _recalc_chunk_item(self, chunk):
+        """ The cells of a chunk, and their precedents with only their values """
+        nodes = {}
+        for cell in chunk:
+            for precedent in self.dep_graph.predecessors(cell):
+                nodes[precedent.address.address] = _Cell(
+                    precedent.address, value=precedent.value)
+        nodes.update((cell.address.address, cell) for cell in chunk)
+        return nodes, tuple(cell.address.address for cell in chunk)
+
+    def compile_all(self, workers=None, chunk_size=1000):
+        """ Build and compile all of the formula cells in the workbook
+
+        Generating the python code for a formula and compiling it does not
+        depend on any other formula, so with `workers` this is done in a pool
+        of processes, and the main process only builds the cells and the
+        dependency graph.
+
+        :param workers: number of worker processes, None or 1 to compile in
+            this process
+        :param chunk_size: number of formulas to send to a worker at a time
+        """
+        addresses = ()
+        if hasattr(self.excel, 'workbook'):
+            addresses = tuple(addr for addr in self.formula_cells()
+                              if addr.address not in self.cell_map)
+
+        if (workers or 1) > 1:
+            formulas = tuple(self.excel.get_range(addr).formula for addr in addresses)
+            cells = tuple(cell for cell in self.cell_map.values() if cell.formula and (
+                cell.formula._marshalled_python is None and
+                cell.formula._compiled_python is None))
+            items = tuple(it.chain(
+                ((addr.address, formula, False, '', 1)
+                 for addr, formula in zip(addresses, formulas)),
+                ((cell.address.address, '=' + cell.python_code, True,
+                  cell.formula.filename, cell.formula.lineno) for cell in cells),
+            ))
+            chunks = (items[i:i + chunk_size] for i in range(0, len(items), chunk_size))
+
+            with ProcessPoolExecutor(
+                    max_workers=workers, initializer=_init_compile_worker,
+                    initargs=(_CompileContext(self.excel), )) as executor:
+                results = tuple(it.chain.from_iterable(
+                    executor.map(_compile_formulas, chunks)))
+
+            for cell, result in zip(cells, results[len(addresses):]):
+                if result is not None:
+                    cell.formula._marshalled_python = result[1]
+
+            compiled = {
+                addr.address: (formula, result) for addr, formula, result in zip(
+                    addresses, formulas, results) if result is not None}
+        else:
+            compiled = None
+
+        self._gen_graph(addresses, compiled=compiled)
+
+        # anything not compiled above
         for cell in self.cell_map.values():
-            self.evaluate(cell.address.address)
+            if cell.formula and cell.formula._marshalled_python is None:
+                try:
+                    cell.formula.compiled_python
+                except Exception:
+                    # this will be reported if and when it is evaluated
+                    pass
+
+    def refresh(self, filename=None, excel=None):
+        """ Update the compiled cells from a new version of the workbook
+
+        Each cell in the cell map is compared with the new workbook.  Cells
+        with a changed constant are given the new value.  Cells with a
+        changed formula are rebuilt, along with their edges in the
+        dependency graph.  The cells which depend on a changed cell are
+        reset, and all other cells keep their compiled code and values.
+
+        :param filename: new workbook filename, defaults to `self.filename`
+        :param excel: Opened instance of ExcelWrapper or openpyxl workbook,
+            instead of loading `filename`
+        :return: tuple of the addresses which changed
+        """
+        if excel is None:
+            excel_class = type(self.excel) if type(self.excel) in (
+                ExcelOpxWrapper, ExcelStreamWrapper) else ExcelOpxWrapper
+            excel = excel_class(filename or self.filename)
+            excel.load()
+        elif not isinstance(excel, ExcelOpxWrapper):
+            excel = ExcelOpxWrapperNoData(excel)
+
+        # find the changes before changing anything
+        new_values = {}
+        rebuilds = {}
+        for address, cell in self.cell_map.items():
+            if '.cf!' in address:
+                # conditional formats are rebuilt when next evaluated
+                rebuilds[address] = None
+                continue
+
+            if cell.sheet in excel.workbook:
+                data = excel.get_range(cell.address)
+            elif cell.address.is_range:
+                # the cells in the range, on a removed sheet, are now empty
+                continue
+            else:
+                data = ExcelWrapper.RangeData(cell.address, None, None)
+
+            if isinstance(cell, _CellRange):
+                formula = data.formula if isinstance(data.formula, str) else None
+                if formula and formula.startswith('={') and formula[-1] == '}':
+                    formula = '=' + formula[2:-1]
+            elif cell.address.is_range:
+                formula = data.address != cell.address and REF_FORMAT.format(data.address)
+            else:
+                formula = data.formula
+                if not (formula or cell.formula):
+                    if data.values != cell.value:
+                        new_values[address] = data.values
+                    continue
+
+            if not self._same_formula(cell, formula):
+                rebuilds[address] = data
+
+        self.excel = excel
+        self.filename = excel.filename
+        self._excel_file_md5_digest = self._compute_excel_file_md5_digest
+        self._formula_cells_dict = {}
+        for cell in self.cell_map.values():
+            if cell.excel is not None:
+                cell.excel = excel
+
+        changed = []
+        for address, value in new_values.items():
+            self.set_value(address, value)
+            changed.append(self.cell_map[address])
+
+        for address, data in rebuilds.items():
+            old_cell = self.cell_map.pop(address)
+            dependants = ()
+            if old_cell in self.dep_graph:
+                dependants = tuple(self.dep_graph.successors(old_cell))
+                self.dep_graph.remove_node(old_cell)
+            if data is None:
+                continue
+
+            address = AddressRange(address)
+            if address.is_range and data.address != address:
+                # reference to a bounded range, which is built if needed
+                self.cell_map[address.address] = self.Cell(
+                    address, formula=REF_FORMAT.format(data.address), excel=excel)
+                self._gen_graph(data.address, recursed=True)
+            elif address.sheet in excel.workbook:
+                self._make_cells(address)
+            else:
+                self.cell_map[address.address] = self.Cell(address, excel=excel)
+
+            new_cell = self.cell_map[address.address]
+            changed.append(new_cell)
+            for dependant in dependants:
+                self.dep_graph.add_edge(new_cell, dependant)
+                if not self.cycles:
+                    self._reset(dependant)
+
+        if self.cycles:
+            # `set_value()` and `_reset()` do not reset the cells of
+            # workbooks with cycles, so reset every cell which depends on a
+            # changed cell, as the dependants of a rebuilt cell would be
+            dependants = set()
+            for cell in changed:
+                if cell in self.dep_graph and cell not in dependants:
+                    dependants.update(nx.descendants(self.dep_graph, cell))
+            for cell in dependants:
+                cell.value = None
+
+        self._process_gen_graph()
+        return tuple(sorted(it.chain(new_values, rebuilds),
+                            key=lambda a: AddressRange(a).sort_key))
+
+    @staticmethod
+    def _same_formula(cell, formula):
+        """Is the cell's formula the same as the formula text from excel"""
+        if not cell.formula or not formula:
+            return not cell.formula and not formula
+        if cell.formula.base_formula is not None:
+            return cell.formula.base_formula == formula
+        # loaded from a file, so compare the generated python code
+        return cell.formula.python_code == ExcelFormula(formula, cell=cell).python_code
 
     def trim_graph(self, input_addrs, output_addrs):
         """Remove unneeded cells from the graph"""
@@ -591,7 +1394,8 @@ class ExcelCompiler:
         return failed
 
     def validate_calcs(self, output_addrs=None, sheet=None, verify_tree=True,
-                       tolerance=None, raise_exceptions=False):
+                       tolerance=None, raise_exceptions=False, workers=None,
+                       chunk_size=100, progress=None):
         """For each address, calc the value, and verify that it matches
 
         This is a debugging tool which will show which cells evaluate
@@ -600,24 +1404,45 @@ class ExcelCompiler:
         :param output_addrs: The cells to evaluate from (defaults to all)
         :param sheet: The sheet to evaluate from (defaults to all)
         :param verify_tree: Follow the tree to any precedent nodes
+        :param workers: number of worker processes, each loading its own
+            compiler from the workbook file, None or 1 to validate in this process
+        :param chunk_size: number of cells to send to a worker at a time
+        :param progress: called with (processed, remaining) as the cells are
+            validated, instead of printing the progress and mismatches.
+            With workers these count the cells sent to the workers, without
+            the precedents the workers follow.
         :return: dict of addresses with good/bad values that failed to verify
         """
+        verbose = progress is None
+        if verbose:
+            def progress(processed, remaining):
+                print(f"{remaining} formulas left to process")
+
         if output_addrs is None:
             to_verify = list(self.formula_cells(sheet))
-            print(f'Found {len(to_verify)} formulas to evaluate')
+            if verbose:
+                print(f'Found {len(to_verify)} formulas to evaluate')
         elif list_like(output_addrs):
             to_verify = [AddressCell(addr) for addr in flatten(output_addrs)]
         else:
             to_verify = [AddressCell(output_addrs)]
 
+        if (workers or 1) > 1:
+            return self._validate_calcs_parallel(
+                to_verify, workers, chunk_size, progress, verbose,
+                verify_tree=verify_tree, tolerance=tolerance,
+                raise_exceptions=raise_exceptions)
+
         verified = set()
         failed = {}
         if self.cycles:
             iterative_eval_tracker(**self.cycles)
+        processed = 0
         while to_verify:
             addr = to_verify.pop()
+            processed += 1
             if len(to_verify) % 100 == 0:
-                print(f"{len(to_verify)} formulas left to process")
+                progress(processed, len(to_verify))
             try:
                 self._gen_graph(addr)
                 cell = self.cell_map[addr.address]
@@ -636,9 +1461,10 @@ class ExcelCompiler:
                         failed.setdefault('mismatch', {})[str(addr)] = Mismatch(
                             original_value, cell.value,
                             cell.formula.base_formula)
-                        print('{} mismatch  {} -> {}  {}'.format(
-                            addr, original_value, cell.value,
-                            cell.formula.base_formula))
+                        if verbose:
+                            print('{} mismatch  {} -> {}  {}'.format(
+                                addr, original_value, cell.value,
+                                cell.formula.base_formula))
 
                         # do it again to allow easy break-pointing
                         cell.value = None
@@ -679,6 +1505,45 @@ class ExcelCompiler:
 
         return failed
 
+    def _validate_calcs_parallel(self, to_verify, workers, chunk_size, progress,
+                                 verbose, **kwargs):
+        """ `validate_calcs()` with the cells split across worker processes """
+        filename = getattr(self.excel, 'filename', None)
+        if isinstance(self.excel, (ExcelOpxWrapperNoData, _CompiledImporter)) or not (
+                filename and os.path.exists(filename)):
+            raise ValueError(
+                'Parallel validate_calcs needs a compiler loaded from a workbook file')
+
+        addresses = tuple(addr.address for addr in to_verify)
+        chunks = tuple(addresses[i:i + chunk_size]
+                       for i in range(0, len(addresses), chunk_size))
+        code_cache = self._code_cache and self._code_cache.directory
+
+        failed = {}
+        processed = 0
+        with ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_validate_worker,
+                initargs=(filename, self._plugin_modules, self.cycles, code_cache)) as pool:
+            futures = {pool.submit(_validate_chunk, (chunk, kwargs)): chunk
+                       for chunk in chunks}
+            for future in as_completed(futures):
+                chunk_failed = future.result()
+                for addr, mismatch in chunk_failed.pop('mismatch', {}).items():
+                    if addr not in failed.get('mismatch', {}):
+                        failed.setdefault('mismatch', {})[addr] = mismatch
+                        if verbose:
+                            print('{} mismatch  {} -> {}  {}'.format(addr, *mismatch))
+                for kind, reports_by_key in chunk_failed.items():
+                    for key, reports in reports_by_key.items():
+                        known = failed.setdefault(kind, {}).setdefault(key, [])
+                        known_addrs = {report[0] for report in known}
+                        known.extend(report for report in reports
+                                     if report[0] not in known_addrs)
+
+                processed += len(futures[future])
+                progress(processed, len(addresses) - processed)
+        return failed
+
     def formula_cells(self, sheet=None):
         """Iterate all cells and find cells with formulas"""
         if sheet is None:
@@ -688,20 +1553,20 @@ class ExcelCompiler:
 
         if sheet not in self._formula_cells_dict:
             if sheet in self.excel.workbook:
-                self._formula_cells_dict[sheet] = tuple(
-                    AddressCell.create(cell.coordinate, sheet)
-                    for row in self.excel.workbook[sheet].iter_rows()
-                    for cell in row
-                    if isinstance(getattr(cell, 'value', None), str) and
-                    cell.value.startswith('=')
-                )
+                self._formula_cells_dict[sheet] = self.excel.formula_addresses(sheet)
             else:
                 self._formula_cells_dict[sheet] = tuple()
 
         return self._formula_cells_dict[sheet]
 
-    def _make_cells(self, address):
-        """Given an AddressRange or AddressCell generate compiler Cells"""
+    def _make_cells(self, address, excel_data=None, compiled=None):
+        """Given an AddressRange or AddressCell generate compiler Cells
+
+        :param excel_data: the `ExcelWrapper.RangeData` for the address, if
+            it has already been fetched
+        :param compiled: dict of address to the formula text and the
+            compiled code from `compile_all()`
+        """
 
         # from here don't build cells that are already in the cell_map
         assert address.address not in self.cell_map
@@ -718,6 +1583,13 @@ class ExcelCompiler:
             a_cell = self.Cell(excel_cell.address, value=excel_cell.values,
                                formula=excel_cell.formula, excel=self.excel)
             self.cell_map[str(excel_cell.address)] = a_cell
+
+            # use the code from compile_all(), if it was for this formula
+            formula_code = compiled and compiled.get(a_cell.address.address)
+            if formula_code and a_cell.formula and (
+                    formula_code[0] == a_cell.formula.base_formula):
+                (a_cell.formula._python_code, a_cell.formula._marshalled_python,
+                 a_cell.formula._needed_addresses) = formula_code[1]
             return [a_cell]
 
         def build_range(excel_range):
@@ -734,11 +1606,12 @@ class ExcelCompiler:
             else:
                 for addr in a_range.needed_addresses:
                     if addr.address not in self.cell_map:
-                        self._make_cells(addr)
+                        self._make_cells(addr, compiled=compiled)
             return added
 
         self.log.debug(f'_make_cells: {address}')
-        excel_data = self.excel.get_range(address)
+        if excel_data is None:
+            excel_data = self.excel.get_range(address)
         if address.is_range:
             if excel_data.address != address:
                 # if the actual data returned is not the same as the address
@@ -757,47 +1630,63 @@ class ExcelCompiler:
                 # nodes to analyze: only ranges and formulas have precedents
                 add_node_to_graph(new_node)
 
+    def _build_missing(self, address):
+        """ Build a cell or range needed during evaluation """
+        self._stats.gen_graph_calls += 1
+        with self._graph_lock:
+            self._gen_graph(address)
+        return self.cell_map[address]
+
     def _evaluate_range(self, address):
         """Evaluate a range"""
         if address in ERROR_CODES:
             return address
 
+        context = _value_context.context
+        if context is not None and context.excel_compiler is self:
+            return context._evaluate_range(address)
+
         cell_range = self.cell_map.get(address)
         if cell_range is None:
             # we don't save the _CellRange values in the text format files
             assert '!' in address, f"{address} missing sheetname"
-            self._gen_graph(address)
-            cell_range = self.cell_map[address]
+            cell_range = self._build_missing(address)
 
         if cell_range.needs_calc:
-            self.log.debug(f"Evaluating: {cell_range.address}, {cell_range.python_code}")
-            if cell_range.address.is_unbounded_range:
-                bounded_addr = str(self.eval(cell_range))
-                bounded_addr_cell = self.cell_map.get(bounded_addr)
-                if bounded_addr_cell.value is None:
-                    self._evaluate_range(bounded_addr)
-                data = bounded_addr_cell.value
-
-            elif cell_range.formula is None:
-                data = tuple(
-                    tuple(self._evaluate(addr.address) for addr in row)
-                    for row in cell_range.addresses
-                )
-            else:
-                # CSE Array Formula
-                data = self.eval(cell_range, cell_range.address)
-            self.log.info(f"Range {cell_range.address} evaluated to '{data}'")
-
-            cell_range.value = data
-
+            cell_range.value = self._range_data(cell_range)
         return cell_range.value
 
+    def _range_data(self, cell_range):
+        """ Gather the values of a range """
+        self._stats.ranges_evaluated += 1
+        tracer = self._tracer
+        if tracer is not None:
+            tracer.range_start(cell_range)
+        if cell_range.address.is_unbounded_range:
+            data = self._evaluate_range(str(self.eval(cell_range)))
+
+        elif cell_range.formula is None:
+            data = tuple(
+                tuple(self._evaluate(addr.address) for addr in row)
+                for row in cell_range.addresses
+            )
+        else:
+            # CSE Array Formula
+            data = self.eval(cell_range, cell_range.address)
+        if tracer is not None:
+            tracer.range_end(cell_range, data)
+        return data
+
     def _evaluate(self, address):
         """Evaluate a single cell"""
-        if address not in self.cell_map:
+        context = _value_context.context
+        if context is not None and context.excel_compiler is self:
+            return context._evaluate(address)
+
+        cell = self.cell_map.get(address)
+        if cell is None:
             # INDIRECT() and OFFSET() can produce addresses we don't already have loaded
-            self._gen_graph(address)
-        cell = self.cell_map[address]
+            cell = self._build_missing(address)
 
         # calculate the cell value for formulas and ranges
         if cell.needs_calc:
@@ -805,33 +1694,39 @@ class ExcelCompiler:
                 self._evaluate_range(cell.address.address)
 
             elif cell.python_code:
-                self.log.debug(f"Evaluating: {address}, {cell.python_code}")
-                value = self.eval(cell)
-                if is_address(value):
-                    # eval produced an address (aka: a reference)
-                    if value.is_range:
-                        # complain as we are not going to do any spilling
-                        self.log.warning(f"Cell {address} evaluated to '{value}',"
-                                         f" truncating to '{value.start}'")
-                        value = value.start
-                    else:
-                        self.log.info(f"Cell {address} evaluated to address '{value}'")
-
-                    # fetch the value for this cell, if it exists
-                    ref_addr = value.address
-                    if ref_addr not in self.cell_map and getattr(self, 'excel', None):
-                        # INDIRECT() can produce addresses we don't already have loaded
-                        self._gen_graph(ref_addr)
-
-                    value = self.cell_map[ref_addr].value
-                else:
-                    self.log.info(
-                        f"Cell {cell.address} evaluated to '{value}' ({type(value).__name__})")
-                cell.value = (value[0][0] if list_like(value[0]) else value[0]
-                              ) if list_like(value) else value
+                cell.value = self._formula_value(cell)
 
         return cell.value
 
+    def _formula_value(self, cell):
+        """ Evaluate the formula of a cell """
+        self._stats.cells_evaluated += 1
+        tracer = self._tracer
+        if tracer is not None:
+            tracer.cell_start(cell)
+        value = self.eval(cell)
+        if tracer is not None:
+            tracer.cell_end(cell, value)
+        if is_address(value):
+            # eval produced an address (aka: a reference)
+            if value.is_range:
+                # complain as we are not going to do any spilling
+                self.log.warning(f"Cell {cell.address} evaluated to '{value}',"
+                                 f" truncating to '{value.start}'")
+                value = value.start
+
+            # fetch the value for this cell, if it exists
+            ref_addr = value.address
+            if ref_addr not in self.cell_map and getattr(self, 'excel', None):
+                # INDIRECT() can produce addresses we don't already have loaded
+                self._stats.gen_graph_calls += 1
+                with self._graph_lock:
+                    self._gen_graph(ref_addr)
+
+            value = self._evaluate(ref_addr)
+        return (value[0][0] if list_like(value[0]) else value[0]
+                ) if list_like(value) else value
+
     def _evaluate_non_iterative(self, address):
         """ evaluate a cell or cells in the spreadsheet
 
@@ -856,7 +1751,8 @@ class ExcelCompiler:
                     address, sheet=self.excel.get_active_sheet_name())
 
             if address.address not in self.cell_map:
-                self._gen_graph(address)
+                with self._graph_lock:
+                    self._gen_graph(address)
 
         result = self._evaluate(str(address))
         if isinstance(result, tuple):
@@ -891,56 +1787,104 @@ class ExcelCompiler:
             progress_tracker.inc_iteration_number()
             results = self._evaluate_non_iterative(address)
             if progress_tracker.done:
+                self._stats.cycle_iterations[progress_tracker.ns.iteration_number] += 1
                 return results
 
-    def _gen_graph(self, seed, recursed=False):
+    def _gen_graph(self, seed, recursed=False, compiled=None):
         """Given a starting point (e.g., A6, or A3:B7) on a particular sheet,
         generate a Spreadsheet instance that captures the logic and control
         flow of the equations.
-        """
-        if not is_address(seed):
-            if isinstance(seed, str):
-                seed = AddressRange(seed)
-            elif isinstance(seed, collections.abc.Iterable):
-                for s in seed:
-                    self._gen_graph(s, recursed=True)
-                self._process_gen_graph()
-                return
-            else:
-                raise ValueError(f'Unknown seed: {seed}')
 
-        # get/set the current sheet
-        if not seed.has_sheet:
-            seed = AddressRange(seed, sheet=self.excel.get_active_sheet_name())
+        :param seed: address, or iterable of addresses, to start from
+        :param recursed: if True, only build the cells for the seed and
+            leave connecting them to their precedents to the caller
+        :param compiled: dict of address to the formula text and the
+            compiled code from `compile_all()`
+        """
+        if is_address(seed) or isinstance(seed, str):
+            seeds = (seed, )
+        elif isinstance(seed, collections.abc.Iterable):
+            seeds = seed
+        else:
+            raise ValueError(f'Unknown seed: {seed}')
+
+        active_sheet = None
+        addresses = {}
+        for address in seeds:
+            if not is_address(address):
+                if isinstance(address, str):
+                    address = AddressRange(address)
+                else:
+                    raise ValueError(f'Unknown seed: {address}')
 
-        if '[' in seed.sheet:
-            raise NotImplementedError('Linked SheetNames')
+            # get/set the current sheet
+            if not address.has_sheet:
+                if active_sheet is None:
+                    active_sheet = self.excel.get_active_sheet_name()
+                address = AddressRange(address, sheet=active_sheet)
 
-        if seed.address in self.cell_map:
-            # already did this cell/range
-            return
+            # skip cells/ranges already done
+            if address.address not in self.cell_map:
+                addresses.setdefault(address.address, address)
 
-        # process the seed
-        self._make_cells(seed)
+        # process the seeds
+        self._make_missing_cells(addresses.values(), compiled)
 
-        if not recursed:
+        if not recursed and (addresses or seeds is seed):
             # if not entered to process one cell / cellrange process other work
-            self._process_gen_graph()
+            self._process_gen_graph(compiled)
 
-    def _process_gen_graph(self):
+    def _make_missing_cells(self, addresses, compiled=None):
+        """Generate compiler Cells for the addresses not in the cell map
 
+        The data for all of the addresses is fetched from the excel wrapper
+        in one call.
+
+        :param compiled: dict of address to the formula text and the
+            compiled code from `compile_all()`
+        """
+        addresses = tuple(addresses)
+        for address in addresses:
+            if '[' in address.sheet:
+                raise NotImplementedError('Linked SheetNames')
+
+        for address, excel_data in zip(addresses, self.excel.get_ranges(addresses)):
+            # building a range also builds its cells, so check again
+            if address.address not in self.cell_map:
+                self._make_cells(address, excel_data, compiled)
+
+    def _process_gen_graph(self, compiled=None):
+        """Connect the cells in `graph_todos` to their precedents
+
+        This is a breadth first worklist.  The missing precedents of all of
+        the queued cells are built together, which queues them in turn, and
+        then the edges to the queued cells are added to the graph together.
+
+        :param compiled: dict of address to the formula text and the
+            compiled code from `compile_all()`
+        """
+        connected = 0
         while self.graph_todos:
-            # connect the dependant cells in the graph
-            dependant = self.graph_todos.pop()
+            dependants, self.graph_todos = self.graph_todos, []
 
-            self.log.debug(f"Handling {dependant.address}")
+            missing = {}
+            for dependant in dependants:
+                for precedent_address in dependant.needed_addresses:
+                    if precedent_address.address not in self.cell_map:
+                        missing.setdefault(precedent_address.address, precedent_address)
+            if missing:
+                self._make_missing_cells(missing.values(), compiled)
 
-            for precedent_address in dependant.needed_addresses:
-                if precedent_address.address not in self.cell_map:
-                    self._gen_graph(precedent_address, recursed=True)
+            # connect the dependant cells in the graph
+            cell_map = self.cell_map
+            self.dep_graph.add_edges_from(
+                (cell_map[precedent_address.address], dependant)
+                for dependant in dependants
+                for precedent_address in dependant.needed_addresses)
 
-                self.dep_graph.add_edge(
-                    self.cell_map[precedent_address.address], dependant)
+            connected += len(dependants)
+            if self.graph_progress is not None:
+                self.graph_progress(connected, len(self.graph_todos))
 
         # calc the values for ranges
         try:
@@ -993,21 +1937,136 @@ class ExcelCompiler:
             phony_cell = _Cell(address)
             formats = self.excel.conditional_format(address)
             format_strs = []
+            needed_addresses = []
             for f in formats:
                 excel_formula = ExcelFormula(f.formula, cell=phony_cell)
                 python_code = excel_formula.python_code
                 format_strs.append(
                     f'({python_code}, {f.dxf_id}, {int(bool(f.stop_if_true))})')
+                needed_addresses.extend(excel_formula.needed_addresses)
                 self.conditional_formats[f.dxf_id] = f.dxf
 
             python_code = f"=conditional_format_ids({', '.join(format_strs)})"
             a_cell = _Cell(address, formula=python_code)
+            a_cell.formula._needed_addresses = uniqueify(needed_addresses)
             self.cell_map[cf_addr] = a_cell
             self._gen_graph(a_cell.formula.needed_addresses)
 
         return self.eval(self.cell_map[cf_addr])
 
 
+class ValueContext:
+    """ Values set and calculated over the values of an `ExcelCompiler`
+
+    The cells, formulas and dependency graph of the compiler are shared, and
+    each context keeps its own copy of only the values which differ.  The
+    values of the compiler should not be changed while contexts are in use,
+    and it is best to `evaluate()` the outputs with the compiler first so
+    that each context only has to calculate the cells changed by its inputs.
+
+    Used like:
+
+        context = excel_compiler.value_context()
+        context.set_value('Sheet1!A1', 5)
+        context.evaluate('Sheet1!B1')
+
+    :param excel_compiler: the `ExcelCompiler` to evaluate
+    """
+
+    # the value in `values` of the cells which need to be calculated, so
+    # that None can be set as the value of a cell
+    NEEDS_CALC = object()
+
+    def __init__(self, excel_compiler):
+        self.excel_compiler = excel_compiler
+
+        # address to value, or NEEDS_CALC for cells which need to be calculated
+        self.values = {}
+
+    def value(self, address):
+        """ The value of a cell or range in this context, without evaluating
+
+        :return: the value, `NEEDS_CALC` if the context needs to calculate
+            it, or None if the compiler needs to calculate it
+        """
+        if address in self.values:
+            return self.values[address]
+        return self.excel_compiler.cell_map[address].value
+
+    def _needs_calc(self, address):
+        if address in self.values:
+            return self.values[address] is self.NEEDS_CALC
+        return self.excel_compiler.cell_map[address].needs_calc
+
+    def set_value(self, address, value, set_as_range=False):
+        """ Set the value of one or more cells or ranges in this context
+
+        Takes the same parameters as `ExcelCompiler.set_value()`
+        """
+        values = self.values
+        excel_compiler = self.excel_compiler
+        for cell_or_range, value in excel_compiler._cells_to_set(
+                address, value, set_as_range):
+            address = cell_or_range.address.address
+            if address not in values or values[address] != value:  # pragma: no branch
+                values[address] = value
+
+                # the cells which depend on this cell need to be calculated
+                with excel_compiler._graph_lock:
+                    todo = list(excel_compiler.dep_graph.successors(cell_or_range)
+                                if cell_or_range in excel_compiler.dep_graph else ())
+                    while todo:
+                        cell = todo.pop()
+                        cell_address = cell.address.address
+                        if not self._needs_calc(cell_address):
+                            values[cell_address] = self.NEEDS_CALC
+                            todo.extend(excel_compiler.dep_graph.successors(cell))
+
+    def evaluate(self, address):
+        """ Evaluate cells or ranges in this context
+
+        Takes the same parameters as `ExcelCompiler.evaluate()`
+        """
+        state = _value_context
+        previous, state.context = state.context, self
+        try:
+            return self.excel_compiler._evaluate_non_iterative(address)
+        finally:
+            state.context = previous
+
+    def _evaluate_range(self, address):
+        value = self.values.get(address, self.NEEDS_CALC)
+        if value is self.NEEDS_CALC:
+            excel_compiler = self.excel_compiler
+            cell_range = excel_compiler.cell_map.get(address)
+            if cell_range is None:
+                assert '!' in address, f"{address} missing sheetname"
+                cell_range = excel_compiler._build_missing(address)
+
+            if address not in self.values and not cell_range.needs_calc:
+                return cell_range.value
+            value = self.values[address] = excel_compiler._range_data(cell_range)
+        return value
+
+    def _evaluate(self, address):
+        value = self.values.get(address, self.NEEDS_CALC)
+        if value is self.NEEDS_CALC:
+            excel_compiler = self.excel_compiler
+            cell = excel_compiler.cell_map.get(address)
+            if cell is None:
+                cell = excel_compiler._build_missing(address)
+
+            if address not in self.values and not cell.needs_calc:
+                return cell.value
+            if isinstance(cell, _CellRange) or cell.address.is_unbounded_range:
+                value = self._evaluate_range(address)
+            elif cell.python_code:
+                value = self.values[address] = excel_compiler._formula_value(cell)
+            else:
+                value = cell.value
+        return value
+
+
 class _CellBase:
 
     value = None
@@ -1019,10 +2078,12 @@ class _CellBase:
             formula, cell=self,
             formula_is_python_code=formula_is_python_code) or None
 
+        self.address = address if is_address(address) else AddressRange(address)
         if isinstance(excel, _CompiledImporter):
+            if self.formula:
+                excel.prepare_formula(self.formula, self.address)
             excel = None
         self.excel = excel
-        self.address = AddressRange(address)
 
     @property
     def sheet(self):
@@ -1182,6 +2243,110 @@ class _CycleCell(_Cell):
         return not self.wip and not iterative_eval_tracker.is_calced(self)
 
 
+class _CompileContext:
+    """Emulate the parts of the excel_wrapper used to generate python code
+
+    This can be pickled for worker processes.
+    """
+
+    def __init__(self, excel):
+        self.defined_names = getattr(excel, 'defined_names', None) or {}
+        self.tables = {}
+        self.table_refs = collections.defaultdict(list)
+        if getattr(excel, 'workbook', None) is not None:
+            for ws in excel.workbook:
+                for table in excel._worksheet_tables(ws):
+                    self.tables[table.name.lower()] = (table, ws.title)
+                    self.table_refs[ws.title].append(
+                        (AddressRange(table.ref), table.name.lower()))
+
+    def table(self, table_name):
+        return self.tables.get(table_name.lower(), (None, None))
+
+    def table_name_containing(self, address):
+        address = AddressCell(address)
+        return next((name for ref, name in self.table_refs.get(address.sheet, ())
+                     if address in ref), None)
+
+
+_compile_context = None
+
+
+def _init_compile_worker(context):
+    global _compile_context
+    _compile_context = context
+
+
+def _compile_formulas(items):
+    """ Generate and compile the python code for formulas, in a worker process
+
+    :param items: (address, formula, formula_is_python_code, filename, lineno)
+    :return: (python code, marshalled code, needed addresses) for each item,
+        None if it failed
+    """
+    results = []
+    for address, formula, formula_is_python_code, filename, lineno in items:
+        excel_formula = ExcelFormula(
+            formula, cell=_Cell(address, excel=_compile_context),
+            formula_is_python_code=formula_is_python_code)
+        excel_formula.filename = filename
+        excel_formula.lineno = lineno
+        try:
+            excel_formula.compiled_python
+            results.append((excel_formula.python_code, excel_formula._marshalled_python,
+                            excel_formula.needed_addresses))
+        except Exception:
+            # this will be reported if and when it is evaluated
+            results.append(None)
+    return results
+
+
+_validate_compiler = None
+
+
+def _init_validate_worker(filename, plugins, cycles, code_cache):
+    global _validate_compiler
+    _validate_compiler = ExcelCompiler(
+        filename=filename, plugins=plugins, cycles=cycles, code_cache=code_cache)
+
+
+def _validate_chunk(item):
+    """ Validate cells in a worker process, for `validate_calcs()`
+
+    :param item: (addresses to validate, validate_calcs keyword arguments)
+    :return: the failed dict of the addresses
+    """
+    addresses, kwargs = item
+    return _validate_compiler.validate_calcs(
+        addresses, progress=lambda processed, remaining: None, **kwargs)
+
+
+_recalc_compiler = None
+
+
+def _init_recalc_worker(excel_compiler, code_cache):
+    global _recalc_compiler
+    _recalc_compiler = excel_compiler
+    _recalc_compiler.code_cache = code_cache
+
+
+def _has_reference_function(cell):
+    """ Can the formula of the cell produce a reference to another cell """
+    python_code = cell.python_code or ''
+    return 'indirect(' in python_code or 'offset(' in python_code
+
+
+def _recalc_cells(item):
+    """ Evaluate cells in a worker process, for `recalculate()`
+
+    :param item: (cells and precedents by address, addresses to evaluate)
+    :return: the values of the addresses
+    """
+    nodes, addresses = item
+    _recalc_compiler.cell_map = nodes
+    return [_recalc_compiler._evaluate(address) for address in addresses]
+
+
 class _CompiledImporter:
     """Emulate the excel_wrapper for serialized files"""
     def __init__(self, filename, file_data):
@@ -1219,6 +2384,12 @@ class _CompiledImporter:
 
             return ExcelOpxWrapper.RangeData(address, None, values)
 
+    def get_ranges(self, addresses):
+        return [self.get_range(address) for address in addresses]
+
+    def prepare_formula(self, formula, address):
+        """Hook to restore saved state into a formula built by the compiler"""
+
     def _get_cell(self, address):
         cell_value = self.cell_map.get(str(address))
 
@@ -1230,3 +2401,99 @@ class _CompiledImporter:
 
         else:
             return ExcelOpxWrapper.RangeData(address, '', cell_value)
+
+
+class _BinaryCellMap(collections.abc.Mapping):
+    """Read only map of address to value or python code in a binary file
+
+    Values are decoded from the file sections only when asked for, which
+    allows the file to be memory mapped and used in place.
+    """
+
+    def __init__(self, meta, sections):
+        self.meta = meta
+        self.sections = sections
+        self.strings = binaryformat.StringTableView(
+            sections['strings'], sections['string_offsets'])
+        self.addresses = binaryformat.StringTableView(
+            sections['strings'], sections['string_offsets'], meta['cell_count'])
+        self.code_is_usable = meta['python_magic'] == importlib.util.MAGIC_NUMBER.hex()
+        self._others = None
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def __iter__(self):
+        return iter(self.addresses)
+
+    def __getitem__(self, address):
+        index = self.index(address)
+        if index is None:
+            raise KeyError(address)
+
+        formula = self.sections['formulas'][index]
+        if formula >= 0:
+            return '=' + self.strings[formula]
+
+        value_type = self.sections['value_types'][index]
+        if value_type == BINARY_NONE:
+            return None
+        elif value_type in (BINARY_FALSE, BINARY_TRUE):
+            return value_type == BINARY_TRUE
+        elif value_type == BINARY_INT:
+            return self.sections['value_ints'][index]
+        elif value_type == BINARY_FLOAT:
+            return self.sections['value_floats'][index]
+        elif value_type == BINARY_STR:
+            return self.strings[self.sections['value_ints'][index]]
+        else:
+            if self._others is None:
+                self._others = pickle.loads(self.sections['others'])
+            return self._others[self.sections['value_ints'][index]]
+
+    def index(self, address):
+        """The index of an address in the file, the addresses are sorted"""
+        index = bisect.bisect_left(self.addresses, address)
+        if index < len(self.addresses) and self.addresses[index] == address:
+            return index
+        return None
+
+    def needed_addresses(self, index):
+        """The addresses a cell depends on, edges are in dependant order"""
+        edges = self.sections['edges']
+        dependants = edges[1::2]
+        start = bisect.bisect_left(dependants, index)
+        end = bisect.bisect_right(dependants, index, start)
+        return tuple(AddressRange(self.strings[precedent])
+                     for precedent in edges[start * 2:end * 2:2])
+
+    def marshalled_python(self, index):
+        """The marshalled code for a cell, if usable by this python"""
+        code_offsets = self.sections['code_offsets']
+        start, end = code_offsets[index], code_offsets[index + 1]
+        if not self.code_is_usable or start == end:
+            return None
+
+        name_offsets = self.sections['code_name_offsets']
+        names = self.sections['code_names'][name_offsets[index]:name_offsets[index + 1]]
+        return (bytes(self.sections['code'][start:end]),
+                {self.strings[name] for name in names})
+
+
+class _BinaryImporter(_CompiledImporter):
+    """Emulate the excel_wrapper for a (memory mapped) binary file
+
+    The compiler only builds the cells, and their part of the graph, that
+    an evaluation reaches.
+    """
+    def __init__(self, filename, meta, sections):
+        super().__init__(filename, dict(
+            filename=meta['filename'],
+            cell_map=_BinaryCellMap(meta, sections),
+        ))
+
+    def prepare_formula(self, formula, address):
+        index = self.cell_map.index(address.address)
+        if index is not None:  # pragma: no branch
+            formula._needed_addresses = self.cell_map.needed_addresses(index)
+            formula._marshalled_python = self.cell_map.marshalled_python(index)
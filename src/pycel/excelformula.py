@@ -12,12 +12,12 @@ import importlib
 import logging
 import marshal
 import math
+import re
 import sys
-import tokenize as tk
+import threading
+import types
 
 import openpyxl.formula.tokenizer as tokenizer
-from networkx.classes.digraph import DiGraph
-from networkx.exception import NetworkXError
 
 from pycel.excelutil import (
     AddressMultiAreaRange,
@@ -27,16 +27,46 @@ from pycel.excelutil import (
     EMPTY,
     ERROR_CODES,
     in_array_formula_context,
+    LruCache,
     NAME_ERROR,
     PyCelException,
     uniqueify,
 )
 from pycel.lib.function_helpers import load_functions
 from pycel.lib.function_info import func_status_msg
+from pycel.tracing import format_error, LoggingTracer
 
 
 ADDR_FUNCS_NAMES = '_R_', '_C_', '_REF_'
 
+# an address function call, or a string literal to skip over
+ADDR_FUNCS_RE = re.compile(
+    r'(?<![\w.])({})\("([^"\\]*)"\)'.format('|'.join(ADDR_FUNCS_NAMES)) +
+    r'|"(?:[^"\\]|\\.)*"' + r"|'(?:[^'\\]|\\.)*'")
+
+# Reverse polish notation tokens by formula text, shared by all formulas.
+# Only the same text hits, such as formulas with only absolute references
+# and workbooks compiled again or refreshed.  Formulas copied down a column
+# have different text in each row, so they each miss.
+parse_cache = LruCache(maxsize=2 ** 16)
+
+
+def _relocate_code(code, filename, line_offset):
+    """ Copy of a code object and its nested code, moved to a file and down lines """
+    consts = tuple(
+        _relocate_code(const, filename, line_offset)
+        if isinstance(const, types.CodeType) else const
+        for const in code.co_consts)
+    return code.replace(co_filename=filename, co_consts=consts,
+                        co_firstlineno=code.co_firstlineno + line_offset)
+
+
+class _ErrorState(threading.local):
+    """ Errors captured while evaluating a formula, per thread """
+
+    def __init__(self):
+        self.messages = []
+
 
 class FormulaParserError(PyCelException):
     """Error during parsing"""
@@ -53,10 +83,64 @@ class FormulaEvalError(PyCelException):
 class Tokenizer(tokenizer.Tokenizer):
     """Amend openpyxl tokenizer"""
 
+    # a run of characters which have no special meaning to the tokenizer
+    PLAIN_RUN_RE = re.compile(r"""[^"'\[# \n+\-*/^&=><%{}();,]+""")
+
+    # the consumer for each character with a special meaning
+    DISPATCHER = {
+        char: consumer
+        for chars, consumer in (
+            ('"\'', tokenizer.Tokenizer._parse_string),
+            ('[', tokenizer.Tokenizer._parse_brackets),
+            ('#', tokenizer.Tokenizer._parse_error),
+            (' \n', tokenizer.Tokenizer._parse_whitespace),
+            ('+-*/^&=><%', tokenizer.Tokenizer._parse_operator),
+            ('{(', tokenizer.Tokenizer._parse_opener),
+            (')}', tokenizer.Tokenizer._parse_closer),
+            (';,', tokenizer.Tokenizer._parse_separator))
+        for char in chars
+    }
+
     def __init__(self, formula):
         super(Tokenizer, self).__init__(formula)
         self.items = self._items()
 
+    def _parse(self):
+        """Populate self.items with the tokens from the formula.
+
+        This is the openpyxl loop, except that a run of plain characters
+        is consumed with one regex match instead of a character at a time.
+        """
+        if self.offset or not self.formula:
+            return
+        elif self.formula[0] != '=':
+            self.items.append(tokenizer.Token(self.formula, Token.LITERAL))
+            return
+        self.offset += 1
+
+        dispatcher = self.DISPATCHER
+        formula = self.formula
+        plain_run = self.PLAIN_RUN_RE.match
+        while self.offset < len(formula):
+            curr_char = formula[self.offset]
+            if curr_char in dispatcher:
+                if curr_char in '+-' and self.check_scientific_notation():
+                    continue
+                if curr_char in self.TOKEN_ENDERS:
+                    self.save_token()
+                self.offset += dispatcher[curr_char](self)
+            else:
+                run = plain_run(formula, self.offset).group()
+                self.token.append(run)
+                self.offset += len(run)
+        self.save_token()
+
+    def assert_empty_token(self, can_follow=()):
+        # the token is built from runs of characters, so check the last one
+        if self.token and self.token[-1][-1] not in can_follow:
+            raise tokenizer.TokenizerError(
+                f"Unexpected character at position {self.offset} in '{self.formula}'")
+
     def _items(self):
         """Convert to use our Token"""
         t = [None] + [Token.from_token(t) for t in self.items] + [None]
@@ -181,14 +265,16 @@ class Token(tokenizer.Token):
 class ASTNode:
     """A generic node in the AST used to compile a cell's formula"""
 
+    __slots__ = ('token', 'cell', 'children', 'parent', 'addresses')
+
     def __init__(self, token, cell=None):
         super(ASTNode, self).__init__()
         self.token = token
         self.cell = cell
-        self._ast = None
-        self._parent = None
-        self._children = None
-        self._descendants = None
+        self.children = []
+        self.parent = None
+        # the addresses referred to by the last code emitted for this node
+        self.addresses = ()
 
     @classmethod
     def create(cls, token, cell=None):
@@ -213,13 +299,11 @@ class ASTNode:
     def __repr__(self):
         return f"{type(self).__name__}<{self.token.value.strip('(')}>"
 
-    @property
-    def ast(self):
-        return self._ast
-
-    @ast.setter
-    def ast(self, value):
-        self._ast = value
+    def set_children(self, children):
+        """Attach the ordered argument nodes to this node"""
+        self.children = children
+        for child in children:
+            child.parent = self
 
     @property
     def value(self):
@@ -233,30 +317,16 @@ class ASTNode:
     def subtype(self):
         return self.token.subtype
 
-    @property
-    def children(self):
-        if self._children is None:
-            try:
-                args = self.ast.predecessors(self)
-            except NetworkXError:
-                args = []
-            self._children = sorted(
-                args, key=lambda x: self.ast.nodes[x]['pos'])
-        # args.reverse()
-        return self._children
-
     @property
     def descendants(self):
-        if self._descendants is None:
-            self._descendants = list(
-                n for n in self.ast.nodes(self) if n[0] != self)
-        return self._descendants
-
-    @property
-    def parent(self):
-        if self._parent is None:
-            self._parent = next(self.ast.successors(self), None)
-        return self._parent
+        """(node, position in its parent's children) for the nodes below"""
+        descendants = []
+        to_visit = list(reversed(tuple(enumerate(self.children))))
+        while to_visit:
+            pos, node = to_visit.pop()
+            descendants.append((node, pos))
+            to_visit.extend(reversed(tuple(enumerate(node.children))))
+        return descendants
 
     @property
     def emit(self):
@@ -265,6 +335,8 @@ class ASTNode:
 
 
 class OperatorNode(ASTNode):
+    __slots__ = ()
+
     op_map = {
         # convert the operator to python equivalents
         "^": "**",
@@ -312,6 +384,7 @@ class OperatorNode(ASTNode):
 
 
 class OperandNode(ASTNode):
+    __slots__ = ()
 
     @property
     def emit(self):
@@ -336,8 +409,11 @@ class OperandNode(ASTNode):
 class RangeNode(OperandNode):
     """Represents a spreadsheet cell or range, e.g., A5 or B3:C20"""
 
+    __slots__ = ()
+
     @property
     def emit(self):
+        self.addresses = []
         return self._emit()
 
     def _emit(self, value=None):
@@ -368,6 +444,7 @@ class RangeNode(OperandNode):
         if isinstance(address, AddressMultiAreaRange):
             return ', '.join(self._emit(value=str(addr)) for addr in address)
         else:
+            self.addresses.append(address)
             template = '_R_("{}")' if address.is_range else '_C_("{}")'
             return template.format(address)
 
@@ -406,6 +483,8 @@ class FunctionNode(ASTNode):
         "xor": "xor_",
     }
 
+    __slots__ = ('num_args', )
+
     def __init__(self, *args):
         super(FunctionNode, self).__init__(*args)
         self.num_args = 0
@@ -461,6 +540,7 @@ class FunctionNode(ASTNode):
     @property
     def _build_reference(self):
         if len(self.children) == 0:
+            self.addresses = (self.cell.address, )
             address = f'_REF_("{self.cell.address}")'
         else:
             address = self.children[0].emit
@@ -564,10 +644,9 @@ class ExcelFormula:
         # build the python code
         self.python_code
 
-        # Throw everything away except the python code
+        # Throw everything away except the python code and needed addresses
         state = dict(self.__dict__)
-        remove_names = 'compiled_lambda _compiled_python _ast _rpn ' \
-                       'base_formula _needed_addresses'
+        remove_names = 'compiled_lambda _compiled_python _ast _rpn base_formula'
         for to_remove in remove_names.split():
             if to_remove in state:  # pragma: no branch
                 state[to_remove] = None
@@ -589,19 +668,14 @@ class ExcelFormula:
     def needed_addresses(self):
         """Return the addresses and address ranges this formula needs"""
         if self._needed_addresses is None:
-            # get all the cells/ranges this formula refers to, and remove dupes
-            if self.python_code:
-                code = iter((self.python_code.encode(),))
-                tokens = tuple(tk.tokenize(lambda: next(code)))
-                addrs = []
-                for i, t in enumerate(tokens):
-                    if t.type == 1 and t.string in ADDR_FUNCS_NAMES and (
-                            tokens[i + 1].string == '(' and
-                            tokens[i + 3].string == ')'):
-                        addrs.append(AddressRange(tokens[i + 2].string[1:-1]))
-                self._needed_addresses = uniqueify(addrs)
-            else:
-                self._needed_addresses = ()
+            # these are recorded when the python code is emitted from the ast
+            python_code = self.python_code
+            if self._needed_addresses is None:
+                # python code from a text file, find the address functions
+                self._needed_addresses = uniqueify(
+                    AddressRange(match.group(2))
+                    for match in ADDR_FUNCS_RE.finditer(python_code)
+                    if match.group(1))
 
         return self._needed_addresses
 
@@ -611,8 +685,13 @@ class ExcelFormula:
         if self._python_code is None:
             if self.ast is None:
                 self._python_code = ''
+                self._needed_addresses = ()
             else:
                 self._python_code = self.ast.emit
+                # get all the cells/ranges this formula refers to, and remove dupes
+                self._needed_addresses = uniqueify(
+                    address for node in (self.ast, *(n for n, _ in self.ast.descendants))
+                    for address in node.addresses)
         return self._python_code
 
     @property
@@ -628,23 +707,71 @@ class ExcelFormula:
                     return self.compiled_python
             else:
                 try:
-                    self._compile_python_ast()
+                    self._use_compiled_code(*self._compile_python_ast())
                 except Exception as exc:
                     raise FormulaParserError(
                         f"Failed to compile expression {self.python_code}: {exc}")
 
         return self._compiled_python
 
+    def _use_code_cache(self, code_cache):
+        """ Take the marshalled code from the cache, or add it to the cache """
+        if self._compiled_python is None and self._marshalled_python is None \
+                and self.python_code:
+            key = code_cache.key(self.python_code)
+            cached = code_cache.get(key)
+            if cached is None:
+                try:
+                    code, names = self._compile_python_ast()
+                except Exception:
+                    # raise the error as a FormulaParserError
+                    return self.compiled_python
+                code_cache[key] = marshal.dumps(code), names
+            else:
+                marshalled, names = cached
+                code = marshal.loads(marshalled)
+            self._use_compiled_code(code, names)
+
+    def _use_compiled_code(self, code, names):
+        """ Use code compiled at line 1, moved to the file and line of the formula """
+        filename, lineno = self._code_location()
+        if sys.version_info >= (3, 8):  # pragma: no cover
+            code = _relocate_code(code, filename, lineno - 1)
+        else:  # pragma: no cover
+            # ::TODO:: remove when Python 3.7 is obsolete, code.replace() is 3.8+
+            code, names = self._compile_python_ast(line_offset=lineno - 1)
+        self._compiled_python = code, names
+        self._marshalled_python = marshal.dumps(code), names
+
     def _ast_node(self, token):
         return ASTNode.create(token, self.cell)
 
     def _parse_to_rpn(self, expression):
+        """Parse an excel formula expression into reverse polish notation"""
+        rpn_tokens = parse_cache.get(expression)
+        if rpn_tokens is None:
+            rpn_tokens = self._tokens_to_rpn(expression)
+            parse_cache[expression] = rpn_tokens
+
+        rpn = []
+        for token, num_args in rpn_tokens:
+            node = self._ast_node(token)
+            if num_args is not None:
+                node.num_args = num_args
+            rpn.append(node)
+        return rpn
+
+    @staticmethod
+    def _tokens_to_rpn(expression):
         """
-        Parse an excel formula expression into reverse polish notation
+        Parse an excel formula expression into reverse polish notation tokens
 
         Core algorithm taken from wikipedia with varargs extensions from
         http://www.kallisti.net.nz/blog/2008/02/extension-to-the-shunting-yard-
             algorithm-to-allow-variable-numbers-of-arguments-to-functions/
+
+        :return: tuple of (token, number of args), the number of args is
+            None except for functions
         """
 
         lexer = Tokenizer(expression)
@@ -701,7 +828,7 @@ class ExcelFormula:
         for token in tokens:
             if token.type == token.OPERAND:
 
-                output.append(self._ast_node(token))
+                output.append((token, None))
                 if were_values:
                     were_values[-1] = True
 
@@ -719,7 +846,7 @@ class ExcelFormula:
             elif token.type == token.SEP:
 
                 while stack and (stack[-1].subtype != token.OPEN):
-                    output.append(self._ast_node(stack.pop()))
+                    output.append((stack.pop(), None))
 
                 if not len(were_values):
                     raise FormulaParserError("Mismatched or misplaced parentheses")
@@ -732,7 +859,7 @@ class ExcelFormula:
 
                 while stack and stack[-1].is_operator and (
                         token.precedence < stack[-1].precedence):
-                    output.append(self._ast_node(stack.pop()))
+                    output.append((stack.pop(), None))
 
                 stack.append(token)
 
@@ -743,7 +870,7 @@ class ExcelFormula:
             elif token.subtype == token.CLOSE:
 
                 while stack and stack[-1].subtype != Token.OPEN:
-                    output.append(self._ast_node(stack.pop()))
+                    output.append((stack.pop(), None))
 
                 if not stack:
                     raise FormulaParserError("Mismatched or misplaced parentheses")
@@ -751,9 +878,8 @@ class ExcelFormula:
                 stack.pop()
 
                 if stack and stack[-1].is_funcopen:
-                    f = self._ast_node(stack.pop())
-                    f.num_args = arg_count.pop() + int(were_values.pop())
-                    output.append(f)
+                    output.append(
+                        (stack.pop(), arg_count.pop() + int(were_values.pop())))
 
             else:
                 assert token.type == token.WSPACE, f'Unexpected token: {token}'
@@ -762,9 +888,9 @@ class ExcelFormula:
             if stack[-1].subtype in (Token.OPEN, Token.CLOSE):
                 raise FormulaParserError("Mismatched or misplaced parentheses")
 
-            output.append(self._ast_node(stack.pop()))
+            output.append((stack.pop(), None))
 
-        return output
+        return tuple(output)
 
     @classmethod
     def _build_ast(cls, rpn_expression):
@@ -774,47 +900,24 @@ class ExcelFormula:
         :return: AST which can be used to generate code
         """
 
-        # use a directed graph to store the syntax tree
-        tree = DiGraph()
-
         # production stack
         stack = []
 
         for node in rpn_expression:
-            # The graph does not maintain the order of adding nodes/edges, so
-            # add an attribute 'pos' so we can always sort to the correct order
-
-            node.ast = tree
             if isinstance(node, OperatorNode):
-                if node.token.type == node.token.OP_IN:
-                    try:
-                        arg2 = stack.pop()
-                        arg1 = stack.pop()
-                    except IndexError:
-                        raise FormulaParserError(
-                            f"'{node.token.value}' operator missing operand")
-                    tree.add_node(arg1, pos=0)
-                    tree.add_node(arg2, pos=1)
-                    tree.add_edge(arg1, node)
-                    tree.add_edge(arg2, node)
-                else:
-                    try:
-                        arg1 = stack.pop()
-                    except IndexError:
-                        raise FormulaParserError(
-                            f"'{node.token.value}' operator missing operand")
-                    tree.add_node(arg1, pos=1)
-                    tree.add_edge(arg1, node)
-
-            elif isinstance(node, FunctionNode):
-                if node.num_args:
-                    args = stack[-node.num_args:]
-                    del stack[-node.num_args:]
-                    for i, a in enumerate(args):
-                        tree.add_node(a, pos=i)
-                        tree.add_edge(a, node)
+                num_args = 2 if node.token.type == node.token.OP_IN else 1
+                if len(stack) < num_args:
+                    raise FormulaParserError(
+                        f"'{node.token.value}' operator missing operand")
             else:
-                tree.add_node(node, pos=0)
+                num_args = isinstance(node, FunctionNode) and node.num_args
+
+            if num_args:
+                node.set_children(stack[-num_args:])
+                del stack[-num_args:]
+            else:
+                node.children = []
+            node.parent = None
 
             stack.append(node)
 
@@ -823,7 +926,8 @@ class ExcelFormula:
 
     @classmethod
     def build_eval_context(cls, evaluate, evaluate_range,
-                           logger=None, plugins=None):
+                           logger=None, plugins=None, code_cache=None,
+                           profiler=None, stats=None, tracer=None):
         """eval with namespace management.  Will auto import needed functions
 
         Used like:
@@ -832,8 +936,14 @@ class ExcelFormula:
 
         :param evaluate: a function to evaluate a cell address
         :param evaluate_range: a function to evaluate a range address
-        :param logger: a logger to use (defaults to pycel)
+        :param logger: a logger to use if no tracer (defaults to pycel)
         :param plugins: module paths for plugin lib functions
+        :param code_cache: a `codecache.CodeCache` for the compiled code
+        :param profiler: a `profiler.Profiler` to count the library calls
+        :param stats: a `profiler.EvalStats` to count the compiled lambdas,
+            and the library calls if its `count_functions` is set
+        :param tracer: a `tracing.Tracer` for the captured errors, defaults
+            to a `tracing.LoggingTracer`, or False for none
         :return: a function to evaluate a compiled expression from build_ast
         """
 
@@ -846,36 +956,35 @@ class ExcelFormula:
         modules = tuple(importlib.import_module(m)
                         for m in modules + cls.default_modules)
 
-        logger = logger or logging.getLogger('pycel')
-        error_messages = []
+        if tracer is None:
+            tracer = LoggingTracer(logger)
+        error_state = _ErrorState()
 
         def capture_error_state(is_exception, msg):
-            if is_exception:
+            if is_exception and tracer:
                 import traceback
                 trace = traceback.format_exc()
             else:
                 trace = ''  # pragma: no cover
-            error_messages.append((trace, msg))
+            error_state.messages.append((trace, msg))
 
         def error_logger(level, python_code, msg=None, exc=None):
-            """ Log a traceback, a msg, and reraise if asked
+            """ Trace a traceback and a msg, and reraise if asked
 
             :param level: level for the logger "error", "warning", "debug"...
             :param python_code: Code which caused the error
             :param msg: Additional information for logging
             :param exc: An exception to reraise, if desired
-            :return: the constructed error message if not reraising
             """
             if exc:
-                capture_error_state(exc, msg)
-                assert 1 == len(error_messages)
-            trace, msg = error_messages.pop()
-            fmt_str = "{0}Eval: {1}" if msg is None else "{0}Eval: {1}\n{2}"
-            error_msg = fmt_str.format(trace, python_code, msg)
-            getattr(logger, level)(error_msg)
+                import traceback
+                error_state.messages.append((traceback.format_exc(), msg))
+                assert 1 == len(error_state.messages)
+            trace, msg = error_state.messages.pop()
+            if tracer:
+                tracer.error_captured(level, trace, python_code, msg)
             if exc is not None:
-                raise exc(error_msg)
-            return error_msg
+                raise exc(format_error(trace, python_code, msg))
 
         def load_function(excel_formula, name_space):
             """exec the code into our address space"""
@@ -895,15 +1004,26 @@ class ExcelFormula:
             name_space['lambdas'] = lambdas = []
 
             # get the compiled code and needed names
+            if code_cache is not None:
+                excel_formula._use_code_cache(code_cache)
             compiled, names = excel_formula.compiled_python
 
             # load the needed names
+            loaded = set(name_space)
             not_found = load_functions(names, name_space, modules)
+            counters = (stats if stats is not None and stats.count_functions else None,
+                        profiler)
+            for counter in counters:
+                if counter is not None:
+                    for name in set(name_space) - loaded:
+                        name_space[name] = counter.wrap_function(name, name_space[name])
 
             # exec the code to define the lambda
             exec(compiled, name_space, name_space)
             excel_formula.compiled_lambda = lambdas[0]
             del name_space['lambdas']
+            if stats is not None:
+                stats.lambdas_compiled += 1
             return not_found
 
         def eval_func(excel_formula, cse_array_address=None):
@@ -934,7 +1054,7 @@ class ExcelFormula:
                 error_logger('error', f"{address}{excel_formula.python_code}",
                              exc=FormulaEvalError)
 
-            if error_messages:
+            if error_state.messages:
                 level = 'warning' if ret_val in ERROR_CODES else 'info'
                 error_logger(level, excel_formula.python_code)
 
@@ -942,20 +1062,41 @@ class ExcelFormula:
 
         return eval_func
 
-    def _compile_python_ast(self):
+    def _code_location(self):
+        """ The filename and line number of the compiled python code
+
+        Without a text file, this is the ### line in the docstring of
+        `_compile_python_ast()`.
+        """
+        if self.lineno > 1:
+            return self.filename or __file__, self.lineno
+
+        compile_python_ast = ExcelFormula._compile_python_ast
+        doc_lines = (compile_python_ast.__doc__ or '').splitlines()
+        marker = next((i for i, line in enumerate(doc_lines)
+                       if line.lstrip().startswith('###')), -1)
+
+        # the docstring starts on the line after the def
+        return (self.filename or __file__,
+                compile_python_ast.__code__.co_firstlineno + 1 + marker)
+
+    def _compile_python_ast(self, line_offset=0):
         """ Compile the python code into a lambda for execution
 
         ### Traceback will show this line if not loaded from a text file
 
         If the compiler has been loaded from (json, yaml, etc) then python
         expression will be shown in any tracebacks instead of the above
-        """
-        local_line = sys._getframe().f_lineno - 6
 
+        :param line_offset: lines to move the code down
+        :return: the code compiled at line 1 plus line_offset, see
+            `_use_compiled_code()`, and the names it needs
+        """
         source_code = f"lambdas.append(lambda: {self.python_code})"
-        kwargs = dict(mode='exec', filename=self.filename or __file__)
+        kwargs = dict(mode='exec', filename=self._code_location()[0])
         tree = ast.parse(source_code, **kwargs)
-        ast.increment_lineno(tree, (self.lineno - 1) or local_line)
+        if line_offset:  # pragma: no cover
+            ast.increment_lineno(tree, line_offset)
 
         names = set()
 
@@ -1013,6 +1154,5 @@ class ExcelFormula:
         # modify the ast tree to convert Compare and BinOp to Call
         tree = ast.fix_missing_locations(OperatorWrapper().visit(tree))
 
-        # compile the tree
-        self._compiled_python = compile(tree, **kwargs), names
-        self._marshalled_python = marshal.dumps(self._compiled_python[0]), names
+        # compile the tree, by default at line 1 so the code can be moved to any line
+        return compile(tree, **kwargs), names
@@ -113,6 +113,49 @@ class PyCelException(Exception):
     """Base class for PyCel errors"""
 
 
+class LruCache:
+    """Thread safe mapping which discards the least recently used items
+
+    :param maxsize: maximum number of items to hold
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+
 class AddressMixin:
 
     def __str__(self):
@@ -339,16 +382,36 @@ class AddressRange(collections.namedtuple(
         elif address in ERROR_CODES:
             return address
 
+        # addresses which do not depend on the cell are interned
+        key = address, sheet
+        interned = address_cache.get(key)
+        if interned is not None:
+            return interned
+
         sheetname, addr = split_sheetname(address, sheet=sheet)
-        addr_tuple, sheetname = range_boundaries(
-            addr, sheet=sheetname, cell=cell)
+        addr_tuple = a1_range_boundaries(addr)
+        if addr_tuple is not None:
+            cacheable = True
+        else:
+            addr_tuple, sheetname = extended_range_boundaries(
+                addr, sheet=sheetname, cell=cell)
+            cacheable = cell is None
 
         if isinstance(addr_tuple, AddressMultiAreaRange):
             return addr_tuple
         elif None in addr_tuple or addr_tuple[0:2] != addr_tuple[2:]:
-            return AddressRange(addr_tuple, sheet=sheetname)
+            result = AddressRange(addr_tuple, sheet=sheetname)
         else:
-            return AddressCell(addr_tuple, sheet=sheetname)
+            result = AddressCell(addr_tuple, sheet=sheetname)
+
+        if cacheable:
+            # share one instance between all the spellings of an address
+            canonical_key = result.address, ''
+            if key != canonical_key:
+                result = address_cache.get(canonical_key, result)
+                address_cache[canonical_key] = result
+            address_cache[key] = result
+        return result
 
 
 class AddressCell(collections.namedtuple(
@@ -518,6 +581,10 @@ class AddressMultiAreaRange(tuple):
         return it.chain.from_iterable(addr.resolve_range for addr in self)
 
 
+# Canonical AddressRange/AddressCell for (address string, sheet) pairs
+address_cache = LruCache(maxsize=2 ** 17)
+
+
 def is_address(addr):
     return isinstance(addr, (AddressCell, AddressRange))
 
@@ -699,14 +766,28 @@ def structured_reference_boundaries(address, cell=None):
     return (min_col_idx, min_row, max_col_idx, max_row), sheet
 
 
-def range_boundaries(address, cell=None, sheet=None):
+def a1_range_boundaries(address):
+    """Boundaries for a normal (A1 style) reference, or None if not one"""
     try:
-        # if this is normal reference then just use the openpyxl converter
         boundaries = openpyxl_range_boundaries(address)
         if None not in boundaries or ':' in address:
-            return boundaries, sheet
+            return boundaries
     except ValueError:
         pass
+    return None
+
+
+def range_boundaries(address, cell=None, sheet=None):
+    # if this is normal reference then just use the openpyxl converter
+    boundaries = a1_range_boundaries(address)
+    if boundaries is not None:
+        return boundaries, sheet
+
+    return extended_range_boundaries(address, cell=cell, sheet=sheet)
+
+
+def extended_range_boundaries(address, cell=None, sheet=None):
+    """Boundaries for R1C1, structured, defined name & multi colon references"""
 
     # test for R1C1 style address
     boundaries = r1c1_boundaries(address, cell=cell, sheet=sheet)
@@ -1287,6 +1368,8 @@ class _IterativeEvalTracker:
             self._ns.todo = set()
             self._ns.computed = set()
             self._ns.iteration_number = 0
+            self._ns.iterations = 100
+            self._ns.tolerance = 0.001
         return self._ns
 
     def __call__(self, iterations=100, tolerance=0.001):
@@ -11,22 +11,44 @@
     ExcelOpxWrapper : Can be run anywhere but only with post 2010 Excel formats
     ExcelOpxWrapperNoData  :
         Can be initialized with a instance of an OpenPyXl workbook
+    ExcelStreamWrapper :
+        Single pass streaming reader for post 2010 Excel formats
 """
 
 import abc
 import collections
 import os
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
 from unittest import mock
 
 from openpyxl import load_workbook, Workbook
 from openpyxl.cell.cell import Cell, MergedCell
+from openpyxl.cell.text import Text
+from openpyxl.formatting.formatting import ConditionalFormatting
 from openpyxl.formula.translate import Translator
+from openpyxl.packaging.relationship import get_dependents, get_rels_path
+from openpyxl.reader.excel import ExcelReader
+from openpyxl.styles.stylesheet import apply_stylesheet
+from openpyxl.utils import coordinate_to_tuple, get_column_letter
+from openpyxl.utils.datetime import from_ISO8601
+from openpyxl.worksheet.table import Table
+from openpyxl.xml.constants import SHEET_MAIN_NS
+from openpyxl.xml.functions import fromstring, iterparse
 
 from pycel.excelutil import AddressCell, AddressRange, flatten, is_address
 
 ARRAY_FORMULA_NAME = '=CSE_INDEX'
 ARRAY_FORMULA_FORMAT = '{}(%s,%s,%s,%s,%s)'.format(ARRAY_FORMULA_NAME)
 
+SHEET_DATA_TAG = f'{{{SHEET_MAIN_NS}}}sheetData'
+ROW_TAG = f'{{{SHEET_MAIN_NS}}}row'
+FORMULA_TAG = f'{{{SHEET_MAIN_NS}}}f'
+VALUE_TAG = f'{{{SHEET_MAIN_NS}}}v'
+INLINE_STRING_TAG = f'{{{SHEET_MAIN_NS}}}is'
+CONDITIONAL_FORMATTING_TAG = f'{{{SHEET_MAIN_NS}}}conditionalFormatting'
+
 
 class ExcelWrapper:
     __metaclass__ = abc.ABCMeta
@@ -37,6 +59,10 @@ class ExcelWrapper:
     def get_range(self, address):
         """"""
 
+    def get_ranges(self, addresses):
+        """The range data for each of a sequence of addresses"""
+        return [self.get_range(address) for address in addresses]
+
     @abc.abstractmethod
     def get_used_range(self):
         """"""
@@ -73,18 +99,10 @@ class _OpxRange(ExcelWrapper.RangeData):
         (Formula & Value)
     """
     def __new__(cls, cells, cells_dataonly, address):
-        formula = None
         value = cells[0][0].value
         if isinstance(value, str) and value.startswith(ARRAY_FORMULA_NAME):
             # if this range refers to a CSE Array Formula, get the formula
-            front, *args = cells[0][0].value[:-1].rsplit(',', 4)
-
-            # if this range corresponds to the top left of a CSE Array formula
-            if (args[0] == args[1] == '1') and all(
-                    c.value and c.value.startswith(front)
-                    for c in flatten(cells)):
-                # apply formula to the range
-                formula = '={%s}' % front[len(ARRAY_FORMULA_NAME) + 1:]
+            formula = cls.array_formula(value, (c.value for c in flatten(cells)))
         else:
             formula = tuple(tuple(cls.cell_to_formula(cell) for cell in row)
                             for row in cells)
@@ -93,12 +111,65 @@ class _OpxRange(ExcelWrapper.RangeData):
                        for row in cells_dataonly)
         return ExcelWrapper.RangeData.__new__(cls, address, formula, values)
 
+    @classmethod
+    def from_cell_store(cls, cell_store, address):
+        """ Build the range data for an address from a `_CellStore` """
+        rows = range(address.start.row, address.end.row + 1)
+        cols = range(address.start.col_idx, address.end.col_idx + 1)
+        texts = tuple(tuple(cell_store.formula(row, col) for col in cols)
+                      for row in rows)
+
+        value = texts[0][0]
+        if isinstance(value, str) and value.startswith(ARRAY_FORMULA_NAME):
+            formula = cls.array_formula(value, flatten(texts))
+        else:
+            formula = tuple(
+                tuple(cls.text_to_formula(text, row, col, cell_store.title)
+                      for col, text in zip(cols, row_texts))
+                for row, row_texts in zip(rows, texts))
+
+        values = tuple(tuple(cell_store.value(row, col) for col in cols)
+                       for row in rows)
+        return ExcelWrapper.RangeData.__new__(cls, address, formula, values)
+
+    @staticmethod
+    def array_formula(value, texts):
+        """ The CSE Array Formula for a range with a CSE formula at top left
+
+        :param value: the formula text of the top left cell of the range
+        :param texts: the formula text of all of the cells in the range
+        :return: formula if the range is an entire CSE Array, else None
+        """
+        front, *args = value[:-1].rsplit(',', 4)
+
+        # if this range corresponds to the top left of a CSE Array formula
+        if (args[0] == args[1] == '1') and all(
+                text and text.startswith(front) for text in texts):
+            # apply formula to the range
+            return '={%s}' % front[len(ARRAY_FORMULA_NAME) + 1:]
+        return None
+
     @classmethod
     def cell_to_formula(cls, cell):
-        if cell.value is None:
+        value = cell.value
+        if isinstance(value, str) and value.startswith(ARRAY_FORMULA_NAME):
+            return cls.text_to_formula(
+                value, cell.row, cell.col_idx, cell.parent.title)
+        return cls.text_to_formula(value)
+
+    @staticmethod
+    def text_to_formula(value, row=None, col_idx=None, sheet=None):
+        """ Map the formula text from a cell to the formula to compile
+
+        :param value: the cell formula text (or value)
+        :param row: row of the cell, only needed for CSE Array formulas
+        :param col_idx: column of the cell, only needed for CSE Array formulas
+        :param sheet: sheet of the cell, only needed for CSE Array formulas
+        """
+        if value is None:
             return ''
         else:
-            formula = str(cell.value)
+            formula = str(value)
             if not formula.startswith('='):
                 return ''
 
@@ -109,13 +180,13 @@ class _OpxRange(ExcelWrapper.RangeData):
             elif formula.startswith(ARRAY_FORMULA_NAME):
                 # These are CSE Array formulas as encoded from sheet
                 params = formula[len(ARRAY_FORMULA_NAME) + 1:-1].rsplit(',', 4)
-                start_row = cell.row - int(params[1]) + 1
-                start_col_idx = cell.col_idx - int(params[2]) + 1
+                start_row = row - int(params[1]) + 1
+                start_col_idx = col_idx - int(params[2]) + 1
                 end_row = start_row + int(params[3]) - 1
                 end_col_idx = start_col_idx + int(params[4]) - 1
                 cse_range = AddressRange(
                     (start_col_idx, start_row, end_col_idx, end_row),
-                    sheet=cell.parent.title)
+                    sheet=sheet)
                 return f'=index({cse_range.quoted_address},{params[1]},{params[2]})'
             else:
                 return formula
@@ -140,6 +211,15 @@ class _OpxCell(_OpxRange):
         return ExcelWrapper.RangeData.__new__(
             cls, address, cls.cell_to_formula(cell), cell_dataonly.value)
 
+    @classmethod
+    def from_cell_store(cls, cell_store, address):
+        """ Build the cell data for an address from a `_CellStore` """
+        row, col_idx = address.row, address.col_idx
+        formula = cls.text_to_formula(
+            cell_store.formula(row, col_idx), row, col_idx, cell_store.title)
+        return ExcelWrapper.RangeData.__new__(
+            cls, address, formula, cell_store.value(row, col_idx))
+
 
 class ExcelOpxWrapper(ExcelWrapper):
     """ OpenPyXl implementation for ExcelWrapper interface """
@@ -156,13 +236,18 @@ class ExcelOpxWrapper(ExcelWrapper):
         self._table_refs = {}
         self.workbook = None
         self.workbook_dataonly = None
-        self._max_col_row = {}
+        self._cell_stores = {}
 
     def max_col_row(self, sheet):
-        if sheet not in self._max_col_row:
-            worksheet = self.workbook[sheet]
-            self._max_col_row[sheet] = worksheet.max_column, worksheet.max_row
-        return self._max_col_row[sheet]
+        cell_store = self._cell_store(sheet)
+        return cell_store.max_col, cell_store.max_row
+
+    def _cell_store(self, sheet):
+        """ The index of formulas and values for a sheet, built on first use """
+        if sheet not in self._cell_stores:
+            self._cell_stores[sheet] = _CellStore.from_worksheets(
+                self.workbook[sheet], self.workbook_dataonly[sheet])
+        return self._cell_stores[sheet]
 
     @property
     def defined_names(self):
@@ -314,29 +399,36 @@ class ExcelOpxWrapper(ExcelWrapper):
         if not is_address(address):
             address = AddressRange(address)
 
-        if address.has_sheet:
-            sheet = self.workbook[address.sheet]
-            sheet_dataonly = self.workbook_dataonly[address.sheet]
+        sheet = address.sheet if address.has_sheet else self.get_active_sheet_name()
+        cell_store = self._cell_store(sheet)
+
+        if address.is_unbounded_range:
+            # bound the address range to the data in the spreadsheet
+            address = address & AddressRange(
+                (1, 1, cell_store.max_col, cell_store.max_row), sheet=sheet)
+
+        if address.is_range:
+            return _OpxRange.from_cell_store(cell_store, address)
         else:
-            sheet = self.workbook.active
-            sheet_dataonly = self.workbook_dataonly.active
+            return _OpxCell.from_cell_store(cell_store, address)
 
-        with mock.patch('openpyxl.worksheet._reader.from_excel',
-                        self.from_excel):
-            # work around type coercion to datetime that causes some issues
-
-            if address.is_unbounded_range:
-                # bound the address range to the data in the spreadsheet
-                address = address & AddressRange(
-                    (1, 1, *self.max_col_row(sheet.title)),
-                    sheet=sheet.title)
-
-            cells = sheet[address.coordinate]
-            cells_dataonly = sheet_dataonly[address.coordinate]
-            if isinstance(cells, (Cell, MergedCell)):
-                return _OpxCell(cells, cells_dataonly, address)
+    def get_ranges(self, addresses):
+        """The range data for each of a sequence of addresses
+
+        Cells are read straight from the cell store of their sheet, which
+        is looked up once per sheet.
+        """
+        cell_stores = {}
+        results = []
+        for address in addresses:
+            if address.is_range or not address.has_sheet:
+                results.append(self.get_range(address))
             else:
-                return _OpxRange(cells, cells_dataonly, address)
+                cell_store = cell_stores.get(address.sheet)
+                if cell_store is None:
+                    cell_store = cell_stores[address.sheet] = self._cell_store(address.sheet)
+                results.append(_OpxCell.from_cell_store(cell_store, address))
+        return results
 
     def get_used_range(self):
         return self.workbook.active.iter_rows()
@@ -344,6 +436,10 @@ class ExcelOpxWrapper(ExcelWrapper):
     def get_active_sheet_name(self):
         return self.workbook.active.title
 
+    def formula_addresses(self, sheet):
+        """ Return the addresses of the cells on a sheet with formulas """
+        return self._cell_store(sheet).formula_addresses()
+
 
 class ExcelOpxWrapperNoData(ExcelOpxWrapper):
     """ ExcelWrapper interface from openpyxl workbook,
@@ -378,9 +474,370 @@ class ExcelOpxWrapperNoData(ExcelOpxWrapper):
         self.workbook_dataonly = workbook
         self.load_array_formulas()
 
+    # The workbook belongs to the caller, who may change it between reads,
+    # so the cells are read from the workbook instead of a cell store.
+
+    def max_col_row(self, sheet):
+        worksheet = self.workbook[sheet]
+        return worksheet.max_column, worksheet.max_row
+
     def get_range(self, address):
-        data = super().get_range(address)
-        if isinstance(data.values, tuple):
-            return self.OpxRange(data)
+        if not is_address(address):
+            address = AddressRange(address)
+
+        if address.has_sheet:
+            sheet = self.workbook[address.sheet]
         else:
-            return self.OpxCell(data)
+            sheet = self.workbook.active
+
+        if address.is_unbounded_range:
+            # bound the address range to the data in the spreadsheet
+            address = address & AddressRange(
+                (1, 1, *self.max_col_row(sheet.title)), sheet=sheet.title)
+
+        cells = sheet[address.coordinate]
+        if isinstance(cells, (Cell, MergedCell)):
+            return self.OpxCell(_OpxCell(cells, cells, address))
+        else:
+            return self.OpxRange(_OpxRange(cells, cells, address))
+
+    def formula_addresses(self, sheet):
+        return tuple(
+            AddressCell.create(cell.coordinate, sheet)
+            for row in self.workbook[sheet].iter_rows()
+            for cell in row
+            if isinstance(getattr(cell, 'value', None), str) and
+            cell.value.startswith('=')
+        )
+
+    # the range data needs to be converted by `get_range()`
+    get_ranges = ExcelWrapper.get_ranges
+
+
+class _CellStore:
+    """ Compact store of the formula text and values for one worksheet
+
+    Only cells with a formula or a value are held.  Cells are keyed by a
+    single int, so sorting the keys gives the cells in row major order.
+    """
+    __slots__ = ('title', 'formulas', 'values', 'max_col', 'max_row')
+
+    def __init__(self, title):
+        self.title = title
+        self.formulas = {}
+        self.values = {}
+        self.max_col = 1
+        self.max_row = 1
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    @classmethod
+    def from_worksheets(cls, worksheet, worksheet_dataonly):
+        """ Build the store from openpyxl formula and data_only worksheets """
+        cell_store = cls(worksheet.title)
+        cell_store.max_col = worksheet.max_column
+        cell_store.max_row = worksheet.max_row
+
+        formulas = cell_store.formulas
+        for (row, col_idx), cell in worksheet._cells.items():
+            value = cell.value
+            if value is not None:
+                value = str(value)
+                if value.startswith('='):
+                    formulas[row << 15 | col_idx] = value
+
+        values = cell_store.values
+        for (row, col_idx), cell in worksheet_dataonly._cells.items():
+            if cell.value is not None:
+                values[row << 15 | col_idx] = cell.value
+        return cell_store
+
+    @staticmethod
+    def key(row, col_idx):
+        return row << 15 | col_idx
+
+    def formula(self, row, col_idx):
+        return self.formulas.get(row << 15 | col_idx)
+
+    def value(self, row, col_idx):
+        return self.values.get(row << 15 | col_idx)
+
+    def formula_addresses(self):
+        return tuple(
+            AddressCell((key & 0x7FFF, key >> 15) * 2, sheet=self.title)
+            for key in sorted(self.formulas))
+
+
+def _cast_number(value):
+    """Convert numbers as int or float, the same as openpyxl"""
+    if '.' in value or 'E' in value or 'e' in value:
+        return float(value)
+    return int(value)
+
+
+def _cell_value(cell, shared_strings):
+    """Decode the (cached) value of a cell element"""
+    data_type = cell.get('t', 'n')
+    if data_type == 'inlineStr':
+        child = cell.find(INLINE_STRING_TAG)
+        return None if child is None else Text.from_tree(child).content
+
+    value = cell.findtext(VALUE_TAG, None) or None
+    if value is None:
+        return None
+    elif data_type == 'n':
+        # ::NOTE:: dates are intentionally not converted, see from_excel()
+        return _cast_number(value)
+    elif data_type == 's':
+        return shared_strings[int(value)]
+    elif data_type == 'b':
+        return bool(int(value))
+    elif data_type == 'd':
+        return from_ISO8601(value)
+    return value
+
+
+def _read_worksheet(archive, title, path, shared_strings):
+    """ Stream a worksheet's xml once, collecting formulas and cached values
+
+    :param archive: open `ZipFile` for the xlsx
+    :param title: worksheet name
+    :param path: path to the worksheet xml in the archive
+    :param shared_strings: the workbook's shared string table
+    :return: `_CellStore`, list of the worksheet's `ConditionalFormatting`
+    """
+    cell_store = _CellStore(title)
+    formulas, values = cell_store.formulas, cell_store.values
+    shared_formulae = {}
+    array_formulae = []
+    formatting = []
+    sheet_data = None
+    row = 0
+    max_row = max_col = 1
+
+    with archive.open(path) as src:
+        for event, element in iterparse(src, events=('start', 'end')):
+            tag = element.tag
+            if event == 'start':
+                if tag == SHEET_DATA_TAG:
+                    sheet_data = element
+                continue
+
+            if tag == ROW_TAG:
+                row = int(element.get('r') or row + 1)
+                col_idx = 0
+                for cell in element:
+                    coordinate = cell.get('r')
+                    if coordinate:
+                        row, col_idx = coordinate_to_tuple(coordinate)
+                    else:
+                        col_idx += 1
+                    max_col = max(max_col, col_idx)
+                    key = row << 15 | col_idx
+
+                    value = _cell_value(cell, shared_strings)
+                    if value is not None:
+                        values[key] = value
+
+                    formula = cell.find(FORMULA_TAG)
+                    if formula is not None:
+                        text = '=' + (formula.text or '')
+                        formula_type = formula.get('t')
+                        if formula_type == 'shared':
+                            coordinate = coordinate or f'{get_column_letter(col_idx)}{row}'
+                            idx = formula.get('si')
+                            if idx in shared_formulae:
+                                text = shared_formulae[idx].translate_formula(coordinate)
+                            elif text != '=':
+                                shared_formulae[idx] = Translator(text, coordinate)
+                        elif formula_type == 'array' and formula.get('ref'):
+                            array_formulae.append((text, formula.get('ref')))
+                        formulas[key] = text
+
+                    elif isinstance(value, str) and value.startswith('='):
+                        # openpyxl treats strings which look like formulas as formulas
+                        formulas[key] = value
+
+                max_row = max(max_row, row)
+
+                # done with this row, so free the memory
+                if sheet_data is not None:
+                    sheet_data.clear()
+                else:
+                    element.clear()  # pragma: no cover
+
+            elif tag == CONDITIONAL_FORMATTING_TAG:
+                formatting.append(ConditionalFormatting.from_tree(element))
+
+    # expand array formulas
+    for text, ref in array_formulae:
+        ref_addr = AddressRange(ref)
+        if isinstance(ref_addr, AddressRange):
+            for i, addr_row in enumerate(ref_addr.rows, start=1):
+                for j, addr in enumerate(addr_row, start=1):
+                    formulas[addr.row << 15 | addr.col_idx] = ARRAY_FORMULA_FORMAT % (
+                        text[1:], i, j, *ref_addr.size)
+            max_row = max(max_row, ref_addr.end.row)
+            max_col = max(max_col, ref_addr.end.col_idx)
+
+    cell_store.max_row, cell_store.max_col = max_row, max_col
+    return cell_store, formatting
+
+
+_worker_shared_strings = {}
+
+
+def _read_worksheet_file(filename, title, path):
+    """ Parse one worksheet of an xlsx file, for use in a worker process
+
+    The shared strings table is read once per process and reused for
+    every worksheet the process is handed.
+    """
+    reader = ExcelReader(filename, read_only=True)
+    try:
+        if filename not in _worker_shared_strings:
+            reader.read_manifest()
+            reader.read_strings()
+            _worker_shared_strings.clear()
+            _worker_shared_strings[filename] = reader.shared_strings
+        return _read_worksheet(
+            reader.archive, title, path, _worker_shared_strings[filename])
+    finally:
+        reader.archive.close()
+
+
+class ExcelStreamWrapper(ExcelOpxWrapper):
+    """ ExcelWrapper interface which reads each worksheet's xml only once
+
+    The formula text and the cached value for each cell are streamed
+    together, in a single pass, into a compact `_CellStore` per sheet.
+    This replaces loading two full openpyxl workbooks (formulas and
+    data_only).  Workbook level data (defined names, tables, conditional
+    formats and calculation settings) is kept in an openpyxl workbook
+    which has no cells.
+
+    With ``lazy=True`` only the workbook metadata (sheet names, defined
+    names, tables and styles) is read by `load()`.  Each worksheet's xml
+    is then parsed the first time one of its cells is asked for.
+
+    With ``workers`` > 1 the worksheets are parsed in parallel in a pool
+    of that many processes.  Each worker returns the compact cell store
+    for its sheet.  This is ignored when ``lazy`` is set.
+    """
+
+    def __init__(self, filename, app=None, lazy=False, workers=None):
+        super().__init__(filename, app=app)
+        self.lazy = lazy
+        self.workers = workers
+        self._unloaded_sheets = {}
+        self._shared_strings = None
+        self._load_lock = threading.Lock()
+
+    def load(self):
+        reader = ExcelReader(self.filename, read_only=False, keep_vba=False,
+                             data_only=False, keep_links=False)
+        try:
+            reader.read_manifest()
+            reader.read_strings()
+            reader.read_workbook()
+            apply_stylesheet(reader.archive, reader.wb)
+
+            for sheet, rel in reader.parser.find_sheets():
+                if rel.target not in reader.valid_files:
+                    continue  # pragma: no cover
+
+                if 'chartsheet' in rel.Type:
+                    reader.read_chartsheet(sheet, rel)  # pragma: no cover
+                    continue  # pragma: no cover
+
+                worksheet = reader.wb.create_sheet(sheet.name)
+                worksheet.sheet_state = sheet.state
+                self._load_tables(reader.archive, worksheet, rel.target)
+                self._unloaded_sheets[sheet.name] = rel.target
+
+            reader.parser.assign_names()
+            self.workbook = reader.wb
+            self._shared_strings = reader.shared_strings
+
+            if not self.lazy:
+                self._load_worksheets(reader.archive)
+        finally:
+            reader.archive.close()
+
+    def _load_worksheets(self, archive):
+        sheets = tuple(self._unloaded_sheets.items())
+        self._unloaded_sheets = {}
+        if (self.workers or 1) > 1 and len(sheets) > 1:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                results = tuple(executor.map(
+                    _read_worksheet_file, *zip(*(
+                        (self.filename, title, path) for title, path in sheets))))
+        else:
+            results = tuple(
+                _read_worksheet(archive, title, path, self._shared_strings)
+                for title, path in sheets)
+
+        for (title, _), result in zip(sheets, results):
+            self._bind_worksheet(self.workbook[title], *result)
+
+    @staticmethod
+    def _load_tables(archive, worksheet, path):
+        rels_path = get_rels_path(path)
+        if rels_path in archive.namelist():
+            for rel in get_dependents(archive, rels_path).find(Table._rel_type):
+                worksheet.add_table(Table.from_tree(fromstring(archive.read(rel.target))))
+
+    def _bind_worksheet(self, worksheet, cell_store, formatting):
+        differential_styles = worksheet.parent._differential_styles
+        for cf in formatting:
+            for rule in cf.rules:
+                if rule.dxfId is not None:
+                    rule.dxf = differential_styles[rule.dxfId]
+                worksheet.conditional_formatting[cf] = rule
+
+        # stored last, since _cell_store() reads it without the lock
+        self._cell_stores[worksheet.title] = cell_store
+
+    def _cell_store(self, sheet):
+        if sheet not in self._cell_stores:
+            # threads reading an unloaded sheet together parse it only once
+            with self._load_lock:
+                if sheet not in self._cell_stores:
+                    if sheet not in self._unloaded_sheets:
+                        raise KeyError(f"Worksheet {sheet} does not exist.")
+                    self._load_worksheet(sheet)
+        return self._cell_stores[sheet]
+
+    def _load_worksheet(self, sheet):
+        """ Parse a worksheet deferred by a lazy `load()` """
+        with zipfile.ZipFile(self.filename) as archive:
+            self._bind_worksheet(self.workbook[sheet], *_read_worksheet(
+                archive, sheet, self._unloaded_sheets.pop(sheet),
+                self._shared_strings))
+
+    @property
+    def loaded_sheets(self):
+        """ Names of the worksheets which have been parsed """
+        return tuple(self._cell_stores)
+
+    def conditional_format(self, address):
+        # conditional formats are part of the worksheet's xml
+        self._cell_store(AddressCell(address).sheet)
+        return super().conditional_format(address)
+
+    def set_sheet(self, s):
+        self.workbook.active = self.workbook.index(self.workbook[s])
+        return self.workbook.active
+
+    def get_used_range(self):
+        sheet = self.get_active_sheet_name()
+        max_col, max_row = self.max_col_row(sheet)
+        return tuple(
+            tuple(self.get_range(AddressCell((col, row, col, row), sheet=sheet))
+                  for col in range(1, max_col + 1))
+            for row in range(1, max_row + 1))
@@ -0,0 +1,424 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright 2011-2019 by Dirk Gorissen, Stephen Rauch and Contributors
+# All rights reserved.
+# This file is part of the Pycel Library, Licensed under GPLv3 (the 'License')
+# You may not use this work except in compliance with the License.
+# You may obtain a copy of the Licence at:
+#   https://www.gnu.org/licenses/gpl-3.0.en.html
+
+"""
+    Monte Carlo simulation of a compiled workbook, with numpy arrays of samples
+
+    Used like:
+
+        result = excel_compiler.simulate(
+            {'Inputs!B2': ('normal', 100, 15), 'Inputs!B3': ('uniform', 0, 1)},
+            'Outputs!C10', n=100000, seed=1)
+        result.values['Outputs!C10'], result.stats['Outputs!C10']['p95']
+
+    The cells which depend on the sampled inputs are evaluated in topological
+    order, a chunk of samples at a time.  Formulas made of arithmetic,
+    comparisons, IF() and some math functions of single cells are evaluated
+    with numpy on the arrays of samples.  The other formulas, and the samples
+    where numpy finds a value which would be an excel error, such as a
+    division by zero, are evaluated one sample at a time in a `ValueContext`.
+"""
+
+import ast
+import collections
+import functools
+import math
+from numbers import Real
+
+import numpy as np
+
+Simulation = collections.namedtuple(
+    'Simulation', 'samples values stats vectorized scalar_samples')
+Simulation.__doc__ = """ The result of `simulate()`
+
+    :samples: dict of input address to the array of its samples
+    :values: dict of output address to the array of its values
+    :stats: dict of output address to a dict of summary statistics
+    :vectorized: the addresses of the formulas evaluated with numpy
+    :scalar_samples: `collections.Counter` of address to the number of
+        samples evaluated one at a time, for the formulas which numpy can not
+        evaluate and the samples where numpy found an invalid value
+"""
+
+_BINARY_OPS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.true_divide,
+    ast.Pow: np.power,
+}
+
+_COMPARE_OPS = {
+    ast.Lt: np.less,
+    ast.LtE: np.less_equal,
+    ast.Gt: np.greater,
+    ast.GtE: np.greater_equal,
+    ast.Eq: np.equal,
+    ast.NotEq: np.not_equal,
+}
+
+# pycel library function name to (numpy function, number of arguments)
+_FUNCTIONS = {
+    'abs_': (np.abs, 1),
+    'sqrt': (np.sqrt, 1),
+    'exp': (np.exp, 1),
+    'ln': (np.log, 1),
+    'log10': (np.log10, 1),
+    'sin': (np.sin, 1),
+    'cos': (np.cos, 1),
+    'tan': (np.tan, 1),
+    'int_': (np.floor, 1),
+    'power': (np.power, 2),
+    'if_': (np.where, 3),
+    'max_': (functools.partial(functools.reduce, np.maximum), None),
+    'min_': (functools.partial(functools.reduce, np.minimum), None),
+}
+
+
+def _is_vectorizable(node):
+    """ Can the AST of a formula be evaluated with `_vector_value()` """
+    if isinstance(node, ast.Expression):
+        return _is_vectorizable(node.body)
+    if isinstance(node, ast.BinOp):
+        return type(node.op) in _BINARY_OPS and (
+            _is_vectorizable(node.left) and _is_vectorizable(node.right))
+    if isinstance(node, ast.UnaryOp):
+        return isinstance(node.op, (ast.USub, ast.UAdd)) and _is_vectorizable(node.operand)
+    if isinstance(node, ast.Compare):
+        return len(node.ops) == 1 and type(node.ops[0]) in _COMPARE_OPS and (
+            _is_vectorizable(node.left) and _is_vectorizable(node.comparators[0]))
+    if isinstance(node, ast.Constant):
+        return isinstance(node.value, Real)
+    if isinstance(node, ast.Name):
+        return node.id == 'pi'
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+        if node.func.id == '_C_':
+            return len(node.args) == 1 and isinstance(node.args[0], ast.Constant)
+        if node.func.id in _FUNCTIONS:
+            arg_count = _FUNCTIONS[node.func.id][1]
+            return (arg_count in (None, len(node.args)) and bool(node.args) and
+                    all(_is_vectorizable(arg) for arg in node.args))
+    return False
+
+
+def _either(*masks):
+    """ The samples in any of the masks of invalid samples, or None """
+    masks = [mask for mask in masks if mask is not None]
+    return functools.reduce(np.logical_or, masks) if masks else None
+
+
+def _numeric(value, allow_bool=True):
+    """ A value for numpy arithmetic, and the mask of the invalid samples
+
+    Samples which are not finite numbers, such as excel errors, are invalid,
+    and are evaluated one at a time.  Raises TypeError for values which are
+    not numbers, and for booleans unless allowed.
+    """
+    if isinstance(value, np.ndarray):
+        kind = value.dtype.kind
+        if kind == 'O':
+            invalid = np.array([isinstance(v, bool) or not isinstance(v, Real)
+                                for v in value], dtype=bool)
+            value = value.copy()
+            value[invalid] = 0.0
+            value = value.astype(float)
+        elif kind in 'iuf':
+            value = value.astype(float, copy=False)
+        elif not (kind == 'b' and allow_bool):
+            raise TypeError(f'Not numbers: {value.dtype}')
+        invalid = None if kind == 'b' else _either(
+            invalid if kind == 'O' else None, ~np.isfinite(value))
+        return value, invalid
+
+    is_bool = isinstance(value, (bool, np.bool_))
+    if is_bool and not allow_bool or not isinstance(value, Real):
+        raise TypeError(f'Not a number: {value!r}')
+    return value, None if is_bool or math.isfinite(value) else True
+
+
+def _number(value):
+    """ Booleans as numbers, since numpy arithmetic on booleans is logical """
+    if isinstance(value, np.ndarray):
+        return value.astype(float) if value.dtype.kind == 'b' else value
+    return float(value) if isinstance(value, (bool, np.bool_)) else value
+
+
+def _result(value, *masks):
+    """ The result of a numpy function, and the mask of its invalid samples """
+    if isinstance(value, np.ndarray) and value.dtype.kind == 'f' or isinstance(value, float):
+        masks += (~np.isfinite(value), )
+    return value, _either(*masks)
+
+
+def _vector_value(node, operand):
+    """ Evaluate the AST of a formula with numpy arrays of samples
+
+    :param node: node accepted by `_is_vectorizable()`
+    :param operand: function of a cell address to its array of samples,
+        or to its value if it does not depend on the samples
+    :return: (array of the samples or a value, mask of the invalid samples or None)
+    """
+    if isinstance(node, ast.Expression):
+        return _vector_value(node.body, operand)
+    if isinstance(node, ast.BinOp):
+        left, left_invalid = _vector_value(node.left, operand)
+        right, right_invalid = _vector_value(node.right, operand)
+        return _result(_BINARY_OPS[type(node.op)](_number(left), _number(right)),
+                       left_invalid, right_invalid)
+    if isinstance(node, ast.UnaryOp):
+        value, invalid = _vector_value(node.operand, operand)
+        return (np.negative(_number(value)) if isinstance(node.op, ast.USub) else value), invalid
+    if isinstance(node, ast.Compare):
+        # excel orders booleans after numbers, so only compare numbers
+        left, left_invalid = _vector_value(node.left, operand)
+        right, right_invalid = _vector_value(node.comparators[0], operand)
+        _numeric(left, allow_bool=False)
+        _numeric(right, allow_bool=False)
+        return _COMPARE_OPS[type(node.ops[0])](left, right), _either(
+            left_invalid, right_invalid)
+    if isinstance(node, ast.Constant):
+        return _numeric(node.value)
+    if isinstance(node, ast.Name):
+        return math.pi, None
+
+    name = node.func.id
+    if name == '_C_':
+        return _numeric(operand(node.args[0].value))
+    function = _FUNCTIONS[name][0]
+    args = [_vector_value(arg, operand) for arg in node.args]
+    if name == 'if_':
+        (condition, condition_invalid), (true_value, true_invalid), \
+            (false_value, false_invalid) = args
+        if (np.asarray(true_value).dtype.kind == 'b') != (
+                np.asarray(false_value).dtype.kind == 'b'):
+            raise TypeError('IF() of a boolean and a number')
+        # only the samples of the branch taken need to be valid
+        branch_invalid = None
+        if true_invalid is not None or false_invalid is not None:
+            branch_invalid = np.where(
+                condition, False if true_invalid is None else true_invalid,
+                False if false_invalid is None else false_invalid)
+        return function(condition, true_value, false_value), _either(
+            condition_invalid, branch_invalid)
+    if name in ('max_', 'min_'):
+        # excel MAX() and MIN() ignore booleans in references, so only use numbers
+        for value, _ in args:
+            _numeric(value, allow_bool=False)
+    values = [_number(value) for value, _ in args]
+    value = function(values) if _FUNCTIONS[name][1] is None else function(*values)
+    return _result(value, *(invalid for _, invalid in args))
+
+
+def _as_array(values):
+    """ Array of values, with dtype object unless they are all real numbers or all booleans """
+    is_bool = {isinstance(value, (bool, np.bool_)) for value in values}
+    if len(is_bool) < 2 and all(isinstance(value, Real) for value in values):
+        return np.array(values)
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+def _draw(distribution, rng, n):
+    """ The samples of one input
+
+    :param distribution: name and parameters of a `numpy.random.Generator`
+        method like ('normal', 0, 1), a function of (rng, n), or the samples
+    """
+    if callable(distribution):
+        samples = distribution(rng, n)
+    elif isinstance(distribution, (tuple, list)) and isinstance(distribution[0], str):
+        samples = getattr(rng, distribution[0])(*distribution[1:], size=n)
+    else:
+        samples = distribution
+    samples = np.asarray(samples)
+    if samples.shape != (n, ):
+        raise ValueError(f'Expected {n} samples, got shape {samples.shape}')
+    return samples
+
+
+def summarize(values, percentiles=(5, 50, 95)):
+    """ Summary statistics of the numbers in an array of values
+
+    :param values: array of the values of an output
+    :param percentiles: percentiles to include as 'p5', 'p50' etc.
+    :return: dict of count, errors (values which are not real numbers, such
+        as excel errors and complex numbers), mean, std, min, max and the
+        percentiles.  Booleans are only counted, as 0 and 1, when all of
+        the values are booleans.
+    """
+    if values.dtype.kind in 'biuf':
+        numbers = values.astype(float)
+    else:
+        is_number = np.array([isinstance(value, Real) and not isinstance(value, bool)
+                              for value in values], dtype=bool)
+        numbers = values[is_number].astype(float)
+
+    stats = dict(count=len(numbers), errors=len(values) - len(numbers))
+    if len(numbers):
+        stats.update(mean=float(numbers.mean()), std=float(numbers.std()),
+                     min=float(numbers.min()), max=float(numbers.max()))
+        for percentile, value in zip(percentiles, np.percentile(numbers, percentiles)):
+            stats[f'p{percentile}'] = float(value)
+    return stats
+
+
+def simulate(excel_compiler, distributions, outputs, n, seed=None, chunk_size=10000,
+             percentiles=(5, 50, 95)):
+    """ Evaluate outputs for n samples of the inputs
+
+    :param excel_compiler: the `ExcelCompiler` to evaluate, its values are
+        not changed
+    :param distributions: dict of input cell address to its distribution,
+        which is the name and parameters of a `numpy.random.Generator`
+        method like ('normal', 0, 1), a function of (rng, n) returning the
+        samples, or an array of the n samples
+    :param outputs: address, or tuple or list of cell addresses
+    :param n: number of samples
+    :param seed: seed for `numpy.random.default_rng()`
+    :param chunk_size: number of samples evaluated at a time
+    :param percentiles: percentiles for the summary statistics
+    :return: a `Simulation`
+    """
+    if excel_compiler.cycles:
+        raise NotImplementedError(
+            'Simulations of workbooks with iterative calculation')
+    outputs = tuple(map(str, outputs if isinstance(outputs, (tuple, list)) else (outputs, )))
+    cell_map = excel_compiler.cell_map
+
+    # load the cells, and calculate the values which do not depend on the samples
+    excel_compiler.evaluate(outputs)
+    for address in distributions:
+        if address not in cell_map or cell_map[address].address.is_range:
+            raise ValueError(f'Input "{address}" is not a cell in the cell map. Evaluate '
+                             'an address that references it, to place it in the cell map.')
+
+    rng = np.random.default_rng(seed)
+    samples = {address: _draw(distribution, rng, n)
+               for address, distribution in distributions.items()}
+
+    # the nodes needed for the outputs, and those depending on the samples
+    precedents = {}
+    todo = list(outputs)
+    while todo:
+        address = todo.pop()
+        if address not in precedents:
+            precedents[address] = tuple(
+                p.address.address for p in excel_compiler._precedents(cell_map[address]))
+            todo.extend(precedents[address])
+
+    order = []
+    affected = set(samples)
+    counts = {address: sum(p in precedents for p in addresses)
+              for address, addresses in precedents.items()}
+    dependants = collections.defaultdict(list)
+    for address, addresses in precedents.items():
+        for precedent in addresses:
+            dependants[precedent].append(address)
+    level = [address for address, count in counts.items() if count == 0]
+    while level:
+        next_level = []
+        for address in level:
+            if address not in samples and any(p in affected for p in precedents[address]):
+                affected.add(address)
+                order.append(address)
+            for dependant in dependants[address]:
+                counts[dependant] -= 1
+                if counts[dependant] == 0:
+                    next_level.append(dependant)
+        level = next_level
+    cycle = sorted(address for address, count in counts.items() if count)
+    if cycle:
+        raise ValueError(
+            f'Circular references are not supported, cells on or after a cycle: {", ".join(cycle)}')
+
+    # the affected cells each formula reads, directly or through ranges
+    reads = {}
+    for address in order:
+        if cell_map[address].address.is_range:
+            continue
+        cells, ranges = [], []
+        todo = [p for p in precedents[address] if p in affected]
+        seen = set()
+        while todo:
+            precedent = todo.pop()
+            if precedent not in seen:
+                seen.add(precedent)
+                if cell_map[precedent].address.is_range:
+                    ranges.append(precedent)
+                    todo.extend(p for p in precedents[precedent] if p in affected)
+                else:
+                    cells.append(precedent)
+        reads[address] = cells, ranges
+
+    trees = {}
+    for address in reads:
+        python_code = cell_map[address].python_code
+        tree = python_code and ast.parse(python_code, mode='eval')
+        trees[address] = tree if tree and _is_vectorizable(tree) else None
+
+    vectorized = {address for address, tree in trees.items() if tree is not None}
+    scalar_samples = collections.Counter()
+    values = {address: [] for address in outputs}
+    for start in range(0, n, chunk_size):
+        size = min(chunk_size, n - start)
+        arrays = {address: array[start:start + size] for address, array in samples.items()}
+
+        def operand(address):
+            if address in arrays:
+                return arrays[address]
+            return cell_map[address].value
+
+        for address, tree in trees.items():
+            array = None
+            if tree is not None:
+                try:
+                    with np.errstate(all='ignore'):
+                        array, invalid = _vector_value(tree, operand)
+                    array = np.broadcast_to(array, (size, ))
+                    indices = () if invalid is None else np.flatnonzero(
+                        np.broadcast_to(invalid, (size, )))
+                except (KeyError, TypeError, ValueError):
+                    array = None
+            if array is None:
+                indices = range(size)
+            if len(indices):
+                scalar_values = _scalar_values(
+                    excel_compiler, address, reads[address], arrays, indices)
+                if array is None:
+                    array = _as_array(scalar_values)
+                else:
+                    array = array.astype(object)
+                    array[indices] = scalar_values
+                    array = _as_array(array.tolist())
+                scalar_samples[address] += len(indices)
+            arrays[address] = array
+
+        for address in outputs:
+            values[address].append(
+                arrays[address] if address in arrays else _as_array([operand(address)] * size))
+
+    values = {address: np.concatenate(chunks) for address, chunks in values.items()}
+    stats = {address: summarize(array, percentiles) for address, array in values.items()}
+    return Simulation(samples, values, stats, vectorized, scalar_samples)
+
+
+def _scalar_values(excel_compiler, address, reads, arrays, indices):
+    """ Evaluate a cell for some samples, one at a time in a `ValueContext` """
+    cells, ranges = reads
+    context = excel_compiler.value_context()
+    results = []
+    for i in indices:
+        values = {cell: arrays[cell][i] for cell in cells}
+        context.values = {cell: value.item() if isinstance(value, np.generic) else value
+                          for cell, value in values.items()}
+        context.values.update(dict.fromkeys(ranges, context.NEEDS_CALC))
+        context.values[address] = context.NEEDS_CALC
+        results.append(context.evaluate(address))
+    return results
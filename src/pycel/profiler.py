@@ -0,0 +1,243 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright 2011-2019 by Dirk Gorissen, Stephen Rauch and Contributors
+# All rights reserved.
+# This file is part of the Pycel Library, Licensed under GPLv3 (the 'License')
+# You may not use this work except in compliance with the License.
+# You may obtain a copy of the Licence at:
+#   https://www.gnu.org/licenses/gpl-3.0.en.html
+
+"""
+    Per cell profiling and counters of formula evaluation
+
+    Profiling is used like:
+
+        excel_compiler.profiler = True
+        excel_compiler.evaluate('Sheet1!A1')
+        print(excel_compiler.profiler.report())
+        excel_compiler.profiler.write_collapsed('profile.folded')
+
+    The collapsed stack file can be made into a flamegraph with
+    `flamegraph.pl` or loaded into https://www.speedscope.app
+
+    The counters are always collected, and are used like:
+
+        with excel_compiler.stats_context() as stats:
+            excel_compiler.evaluate('Sheet1!A1')
+        print(stats.as_dict())
+
+    Except for the calls per library function, which are only counted
+    inside `stats_context()` or with `excel_compiler.count_function_calls`,
+    since every call then goes through a counting wrapper.
+"""
+
+import collections
+import functools
+import time
+
+
+class CellProfile:
+    """ The evaluation counters for one cell """
+
+    __slots__ = ('count', 'total_time', 'own_time', 'functions')
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.own_time = 0.0
+        # library function name to number of calls
+        self.functions = collections.Counter()
+
+    def __repr__(self):
+        return (f'CellProfile(count={self.count}, total_time={self.total_time:.6f}, '
+                f'own_time={self.own_time:.6f}, functions={dict(self.functions)})')
+
+
+class Profiler:
+    """ Record the evaluation count and times of cells
+
+    The time of a cell includes the time to evaluate its precedents, the own
+    time does not.  Ranges are not profiled on their own, so the time to
+    gather the values of a range is in the own time of the cell which needed
+    the range.
+
+    :param clock: function which returns the time in seconds
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.clear()
+
+    def clear(self):
+        """ Discard the recorded evaluations """
+        # address to CellProfile
+        self.cells = collections.defaultdict(CellProfile)
+
+        # library function name to [calls, time]
+        self.functions = collections.defaultdict(lambda: [0, 0.0])
+
+        # call tree of the evaluations: the key of each node is the index of
+        # its parent node and its address, node 0 is the root
+        self._node_index = {}
+        self._node_keys = [(None, None)]
+        self._node_times = [0.0]
+
+        # node index, start time, time in precedents, function calls
+        self._stack = []
+
+    def enter(self, address):
+        """ Start the evaluation of a cell """
+        parent = self._stack[-1][0] if self._stack else 0
+        key = parent, address
+        node = self._node_index.get(key)
+        if node is None:
+            node = self._node_index[key] = len(self._node_keys)
+            self._node_keys.append(key)
+            self._node_times.append(0.0)
+        self._stack.append([node, self.clock(), 0.0, None])
+
+    def exit(self):
+        """ Finish the evaluation of the most recently entered cell """
+        node, start, precedents_time, functions = self._stack.pop()
+        elapsed = self.clock() - start
+        own_time = elapsed - precedents_time
+
+        profile = self.cells[self._node_keys[node][1]]
+        profile.count += 1
+        profile.total_time += elapsed
+        profile.own_time += own_time
+        if functions:
+            profile.functions.update(functions)
+
+        self._node_times[node] += own_time
+        if self._stack:
+            self._stack[-1][2] += elapsed
+
+    def wrap_function(self, name, func):
+        """ Count the calls of a library function by the cell being evaluated """
+
+        @functools.wraps(func)
+        def profiled(*args, **kwargs):
+            start = self.clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                totals = self.functions[name]
+                totals[0] += 1
+                totals[1] += self.clock() - start
+                if self._stack:
+                    frame = self._stack[-1]
+                    if frame[3] is None:
+                        frame[3] = collections.Counter()
+                    frame[3][name] += 1
+
+        return profiled
+
+    def hot_cells(self, limit=None):
+        """ (address, CellProfile) sorted by the own time, largest first """
+        return sorted(self.cells.items(), key=lambda item: -item[1].own_time)[:limit]
+
+    def report(self, limit=20):
+        """ A table of the cells with the largest own time
+
+        :param limit: maximum number of cells in the report
+        :return: the report as a string
+        """
+        width = max((len(address) for address, _ in self.hot_cells(limit)), default=7)
+        lines = [f'{"address":<{width}} {"count":>8} {"total s":>10} {"own s":>10}  functions']
+        for address, profile in self.hot_cells(limit):
+            functions = ', '.join(
+                f'{name}({count})' for name, count in profile.functions.most_common())
+            lines.append(f'{address:<{width}} {profile.count:>8} '
+                         f'{profile.total_time:>10.6f} {profile.own_time:>10.6f}  {functions}')
+        return '\n'.join(lines)
+
+    def collapsed_stacks(self):
+        """ The own time, in microseconds, of each chain of dependant cells
+
+        :return: list of lines in the collapsed stack format used by
+            flamegraph tools, e.g.: `Sheet1!A1;Sheet1!B1;Sheet1!C1 1234`
+        """
+        # parents are always added to the tree before their children
+        paths = [None]
+        lines = []
+        for (parent, address), own_time in zip(self._node_keys[1:], self._node_times[1:]):
+            path = address if parent == 0 else f'{paths[parent]};{address}'
+            paths.append(path)
+            microseconds = round(own_time * 1e6)
+            if microseconds > 0:
+                lines.append(f'{path} {microseconds}')
+        return lines
+
+    def write_collapsed(self, filename):
+        """ Write the collapsed stacks to a file for a flamegraph """
+        with open(filename, 'w') as f:
+            for line in self.collapsed_stacks():
+                f.write(line + '\n')
+
+
+class EvalStats:
+    """ Counters of the work done to evaluate a workbook
+
+    The cache hits and misses are counted from when the counters were
+    last reset.
+
+    :param caches: function which returns a dict of the caches to report,
+        by name, each having `hits` and `misses` attributes
+    """
+
+    def __init__(self, caches=None):
+        self.caches = caches or dict
+
+        # the library function calls are only counted when turned on
+        self.count_functions = False
+        self.function_calls = collections.Counter()
+        self.cycle_iterations = collections.Counter()
+        self.reset()
+
+    def reset(self):
+        """ Zero the counters """
+        self.cells_evaluated = 0
+        self.ranges_evaluated = 0
+
+        # cells not in the graph which were needed during evaluation,
+        # usually from INDIRECT() and OFFSET()
+        self.gen_graph_calls = 0
+        self.lambdas_compiled = 0
+
+        # cleared, not replaced, since the function wrappers hold them
+        self.function_calls.clear()
+
+        # number of iterations to evaluate with cycles, to how many times
+        self.cycle_iterations.clear()
+
+        self._cache_baselines = {
+            name: (cache.hits, cache.misses) for name, cache in self.caches().items()}
+
+    def wrap_function(self, name, func):
+        """ Count the calls of a library function """
+        function_calls = self.function_calls
+
+        @functools.wraps(func)
+        def counted(*args, **kwargs):
+            function_calls[name] += 1
+            return func(*args, **kwargs)
+
+        return counted
+
+    def as_dict(self):
+        """ The counters as a dict of plain types, for export to monitoring """
+        caches = {}
+        for name, cache in self.caches().items():
+            hits, misses = self._cache_baselines.get(name, (0, 0))
+            caches[name] = dict(hits=cache.hits - hits, misses=cache.misses - misses)
+
+        return dict(
+            cells_evaluated=self.cells_evaluated,
+            ranges_evaluated=self.ranges_evaluated,
+            gen_graph_calls=self.gen_graph_calls,
+            lambdas_compiled=self.lambdas_compiled,
+            function_calls=dict(self.function_calls),
+            cycle_iterations=dict(self.cycle_iterations),
+            caches=caches,
+        )
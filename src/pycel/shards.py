@@ -0,0 +1,359 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright 2011-2019 by Dirk Gorissen, Stephen Rauch and Contributors
+# All rights reserved.
+# This file is part of the Pycel Library, Licensed under GPLv3 (the 'License')
+# You may not use this work except in compliance with the License.
+# You may obtain a copy of the Licence at:
+#   https://www.gnu.org/licenses/gpl-3.0.en.html
+
+"""
+    Evaluate one compiled workbook split into shards, each in its own process
+
+    Used like:
+
+        with ShardedModel(excel_compiler, shards=4, by='sheet') as model:
+            model.set_value('Inputs!B2', 5)
+            result = model.evaluate('Outputs!C10')
+
+    Every cell is owned by one shard.  A shard gets a slice of the cell map
+    with the cells it owns, the ranges they read, and placeholders for the
+    cells it reads from other shards.  Evaluating an output is done in rounds:
+    each round the boundary cells (the cells read by other shards) of one
+    topological level are evaluated by their owners, and their values are
+    sent through pipes to the shards which read them.
+"""
+
+import collections
+import multiprocessing
+import pickle
+import sys
+
+import networkx as nx
+
+from pycel.excelcompiler import _Cell, ExcelCompiler
+from pycel.excelutil import list_like
+
+
+def partition(excel_compiler, shards, by='sheet'):
+    """ Assign the cells of a compiler to shards
+
+    Ranges are not assigned, since each shard which reads a range gathers it.
+
+    :param excel_compiler: the `ExcelCompiler`, with its cells loaded
+    :param shards: the most shards to use
+    :param by: 'sheet' to keep the cells of each sheet together, placing the
+        largest sheets first on the shard with the fewest cells, or 'min_cut'
+        to bisect the dependency graph with Kernighan-Lin, which is slower
+    :return: dict of cell address to shard number
+    """
+    cells = [node for node in excel_compiler.cell_map.values() if not node.address.is_range]
+
+    if by == 'sheet':
+        sheets = collections.defaultdict(list)
+        for cell in cells:
+            sheets[cell.address.sheet].append(cell.address.address)
+        loads = [[] for _ in range(shards)]
+        for addresses in sorted(sheets.values(), key=len, reverse=True):
+            min(loads, key=len).extend(addresses)
+        parts = loads
+
+    elif by == 'min_cut':
+        graph = nx.Graph()
+        graph.add_nodes_from(excel_compiler.cell_map)
+        for node in excel_compiler.cell_map.values():
+            graph.add_edges_from(
+                (node.address.address, precedent.address.address)
+                for precedent in excel_compiler._precedents(node))
+
+        parts = [set(graph)]
+        while len(parts) < shards:
+            parts.sort(key=len)
+            if len(parts[-1]) < 2:
+                break
+            largest = parts.pop()
+            parts.extend(nx.algorithms.community.kernighan_lin_bisection(
+                graph.subgraph(largest), seed=0))
+        is_range = {node.address.address: node.address.is_range
+                    for node in excel_compiler.cell_map.values()}
+        parts = [[address for address in part if not is_range[address]] for part in parts]
+
+    else:
+        raise ValueError(f'Unknown partition: {by}')
+
+    return {address: shard
+            for shard, part in enumerate(part for part in parts if part)
+            for address in part}
+
+
+def _shard_worker(connection, pickled_compiler, recursion_limit):
+    """ Serve the requests of a `ShardedModel` for one shard
+
+    :param connection: pipe to the coordinator
+    :param pickled_compiler: compiler with the cell map slice of the shard,
+        pickled so that compiled formulas are not shared with the coordinator
+    :param recursion_limit: recursion limit of the coordinator
+    """
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), recursion_limit))
+    excel_compiler = pickle.loads(pickled_compiler)
+    cell_map = excel_compiler.cell_map
+    while True:
+        command, *args = connection.recv()
+        if command == 'close':
+            break
+        try:
+            result = None
+            if command == 'evaluate':
+                values, addresses = args
+                for address, value in values.items():
+                    cell_map[address].value = value
+                result = [excel_compiler._evaluate(address) for address in addresses]
+            elif command == 'reset':
+                for address in args[0]:
+                    cell_map[address].value = None
+            else:
+                raise ValueError(f'Unknown command: {command}')
+            connection.send((False, result))
+        except Exception as exc:
+            connection.send((True, exc))
+    connection.close()
+
+
+class ShardedModel:
+    """ Evaluate a compiler split into shards, each in a worker process
+
+    The outputs should have been evaluated with the compiler before the
+    model is created, so that all of the cells are loaded.  Cells found
+    while evaluating, such as from `INDIRECT()`, are not supported.  The
+    values already in the compiler are used, and the compiler is not changed.
+
+    :param excel_compiler: the `ExcelCompiler` to split
+    :param shards: the most shards to use
+    :param by: 'sheet' or 'min_cut', see `partition()`, or a dict of cell
+        address to shard number
+    :param mp_context: a `multiprocessing` context or start method name for
+        the worker processes, defaults to the default context
+    """
+
+    def __init__(self, excel_compiler, shards=2, by='sheet', mp_context=None):
+        if excel_compiler.cycles:
+            raise NotImplementedError(
+                'Sharded models for workbooks with iterative calculation')
+
+        cell_map = excel_compiler.cell_map
+        self.assignment = by if isinstance(by, dict) else partition(
+            excel_compiler, shards, by=by)
+        self.shards = max(self.assignment.values(), default=-1) + 1
+
+        self._precedents = {address: tuple(
+            p.address.address for p in excel_compiler._precedents(node))
+            for address, node in cell_map.items()}
+        self._dependants = collections.defaultdict(list)
+        for address, precedents in self._precedents.items():
+            for precedent in precedents:
+                self._dependants[precedent].append(address)
+
+        # the addresses in the slice of each shard, and the cells each reads
+        self._slices = [set() for _ in range(self.shards)]
+        self._inputs = [set() for _ in range(self.shards)]
+        for address, shard in self.assignment.items():
+            self._slices[shard].add(address)
+        for shard, addresses in enumerate(self._slices):
+            todo = [p for address in addresses for p in self._precedents[address]]
+            while todo:
+                address = todo.pop()
+                if address in self._slices[shard]:
+                    continue
+                if address in self.assignment:
+                    self._inputs[shard].add(address)
+                else:
+                    todo.extend(self._precedents[address])
+                self._slices[shard].add(address)
+
+        self._readers = collections.defaultdict(list)
+        for shard, inputs in enumerate(self._inputs):
+            for address in inputs:
+                self._readers[address].append(shard)
+
+        # boundary values known here, and those each shard has been sent
+        self._values = {address: cell_map[address].value for address in self._readers
+                        if cell_map[address].value is not None}
+        self._sent = [set(inputs) & self._values.keys() for inputs in self._inputs]
+
+        if not isinstance(mp_context, multiprocessing.context.BaseContext):
+            mp_context = multiprocessing.get_context(mp_context)
+        self._connections = []
+        self._processes = []
+        for shard in range(self.shards):
+            connection, child_connection = mp_context.Pipe()
+            process = mp_context.Process(
+                target=_shard_worker, daemon=True,
+                args=(child_connection, self._shard_compiler(excel_compiler, shard),
+                      sys.getrecursionlimit()))
+            process.start()
+            child_connection.close()
+            self._connections.append(connection)
+            self._processes.append(process)
+
+        # counters of the work done
+        self.rounds = 0
+        self.values_sent = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _shard_compiler(self, excel_compiler, shard):
+        """ Pickled copy of the compiler with only the cell map slice of a shard """
+        cell_map = {}
+        for address in self._slices[shard]:
+            node = excel_compiler.cell_map[address]
+            if address in self._inputs[shard]:
+                node = _Cell(node.address, value=self._values.get(address))
+            cell_map[address] = node
+
+        state = excel_compiler.__getstate__()
+        state.update(cell_map=cell_map, dep_graph=nx.DiGraph(), excel=None)
+        shard_compiler = ExcelCompiler.__new__(ExcelCompiler)
+        shard_compiler.__setstate__(state)
+        return pickle.dumps(shard_compiler)
+
+    def close(self):
+        """ Stop the worker processes """
+        for connection in self._connections:
+            try:
+                connection.send(('close', ))
+            except OSError:
+                pass
+            connection.close()
+        for process in self._processes:
+            process.join()
+        self._connections = []
+        self._processes = []
+
+    def _request(self, messages):
+        """ Send messages to shards, then wait for all of the results
+
+        :param messages: dict of shard number to message
+        :return: dict of shard number to result
+        """
+        for shard, message in messages.items():
+            self._connections[shard].send(message)
+        results = {shard: self._connections[shard].recv() for shard in messages}
+        for is_exception, result in results.values():
+            if is_exception:
+                raise result
+        return {shard: result for shard, (_, result) in results.items()}
+
+    def _evaluate_message(self, shard, addresses):
+        """ Evaluate message, with the boundary values the shard has not been sent """
+        values = {address: self._values[address]
+                  for address in self._inputs[shard] - self._sent[shard]
+                  if address in self._values}
+        self._sent[shard].update(values)
+        self.values_sent += len(values)
+        return 'evaluate', values, addresses
+
+    def _levels(self, addresses):
+        """ The topological level of each node needed for some addresses """
+        needed = set()
+        todo = list(addresses)
+        while todo:
+            address = todo.pop()
+            if address not in needed:
+                needed.add(address)
+                todo.extend(self._precedents[address])
+
+        counts = {address: sum(p in needed for p in self._precedents[address])
+                  for address in needed}
+        levels = {}
+        level = [address for address, count in counts.items() if count == 0]
+        depth = 0
+        while level:
+            next_level = []
+            for address in level:
+                levels[address] = depth
+                for dependant in self._dependants[address]:
+                    if dependant in counts:
+                        counts[dependant] -= 1
+                        if counts[dependant] == 0:
+                            next_level.append(dependant)
+            level = next_level
+            depth += 1
+        return levels
+
+    def evaluate(self, address):
+        """ Evaluate cells across the shards
+
+        :param address: cell address, or a tuple or list of cell addresses
+        :return: evaluated value/values
+        """
+        addresses = tuple(address) if list_like(address) else (address, )
+        for addr in addresses:
+            if addr not in self.assignment:
+                raise KeyError(f'Address "{addr}" is not a cell of the sharded model')
+
+        # evaluate the boundary cells not known here, a level at a time
+        levels = self._levels(addresses)
+        rounds = collections.defaultdict(lambda: collections.defaultdict(list))
+        for addr, level in levels.items():
+            if addr in self._readers and addr not in self._values:
+                rounds[level][self.assignment[addr]].append(addr)
+        for level in sorted(rounds):
+            requests = rounds[level]
+            results = self._request({shard: self._evaluate_message(shard, addrs)
+                                     for shard, addrs in requests.items()})
+            for shard, values in results.items():
+                self._values.update(zip(requests[shard], values))
+            self.rounds += 1
+
+        by_shard = collections.defaultdict(list)
+        for addr in addresses:
+            by_shard[self.assignment[addr]].append(addr)
+        results = self._request({shard: self._evaluate_message(shard, addrs)
+                                 for shard, addrs in by_shard.items()})
+        self.rounds += 1
+
+        values = {}
+        for shard, addrs in by_shard.items():
+            values.update(zip(addrs, results[shard]))
+        if not list_like(address):
+            return values[address]
+        result_type = type(address) if isinstance(address, (tuple, list)) else tuple
+        return result_type(values[addr] for addr in addresses)
+
+    def set_value(self, address, value):
+        """ Set the value of an input cell
+
+        :param address: cell address
+        :param value: value to set
+        """
+        if address not in self.assignment:
+            raise KeyError(f'Address "{address}" is not a cell of the sharded model')
+
+        dependants = set()
+        todo = list(self._dependants[address])
+        while todo:
+            addr = todo.pop()
+            if addr not in dependants:
+                dependants.add(addr)
+                todo.extend(self._dependants[addr])
+
+        for addr in dependants:
+            self._values.pop(addr, None)
+        for sent in self._sent:
+            sent -= dependants
+            sent.discard(address)
+        if address in self._readers:
+            self._values[address] = value
+
+        owner = self.assignment[address]
+        messages = {}
+        for shard, addresses in enumerate(self._slices):
+            reset = dependants & addresses
+            if reset or shard == owner:
+                messages[shard] = ('reset', tuple(reset))
+        self._request(messages)
+        self._request({owner: ('evaluate', {address: value}, ())})
@@ -0,0 +1,102 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright 2011-2019 by Dirk Gorissen, Stephen Rauch and Contributors
+# All rights reserved.
+# This file is part of the Pycel Library, Licensed under GPLv3 (the 'License')
+# You may not use this work except in compliance with the License.
+# You may obtain a copy of the Licence at:
+#   https://www.gnu.org/licenses/gpl-3.0.en.html
+
+"""
+    Hooks called while evaluating formulas
+
+    The default tracer of an `ExcelCompiler` logs to the pycel logger.  With
+    no tracer there are no calls, and no messages are formatted:
+
+        excel_compiler.tracer = None
+
+    Subclass `Tracer` to record the evaluations in some other way:
+
+        class PrintTracer(Tracer):
+            def cell_end(self, cell, value):
+                print(cell.address, value)
+
+        excel_compiler.tracer = PrintTracer()
+"""
+
+import logging
+
+from pycel.excelutil import is_address
+
+
+def format_error(trace, python_code, msg=None):
+    """ The message for an error captured while evaluating a formula """
+    fmt_str = "{0}Eval: {1}" if msg is None else "{0}Eval: {1}\n{2}"
+    return fmt_str.format(trace, python_code, msg)
+
+
+class Tracer:
+    """ Evaluation hooks, which all do nothing """
+
+    def cell_start(self, cell):
+        """ Before evaluating the formula of a cell """
+
+    def cell_end(self, cell, value):
+        """ After evaluating the formula of a cell
+
+        :param value: the result of the formula, which may be an address
+        """
+
+    def range_start(self, cell_range):
+        """ Before gathering the values of a range """
+
+    def range_end(self, cell_range, value):
+        """ After gathering the values of a range """
+
+    def error_captured(self, level, trace, python_code, msg=None):
+        """ A formula caught an error, or evaluated to an excel error
+
+        :param level: "error", "warning" or "info"
+        :param trace: the formatted traceback, or ''
+        :param python_code: the code of the formula
+        :param msg: additional information, or None
+        """
+
+
+class LoggingTracer(Tracer):
+    """ Log the evaluations, formatting the messages only if the level is enabled
+
+    :param logger: logger to use (defaults to pycel)
+    """
+
+    def __init__(self, logger=None):
+        self.log = logger or logging.getLogger('pycel')
+
+    def __getstate__(self):
+        return dict(log=self.log.name)
+
+    def __setstate__(self, d):
+        self.log = logging.getLogger(d['log'])
+
+    def cell_start(self, cell):
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug(f"Evaluating: {cell.address}, {cell.python_code}")
+
+    def cell_end(self, cell, value):
+        if self.log.isEnabledFor(logging.INFO):
+            if is_address(value):
+                self.log.info(f"Cell {cell.address} evaluated to address '{value}'")
+            else:
+                self.log.info(
+                    f"Cell {cell.address} evaluated to '{value}' ({type(value).__name__})")
+
+    def range_start(self, cell_range):
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug(f"Evaluating: {cell_range.address}, {cell_range.python_code}")
+
+    def range_end(self, cell_range, value):
+        if self.log.isEnabledFor(logging.INFO):
+            self.log.info(f"Range {cell_range.address} evaluated to '{value}'")
+
+    def error_captured(self, level, trace, python_code, msg=None):
+        getattr(self.log, level)(format_error(trace, python_code, msg))
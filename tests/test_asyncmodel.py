@@ -0,0 +1,116 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright 2011-2019 by Dirk Gorissen, Stephen Rauch and Contributors
+# All rights reserved.
+# This file is part of the Pycel Library, Licensed under GPLv3 (the 'License')
+# You may not use this work except in compliance with the License.
+# You may obtain a copy of the Licence at:
+#   https://www.gnu.org/licenses/gpl-3.0.en.html
+
+import asyncio
+import concurrent.futures
+
+import pytest
+from openpyxl import Workbook
+from openpyxl.workbook.properties import CalcProperties
+
+from pycel.asyncmodel import AsyncModel, evaluate_batch
+from pycel.excelcompiler import ExcelCompiler
+
+OUTPUTS = ('Sheet!B1', 'Sheet!B2')
+
+
+@pytest.fixture
+def excel_compiler():
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = 1
+    ws['A2'] = 2
+    ws['B1'] = '=A1 * 10'
+    ws['B2'] = '=SUM(A1:A2) + B1'
+    excel_compiler = ExcelCompiler(excel=wb)
+    excel_compiler.evaluate(OUTPUTS)
+    return excel_compiler
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def test_evaluate_batch(excel_compiler):
+    results = evaluate_batch(excel_compiler, [
+        ({'Sheet!A1': 2}, OUTPUTS),
+        ({'Sheet!Z99': 2}, OUTPUTS),
+        ({}, 'Sheet!B2'),
+    ])
+    assert [(False, (20, 24)), (True, AssertionError), (False, 13)] == [
+        (is_exc, type(result) if is_exc else result) for is_exc, result in results]
+
+
+@pytest.mark.parametrize('executor', ('thread', 'process'))
+def test_async_model(excel_compiler, executor):
+    model = AsyncModel(excel_compiler, max_batch_size=8, max_delay=0.01,
+                       executor=executor, workers=2)
+
+    async def requests():
+        async with model:
+            return await asyncio.gather(*(
+                model.evaluate({'Sheet!A1': i % 4}, OUTPUTS) for i in range(50)))
+
+    results = run(requests())
+    assert [(i % 4 * 10, i % 4 * 11 + 2) for i in range(50)] == results
+    assert 50 == model.requests
+    assert 7 <= model.batches < 50
+    assert model.coalesced > 0
+
+    # the compiler is unchanged
+    assert (10, 13) == excel_compiler.evaluate(OUTPUTS)
+
+
+def test_async_model_errors_and_back_pressure(excel_compiler):
+    model = AsyncModel(excel_compiler, max_batch_size=4, max_pending=1)
+
+    async def requests():
+        results = await asyncio.gather(
+            *(model.evaluate({'Sheet!A1': i}, 'Sheet!B1') for i in range(10)),
+            model.evaluate({'Sheet!Z99': 1}, 'Sheet!B1'),
+            return_exceptions=True)
+        await model.close()
+        await model.close()
+        with pytest.raises(RuntimeError, match='closed'):
+            await model.evaluate({}, 'Sheet!B1')
+        return results
+
+    results = run(requests())
+    assert [i * 10 for i in range(10)] == results[:10]
+    assert isinstance(results[10], AssertionError)
+
+
+def test_async_model_executor(excel_compiler):
+    with concurrent.futures.ThreadPoolExecutor(1) as executor:
+        model = AsyncModel(excel_compiler, executor=executor)
+
+        async def request():
+            result = await model.evaluate({'Sheet!A2': 5}, 'Sheet!B2')
+            await model.close()
+            return result
+
+        assert 16 == run(request())
+
+        # the executor was not shut down with the model
+        assert 1 == executor.submit(lambda: 1).result()
+
+    with pytest.raises(ValueError, match='Unknown executor'):
+        AsyncModel(excel_compiler, executor='bogus')
+
+
+def test_async_model_cycles():
+    wb = Workbook()
+    wb.calculation = CalcProperties(iterate=True)
+    wb.active['A1'] = '=A1 + 1'
+    with pytest.raises(NotImplementedError):
+        AsyncModel(ExcelCompiler(excel=wb))
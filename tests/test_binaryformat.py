@@ -0,0 +1,129 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright 2011-2019 by Dirk Gorissen, Stephen Rauch and Contributors
+# All rights reserved.
+# This file is part of the Pycel Library, Licensed under GPLv3 (the 'License')
+# You may not use this work except in compliance with the License.
+# You may obtain a copy of the Licence at:
+#   https://www.gnu.org/licenses/gpl-3.0.en.html
+
+import array
+import io
+import json
+import os
+import struct
+import sys
+
+import pytest
+
+from pycel.binaryformat import (
+    BinaryFormatError,
+    content_hash,
+    FORMAT_VERSION,
+    HEADER,
+    MAGIC,
+    read,
+    read_header,
+    read_meta,
+    StringTable,
+    StringTableView,
+    write,
+)
+
+
+def write_bytes(meta, sections):
+    f = io.BytesIO()
+    write(f, meta, sections)
+    return f.getvalue()
+
+
+def test_write_read():
+    sections = dict(
+        ints=array.array('q', [1, -2, 3]),
+        floats=array.array('d', [1.5]),
+        raw=b'abc',
+        empty=array.array('I'),
+    )
+    data = write_bytes(dict(a=1), sections)
+    assert len(data) % 8 == 0
+
+    meta, read_sections = read(data)
+    assert meta['a'] == 1
+    assert meta['byteorder'] == sys.byteorder
+    assert read_sections.keys() == sections.keys()
+    for name, section in sections.items():
+        assert read_sections[name].tolist() == list(section)
+
+    # sections are aligned for in place use
+    _, start = read_meta(data)
+    for name, typecode, offset, size in meta['sections']:
+        assert (start + offset) % 8 == 0
+
+
+def test_read_errors():
+    data = write_bytes({}, {})
+
+    with pytest.raises(BinaryFormatError, match='too short'):
+        read(data[:4])
+
+    with pytest.raises(BinaryFormatError, match='Not a pycel binary file'):
+        read(b'X' + data[1:])
+
+    bad_version = HEADER.pack(MAGIC, FORMAT_VERSION + 1, 0)
+    with pytest.raises(BinaryFormatError, match='Unsupported pycel binary file version'):
+        read(bad_version)
+
+    other_byteorder = 'big' if sys.byteorder == 'little' else 'little'
+    meta = json.dumps(dict(byteorder=other_byteorder, sections=[])).encode()
+    data = HEADER.pack(MAGIC, FORMAT_VERSION, len(meta)) + meta
+    with pytest.raises(BinaryFormatError, match=f'is {other_byteorder} endian'):
+        read(data)
+
+
+def test_read_header(tmpdir):
+    filename = os.path.join(tmpdir, 'header.bin')
+    assert read_header(filename) is None
+
+    with open(filename, 'wb') as f:
+        write(f, dict(content_hash='abc'), dict(raw=b'xyzzy'))
+    assert read_header(filename)['content_hash'] == 'abc'
+
+    with open(filename, 'wb') as f:
+        f.write(struct.pack('<Q', 0))
+    assert read_header(filename) is None
+
+
+def test_content_hash():
+    sections = dict(a=array.array('I', [1, 2]), b=b'code')
+    hashed = content_hash(dict(x=1), sections)
+
+    assert hashed == content_hash(dict(x=1), dict(sections))
+    assert hashed != content_hash(dict(x=2), sections)
+    assert hashed != content_hash(dict(x=1), dict(sections, b=b'other'))
+    assert content_hash(dict(x=1), sections, exclude=('b', )) == \
+        content_hash(dict(x=1), dict(sections, b=b'other'), exclude=('b', ))
+
+
+def test_string_table():
+    strings = StringTable()
+    assert strings.add('Sheet1!A1') == 0
+    assert strings.add('été') == 1
+    assert strings.add('Sheet1!A1') == 0
+    assert strings.add('') == 2
+    assert strings.add('a\0b') == 3
+    assert strings.add('\0') == 4
+    assert strings.add('\ud800') == 5
+    assert len(strings) == 6
+
+    expected = ['Sheet1!A1', 'été', '', 'a\0b', '\0', '\ud800']
+    meta, sections = read(write_bytes({}, strings.sections()))
+    assert StringTable.decode(sections['strings'], sections['string_offsets']) == expected
+
+    view = StringTableView(sections['strings'], sections['string_offsets'])
+    assert list(view) == expected
+    assert view[1] == 'été'
+    assert view[3] == 'a\0b'
+    assert list(StringTableView(
+        sections['strings'], sections['string_offsets'], size=2)) == ['Sheet1!A1', 'été']
+    with pytest.raises(IndexError):
+        view[6]
@@ -0,0 +1,133 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright 2011-2019 by Dirk Gorissen, Stephen Rauch and Contributors
+# All rights reserved.
+# This file is part of the Pycel Library, Licensed under GPLv3 (the 'License')
+# You may not use this work except in compliance with the License.
+# You may obtain a copy of the Licence at:
+#   https://www.gnu.org/licenses/gpl-3.0.en.html
+
+import marshal
+import os
+import time
+import types
+
+import pytest
+
+from pycel.codecache import CodeCache
+from pycel.excelcompiler import ExcelCompiler
+from pycel.excelformula import ExcelFormula
+
+
+def test_key():
+    key = CodeCache.key('a + b')
+    assert key == CodeCache.key('a + b')
+    assert key != CodeCache.key('a + c')
+
+
+def test_get_set(tmpdir):
+    cache = CodeCache(os.path.join(tmpdir, 'cache'))
+    key = CodeCache.key('a + b')
+    assert cache.get(key) is None
+    assert (0, 1) == (cache.hits, cache.misses)
+
+    cache[key] = b'code', {'b', 'a'}
+    assert (b'code', {'a', 'b'}) == cache.get(key)
+    assert (1, 1) == (cache.hits, cache.misses)
+
+    # shared with another instance
+    assert (b'code', {'a', 'b'}) == CodeCache(cache.directory).get(key)
+    assert cache.size > 0
+
+    # a corrupt file is a miss
+    with open(cache._path(key), 'wb') as f:
+        f.write(b'junk')
+    assert cache.get(key) is None
+
+    cache.clear()
+    assert 0 == cache.size
+    assert (0, 0) == (cache.hits, cache.misses)
+
+
+def test_evict(tmpdir):
+    cache = CodeCache(tmpdir)
+    keys = [CodeCache.key(str(i)) for i in range(4)]
+    for i, key in enumerate(keys):
+        cache[key] = b'x' * 100, set()
+        os.utime(cache._path(key), (time.time() - 100 + i, ) * 2)
+    size = cache.size
+
+    # recently used are kept
+    cache.get(keys[0])
+    cache.max_size = size - 1
+    cache[CodeCache.key('new')] = b'x' * 100, set()
+
+    assert cache.size <= cache.max_size * 3 // 4
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[1]) is None
+    assert cache.get(CodeCache.key('new')) is not None
+
+
+def test_size_when_replacing(tmpdir):
+    cache = CodeCache(os.path.join(tmpdir, 'replacing'))
+    key = CodeCache.key('a')
+    cache[key] = b'x' * 100, set()
+    size = cache.size
+
+    # rewriting a key does not count the replaced file
+    cache[key] = b'x' * 100, set()
+    cache[key] = b'x' * 50, set()
+    assert size - 50 == cache.size == CodeCache(cache.directory).size
+
+
+def test_formula_code_cache(tmpdir):
+    cache = CodeCache(tmpdir)
+
+    formula = ExcelFormula('=1 + 2')
+    eval_ctx = ExcelFormula.build_eval_context(None, None, code_cache=cache)
+    assert 3 == eval_ctx(formula)
+    assert (0, 1) == (cache.hits, cache.misses)
+
+    formula = ExcelFormula('=1 + 2')
+    assert 3 == eval_ctx(formula)
+    assert (1, 1) == (cache.hits, cache.misses)
+
+
+def test_formula_code_cache_location(tmpdir):
+    cache = CodeCache(os.path.join(tmpdir, 'location'))
+    eval_ctx = ExcelFormula.build_eval_context(None, None, code_cache=cache)
+    assert 3 == eval_ctx(ExcelFormula('=1 + 2'))
+
+    # the same formula in a text file is found, and is moved to its line
+    formula = ExcelFormula('=1 + 2')
+    formula.filename, formula.lineno = 'model.yml', 42
+    assert 3 == eval_ctx(formula)
+    assert (1, 1) == (cache.hits, cache.misses)
+
+    for code in (formula.compiled_python[0], marshal.loads(formula._marshalled_python[0])):
+        lambda_code = next(c for c in code.co_consts if isinstance(c, types.CodeType))
+        assert 'model.yml' == code.co_filename == lambda_code.co_filename
+        assert {42} == {line for _, _, line in lambda_code.co_lines()}
+
+
+def test_compiler_code_cache(excel_compiler, tmpdir):
+    cache_dir = os.path.join(tmpdir, 'code')
+    excel_compiler.code_cache = cache_dir
+    assert isinstance(excel_compiler.code_cache, CodeCache)
+    excel_compiler.evaluate('Sheet1!D1')
+    excel_compiler.set_value('Sheet1!A1', 200)
+    expected = excel_compiler.evaluate('Sheet1!D1')
+    assert excel_compiler.code_cache.misses > 0
+    assert excel_compiler.code_cache.hits == 0
+
+    excel_compiler.to_file(file_types=('pycel', ))
+    loaded = ExcelCompiler.from_file(
+        excel_compiler.filename + '.pycel', code_cache=cache_dir)
+    for cell in loaded.cell_map.values():
+        if cell.formula:
+            cell.formula._marshalled_python = None
+    loaded.set_value('Sheet1!A1', 100)
+    loaded.set_value('Sheet1!A1', 200)
+    assert expected == pytest.approx(loaded.evaluate('Sheet1!D1'))
+    # the formulas compiled for the first evaluation are all reused
+    assert loaded.code_cache.hits == excel_compiler.code_cache.misses
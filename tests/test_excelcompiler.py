@@ -11,19 +11,24 @@ import copy
 import json
 import math
 import os
+import pickle
 import random
 import shutil
+import threading
 from pathlib import Path
 from unittest import mock
 
+import networkx as nx
 import numpy as np
+import openpyxl
 import pytest
 from openpyxl import Workbook
 from openpyxl.workbook.defined_name import DefinedName
+from openpyxl.workbook.properties import CalcProperties
 from ruamel.yaml import YAML
 
 from pycel.excelcompiler import _Cell, _CellRange, ExcelCompiler, Mismatch
-from pycel.excelformula import FormulaParserError, UnknownFunction
+from pycel.excelformula import ExcelFormula, FormulaParserError, UnknownFunction
 from pycel.excelutil import (
     AddressCell,
     AddressRange,
@@ -32,16 +37,20 @@ from pycel.excelutil import (
     NA_ERROR,
     NULL_ERROR,
 )
-from pycel.excelwrapper import ExcelWrapper
+from pycel.excelwrapper import ExcelStreamWrapper, ExcelWrapper
 
 
 # ::TODO:: need some rectangular ranges for testing
 
 
 def test_end_2_end(excel, fixture_xls_path):
+    stream_excel = ExcelStreamWrapper(fixture_xls_path)
+    stream_excel.load()
+
     # load & compile the file to a graph, starting from D1
     for excel_compiler in (ExcelCompiler(excel=excel),
                            ExcelCompiler(excel=excel.workbook),
+                           ExcelCompiler(excel=stream_excel),
                            ExcelCompiler(fixture_xls_path)):
 
         # test evaluation
@@ -63,7 +72,7 @@ def test_no_sheet_given(excel_compiler):
     assert sh1_value != value
 
 
-@pytest.mark.parametrize('file_type', ('pickle', 'yaml', 'json'))
+@pytest.mark.parametrize('file_type', ('pickle', 'yaml', 'json', 'pycel'))
 def test_round_trip_through_json_yaml_and_pickle(excel_compiler, fixture_xls_path, file_type):
     extra_data = {1: 3}
     plugins = ('pycel.excellib', )
@@ -174,14 +183,169 @@ def test_pickle_file_rebuilding(excel_compiler):
     excel_compiler.to_file()
     assert old_hash == excel_compiler._compute_file_md5_digest(pickle_name)
 
+    # the pickle does not depend on the text file
     os.unlink(yaml_name)
     excel_compiler.to_file()
+    assert os.path.exists(yaml_name)
+    assert old_hash == excel_compiler._compute_file_md5_digest(pickle_name)
+
+    # changing the content rebuilds the pickle
+    excel_compiler.extra_data = {'changed': True}
+    excel_compiler.to_file()
     new_hash = excel_compiler._compute_file_md5_digest(pickle_name)
     assert old_hash != new_hash
+    assert ExcelCompiler.from_file(pickle_name).extra_data['changed']
 
-    shutil.copyfile(pickle_name, yaml_name)
+    # an unreadable pickle is rebuilt
+    shutil.copyfile(yaml_name, pickle_name)
     excel_compiler.to_file()
-    assert new_hash != excel_compiler._compute_file_md5_digest(pickle_name)
+    assert ExcelCompiler.from_file(pickle_name).extra_data['changed']
+
+
+def test_pickle_file_without_header(excel_compiler, tmpdir):
+    pickle_name = os.path.join(tmpdir, 'no_header.pkl')
+    excel_compiler.evaluate('Sheet1!D1')
+    with open(pickle_name, 'wb') as f:
+        pickle.dump(excel_compiler, f)
+
+    loaded = ExcelCompiler.from_file(pickle_name)
+    assert loaded.evaluate('Sheet1!D1') == excel_compiler.evaluate('Sheet1!D1')
+
+
+def test_binary_file_rebuilding(excel_compiler):
+    excel_compiler.evaluate('Sheet1!D1')
+    binary_name = excel_compiler.filename + '.pycel'
+    yaml_name = excel_compiler.filename + '.yml'
+    for name in (binary_name, yaml_name):
+        if os.path.exists(name):
+            os.unlink(name)
+
+    excel_compiler.to_file(file_types=('pycel', ))
+    assert os.path.exists(binary_name)
+    assert not os.path.exists(yaml_name)
+    old_hash = excel_compiler._compute_file_md5_digest(binary_name)
+
+    assert not excel_compiler._to_binary(binary_name)
+    assert old_hash == excel_compiler._compute_file_md5_digest(binary_name)
+
+    excel_compiler.set_value('Sheet1!A1', 200)
+    assert excel_compiler._to_binary(binary_name)
+    assert old_hash != excel_compiler._compute_file_md5_digest(binary_name)
+
+    # code compiled by a different python is not used
+    with mock.patch('importlib.util.MAGIC_NUMBER', b'\0\0\r\n'):
+        loaded = ExcelCompiler.from_file(binary_name)
+    assert loaded.cell_map['Sheet1!D1'].formula._marshalled_python is None
+    assert -0.00331 == round(loaded.evaluate('Sheet1!D1'), 5)
+
+
+def test_binary_round_trip(excel_compiler, tmpdir):
+    formula_cells = excel_compiler.formula_cells('Sheet1') + \
+        excel_compiler.formula_cells('Sheet2')
+    excel_compiler.evaluate(formula_cells)
+    excel_compiler.evaluate('Sheet1!A1:A4')
+
+    values = {
+        'Sheet3!A1': True,
+        'Sheet3!A2': False,
+        'Sheet3!A3': 2 ** 70,
+        'Sheet3!A4': 'a string',
+        'Sheet3!A5': '#DIV/0!',
+        'Sheet3!A6': 1.5,
+        'Sheet3!A7': -12,
+        'Sheet3!A8': np.int64(3),
+        'Sheet3!A9': 'nul\0',
+    }
+    excel_compiler.evaluate(tuple(values))
+    for address, value in values.items():
+        excel_compiler.set_value(address, value)
+
+    tmp_name = os.path.join(tmpdir, 'binary_test.pycel')
+    excel_compiler.to_file(tmp_name)
+    loaded = ExcelCompiler.from_file(tmp_name)
+
+    assert loaded.cell_map.keys() == excel_compiler.cell_map.keys()
+
+    def edges(compiler):
+        return {(a.address.address, b.address.address) for a, b in compiler.dep_graph.edges}
+    assert edges(loaded) == edges(excel_compiler)
+    for address, value in values.items():
+        assert loaded.evaluate(address) == value
+        assert type(loaded.evaluate(address)) == type(value)
+
+    # formulas are saved without values and are recalculated
+    assert loaded.cell_map['Sheet1!D1'].value is None
+    assert loaded.cell_map['Sheet1!D1'].formula._marshalled_python is not None
+    assert loaded.evaluate(formula_cells) == pytest.approx(
+        excel_compiler.evaluate(formula_cells))
+
+
+def test_binary_round_trip_nul(tmpdir):
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = 'a'
+    ws['A2'] = '=A1 & "cd"'
+    excel_compiler = ExcelCompiler(excel=wb)
+    excel_compiler.evaluate('Sheet!A2')
+    excel_compiler.set_value('Sheet!A1', 'a\0b')
+
+    # openpyxl does not allow nul in a cell, but python code can have it
+    formula = excel_compiler.cell_map['Sheet!A2'].formula
+    formula._python_code = formula.python_code.replace('cd', 'c\0d')
+
+    tmp_name = os.path.join(tmpdir, 'binary_nul.pycel')
+    excel_compiler.to_file(tmp_name)
+    loaded = ExcelCompiler.from_file(tmp_name)
+    assert 'a\0b' == loaded.evaluate('Sheet!A1')
+    assert '_C_("Sheet!A1") & "c\0d"' == loaded.cell_map['Sheet!A2'].python_code
+    assert 'a\0b' == ExcelCompiler.from_file(tmp_name, lazy=True).evaluate('Sheet!A1')
+
+
+def test_binary_lazy_load(excel_compiler, tmpdir):
+    formula_cells = excel_compiler.formula_cells('Sheet1') + \
+        excel_compiler.formula_cells('Sheet2') + \
+        excel_compiler.formula_cells('trim-range')
+    excel_compiler.evaluate(formula_cells)
+    excel_compiler.evaluate(['Sheet1!A:A', 'Sheet1!A1:B3'])
+
+    tmp_name = os.path.join(tmpdir, 'lazy_test.pycel')
+    excel_compiler.to_file(tmp_name)
+    expected = ExcelCompiler.from_file(tmp_name).evaluate(formula_cells)
+
+    lazy = ExcelCompiler.from_file(tmp_name, lazy=True)
+    assert lazy.cell_map == {}
+    assert -0.02286 == round(lazy.evaluate('Sheet1!D1'), 5)
+    assert 'Sheet2!A1' not in lazy.cell_map
+
+    # only the cells reached by the evaluation are built
+    d1 = lazy.cell_map['Sheet1!D1']
+    assert len(lazy.cell_map) < len(excel_compiler.cell_map)
+    cone = nx.ancestors(excel_compiler.dep_graph, excel_compiler.cell_map['Sheet1!D1'])
+    assert set(lazy.cell_map) == {'Sheet1!D1'} | {cell.address.address for cell in cone}
+    assert d1.formula._marshalled_python is not None
+    assert d1.formula._needed_addresses == ExcelFormula(
+        '=' + d1.python_code, formula_is_python_code=True).needed_addresses
+
+    assert lazy.evaluate(formula_cells) == pytest.approx(expected)
+    assert lazy.evaluate('Sheet1!A:A') == excel_compiler.evaluate('Sheet1!A:A')
+
+    lazy.set_value('Sheet1!A1', 200)
+    assert -0.00331 == round(lazy.evaluate('Sheet1!D1'), 5)
+
+    with pytest.raises(ValueError, match='Lazy loading needs a binary file'):
+        ExcelCompiler.from_file(excel_compiler.filename + '.yml', lazy=True)
+
+
+def test_binary_round_trip_cycles(circular_ws, tmpdir):
+    expected = circular_ws.evaluate('Sheet1!B8', iterations=5000, tolerance=0.01)
+
+    tmp_name = os.path.join(tmpdir, 'binary_cycles.pycel')
+    circular_ws.to_file(tmp_name)
+    loaded = ExcelCompiler.from_file(tmp_name)
+
+    assert loaded.cycles == circular_ws.cycles
+    assert loaded.evaluate('Sheet1!B8', iterations=5000, tolerance=0.01) == \
+        pytest.approx(expected)
 
 
 def test_reset(excel_compiler):
@@ -213,6 +377,153 @@ def test_recalculate(excel_compiler):
     assert -0.02286 == round(excel_compiler.cell_map[out_address].value, 5)
 
 
+@pytest.mark.parametrize('executor', ('process', 'thread'))
+def test_recalculate_parallel(fixture_xls_path, executor):
+    excel_compiler = ExcelCompiler(fixture_xls_path)
+    excel_compiler._gen_graph(excel_compiler.formula_cells())
+    excel_compiler.recalculate()
+    expected = {address: cell.value for address, cell in excel_compiler.cell_map.items()}
+
+    excel_compiler.recalculate(workers=2, executor=executor, chunk_size=2)
+    values = {address: cell.value for address, cell in excel_compiler.cell_map.items()}
+    assert expected.keys() == values.keys()
+    for address, value in expected.items():
+        if isinstance(value, float):
+            assert value == pytest.approx(values[address]), address
+        else:
+            assert value == values[address], address
+
+    # each level only depends on earlier levels
+    for cell in excel_compiler.cell_map.values():
+        if isinstance(cell, _CellRange) or cell.formula:
+            cell.value = None
+    levels = excel_compiler._recalc_levels()
+    assert 3 < len(levels)
+    done = {cell for cell in excel_compiler.cell_map.values() if not cell.needs_calc}
+    for level in levels:
+        for cell in level:
+            assert done.issuperset(excel_compiler.dep_graph.predecessors(cell))
+        done.update(level)
+    assert len(done) == len(excel_compiler.cell_map)
+
+    with pytest.raises(ValueError, match='Unknown executor'):
+        excel_compiler.recalculate(workers=2, executor='bogus')
+
+
+@pytest.mark.parametrize('executor', ('process', 'thread'))
+def test_recalculate_parallel_indirect(executor):
+    wb = Workbook()
+    ws = wb.active
+    ws['G1'] = '=D2 * 10'
+    for row in range(1, 5):
+        ws[f'A{row}'] = f'Sheet!C{row}'
+        ws[f'B{row}'] = f'=INDIRECT(A{row})'
+        ws[f'C{row}'] = f'=D{row} * 2'
+        ws[f'D{row}'] = row
+        ws[f'E{row}'] = f'=OFFSET(D1, {row - 1}, 0)'
+        ws[f'F{row}'] = f'=B{row} + E{row}'
+
+    def values(column):
+        return [excel_compiler.cell_map[f'Sheet!{column}{row}'].value for row in range(1, 5)]
+
+    # the cells INDIRECT() refers to are not loaded
+    excel_compiler = ExcelCompiler(excel=wb)
+    excel_compiler._gen_graph([f'Sheet!F{row}' for row in range(1, 5)])
+    assert 'Sheet!C1' not in excel_compiler.cell_map
+    excel_compiler.recalculate(workers=2, executor=executor, chunk_size=1)
+    assert [2, 4, 6, 8] == values('B')
+    assert [1, 2, 3, 4] == values('E')
+    assert [3, 6, 9, 12] == values('F')
+
+    excel_compiler.set_value('Sheet!A1', 'Sheet!G1')
+    excel_compiler.recalculate(workers=2, executor=executor, chunk_size=1)
+    assert [20, 4, 6, 8] == values('B')
+    assert [21, 6, 9, 12] == values('F')
+
+
+@pytest.mark.parametrize('workers', (None, 2))
+def test_compile_all(fixture_xls_path, workers):
+    excel_compiler = ExcelCompiler(fixture_xls_path)
+    excel_compiler.evaluate('Sheet1!D1')
+    excel_compiler.compile_all(workers=workers)
+
+    expected = ExcelCompiler(fixture_xls_path)
+    expected._gen_graph(expected.formula_cells())
+    assert expected.cell_map.keys() == excel_compiler.cell_map.keys()
+
+    for address, cell in excel_compiler.cell_map.items():
+        if cell.formula:
+            assert cell.formula._marshalled_python is not None
+            assert expected.cell_map[address].python_code == cell.python_code
+
+    if workers:
+        # the cells which were not built before use the code from the workers
+        assert excel_compiler.cell_map['trim-range!B1'].formula._ast is None
+        assert not hasattr(excel_compiler, '_compiled_formulas')
+
+    excel_compiler.set_value('Sheet1!A1', 200)
+    assert -0.00331 == round(excel_compiler.evaluate('Sheet1!D1'), 5)
+
+
+@pytest.mark.parametrize('from_file', (False, True))
+def test_refresh(fixture_xls_copy, tmpdir, from_file):
+    filename = fixture_xls_copy('excelcompiler.xlsx')
+    excel_compiler = ExcelCompiler(filename)
+    out_address = 'Sheet1!D1'
+    excel_compiler.evaluate(out_address)
+    excel_compiler.recalculate()
+    if from_file:
+        excel_compiler.to_file(file_types=('pycel', ))
+        excel_compiler = ExcelCompiler.from_file(filename + '.pycel')
+        excel_compiler.recalculate()
+    unchanged = excel_compiler.cell_map['Sheet1!C5']
+    unchanged_lambda = unchanged.formula.compiled_lambda
+    assert unchanged_lambda is not None
+
+    wb = openpyxl.load_workbook(filename)
+    wb['Sheet1']['A10'] = 20
+    wb['Sheet1']['C3'] = '=COS(B3*A3^2)'
+    new_filename = os.path.join(tmpdir, f'refresh_{from_file}.xlsx')
+    wb.save(new_filename)
+
+    changed = excel_compiler.refresh(new_filename)
+    assert ('Sheet1!A10', 'Sheet1!C3') == changed
+    assert excel_compiler.hash_matches
+    assert excel_compiler.cell_map['Sheet1!C5'] is unchanged
+    assert unchanged.formula.compiled_lambda is unchanged_lambda
+    assert unchanged.value is not None
+    assert excel_compiler.cell_map['Sheet1!B10'].value is None
+
+    expected = ExcelCompiler(new_filename).evaluate(out_address)
+    assert expected == pytest.approx(excel_compiler.evaluate(out_address))
+    assert () == excel_compiler.refresh()
+
+
+def test_refresh_cycles(fixture_xls_copy, tmpdir):
+    filename = fixture_xls_copy('circular.xlsx')
+    excel_compiler = ExcelCompiler(filename, cycles=True)
+    assert -50 == excel_compiler.evaluate('Sheet1!B8')
+
+    wb = openpyxl.load_workbook(filename)
+    wb['Sheet1']['A5'] = 70
+    wb['Sheet1']['B1'] = '=B3-B2+1'
+    new_filename = os.path.join(tmpdir, 'refresh_cycles.xlsx')
+    wb.save(new_filename)
+
+    changed = excel_compiler.refresh(new_filename)
+    assert ('Sheet1!A5', 'Sheet1!B1') == changed
+
+    # the dependants of the changed cells are reset
+    cell_map = excel_compiler.cell_map
+    assert 70 == cell_map['Sheet1!A5'].value
+    for address in ('Sheet1!A6', 'Sheet1!B6', 'Sheet1!B8'):
+        assert cell_map[address].value is None
+    assert 0.01 == cell_map['Sheet1!B5'].value
+
+    expected = ExcelCompiler(new_filename, cycles=True).evaluate('Sheet1!B8')
+    assert -69 == expected == excel_compiler.evaluate('Sheet1!B8')
+
+
 def test_evaluate_from_generator(excel_compiler):
     result = excel_compiler.evaluate(
         a for a in ('trim-range!B1', 'trim-range!B2'))
@@ -251,6 +562,142 @@ def test_gen_graph(excel_compiler):
         excel_compiler._gen_graph('=[Filename.xlsx]Sheetname!A1')
 
 
+def test_gen_graph_breadth_first():
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = 1
+    for row in range(2, 2001):
+        ws[f'A{row}'] = f'=A{row - 1} + 1'
+    ws['B1'] = '=A2000 + SUM(A1:A3)'
+    excel_compiler = ExcelCompiler(excel=wb)
+
+    progress = []
+    excel_compiler.graph_progress = lambda *args: progress.append(args)
+    excel_compiler._gen_graph('Sheet!B1')
+    assert 2000 + 2 == len(excel_compiler.cell_map)
+    assert 1999 + 5 == excel_compiler.dep_graph.number_of_edges()
+
+    # B1, then A2000 and the range with its formula cells, then the chain
+    assert (1, 4) == progress[0]
+    assert (2001, 0) == progress[-1]
+    assert [done for done, _ in progress] == sorted(done for done, _ in progress)
+
+
+def value_context_workbook():
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = 1
+    ws['A2'] = 2
+    ws['A3'] = 'Sheet!A2'
+    ws['B1'] = '=A1 * 10'
+    ws['B2'] = '=SUM(A1:A2) + B1'
+    ws['B3'] = '=INDIRECT(A3)'
+    ws['C1'] = '=A2 * 2'
+    return wb
+
+
+def test_value_context():
+    excel_compiler = ExcelCompiler(excel=value_context_workbook())
+    outputs = ('Sheet!B1', 'Sheet!B2', 'Sheet!B3', 'Sheet!C1')
+    assert (10, 13, 2, 4) == excel_compiler.evaluate(outputs)
+
+    context = excel_compiler.value_context()
+    context.set_value('Sheet!A1', 5)
+    assert (50, 57, 2, 4) == context.evaluate(outputs)
+
+    # only the values which depend on the input are in the context
+    assert {'Sheet!A1', 'Sheet!B1', 'Sheet!B2', 'Sheet!A1:A2'} == set(context.values)
+    assert ((5,), (2,)) == context.value('Sheet!A1:A2')
+    assert 4 == context.value('Sheet!C1')
+
+    # the compiler is unchanged
+    assert 1 == excel_compiler.cell_map['Sheet!A1'].value
+    assert (10, 13, 2, 4) == excel_compiler.evaluate(outputs)
+
+    context.set_value('Sheet!A1:A2', (3, 4))
+    context.set_value('Sheet!A3', 'Sheet!C1')
+    assert (30, 37, 8, 8) == context.evaluate(outputs)
+
+    # contexts can evaluate cells the compiler has not yet loaded
+    context = ExcelCompiler(excel=value_context_workbook()).value_context()
+    assert 13 == context.evaluate('Sheet!B2')
+    assert context.excel_compiler.cell_map['Sheet!B2'].value is None
+
+
+def test_value_context_threads():
+    excel_compiler = ExcelCompiler(excel=value_context_workbook())
+    outputs = ('Sheet!B1', 'Sheet!B2', 'Sheet!B3', 'Sheet!C1')
+    excel_compiler.evaluate(outputs)
+
+    expected = {}
+    for value in range(20):
+        excel_compiler.set_value('Sheet!A1', value)
+        excel_compiler.set_value('Sheet!A2', -value)
+        expected[value] = excel_compiler.evaluate(outputs)
+    excel_compiler.set_value('Sheet!A1', 1)
+    excel_compiler.set_value('Sheet!A2', 2)
+    excel_compiler.evaluate(outputs)
+
+    results = {}
+
+    def evaluate(value):
+        for _ in range(50):
+            context = excel_compiler.value_context()
+            context.set_value('Sheet!A1', value)
+            context.set_value('Sheet!A2', -value)
+            results.setdefault(value, set()).add(context.evaluate(outputs))
+
+    threads = [threading.Thread(target=evaluate, args=(value, )) for value in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert {value: {result} for value, result in expected.items()} == results
+
+
+@pytest.mark.parametrize('address', ('Sheet!B1', 'Sheet!B2'))
+def test_reference_to_formula(address):
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = 2
+    ws['A2'] = '=A1 * 2'
+    ws['A3'] = 'A2'
+    ws['B1'] = '=INDIRECT(A3)'
+    ws['B2'] = '=OFFSET(A1, 1, 0)'
+
+    # the referenced formula is calculated, even if it was not evaluated first
+    excel_compiler = ExcelCompiler(excel=wb)
+    assert 4 == excel_compiler.evaluate(address)
+
+    # and in a value context, the reference reads the value of the context
+    excel_compiler = ExcelCompiler(excel=wb)
+    excel_compiler.evaluate('Sheet!A1')
+    context = excel_compiler.value_context()
+    context.set_value('Sheet!A1', 5)
+    assert 10 == context.evaluate(address)
+    assert 4 == excel_compiler.evaluate(address)
+
+
+def test_value_context_none():
+    excel_compiler = ExcelCompiler(excel=value_context_workbook())
+    excel_compiler.evaluate('Sheet!B2')
+
+    context = excel_compiler.value_context()
+    context.set_value('Sheet!B1', None)
+    assert context.evaluate('Sheet!B1') is None
+    assert 3 == context.evaluate('Sheet!B2')
+    assert 13 == excel_compiler.evaluate('Sheet!B2')
+
+
+def test_value_context_cycles():
+    wb = Workbook()
+    wb.calculation = CalcProperties(iterate=True)
+    wb.active['A1'] = '=A1 + 1'
+    with pytest.raises(NotImplementedError):
+        ExcelCompiler(excel=wb).value_context()
+
+
 def test_value_tree_str(excel_compiler):
     out_address = 'trim-range!B2'
     excel_compiler.evaluate(out_address)
@@ -413,6 +860,49 @@ def test_validate_calcs_excel_compiler(excel_compiler):
     assert len(excel_compiler.formula_cells('JUNK-Sheet!B1')) == 0
 
 
+def test_validate_calcs_progress(basic_ws, capsys):
+    calls = []
+    assert {} == basic_ws.validate_calcs(progress=lambda *args: calls.append(args))
+    # the precedents of the formulas are also validated
+    processed, remaining = calls[-1]
+    assert processed > 6
+    assert 0 == remaining
+    assert '' == capsys.readouterr().out
+
+
+def test_validate_calcs_parallel(fixture_xls_copy, tmp_path):
+    excel_compiler = ExcelCompiler(fixture_xls_copy('excelcompiler.xlsx'))
+    total = len(excel_compiler.formula_cells())
+    calls = []
+    assert {} == excel_compiler.validate_calcs(
+        workers=2, chunk_size=5, progress=lambda *args: calls.append(args))
+    assert (total, 0) == calls[-1]
+    assert {total} == {processed + remaining for processed, remaining in calls}
+
+    # the reports for cells validated in more than one chunk are merged
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = '=ARABIC("I")'
+    ws['B1'] = '=A1 + 1'
+    ws['B2'] = '=A1 + 2'
+    ws['C1'] = '=B1 + B2'
+    filename = str(tmp_path / 'validate-parallel.xlsx')
+    wb.save(filename)
+
+    def sorted_failed(failed):
+        return {kind: {key: sorted(reports) for key, reports in reports_by_key.items()}
+                for kind, reports_by_key in failed.items()}
+
+    expected = ExcelCompiler(filename).validate_calcs(progress=lambda *args: None)
+    assert 'not-implemented' in expected
+    failed = ExcelCompiler(filename).validate_calcs(
+        workers=2, chunk_size=1, progress=lambda *args: None)
+    assert sorted_failed(expected) == sorted_failed(failed)
+
+    with pytest.raises(ValueError, match='workbook file'):
+        ExcelCompiler(excel=wb).validate_calcs(workers=2)
+
+
 def test_validate_calcs_empty_params():
     data = [x.strip().split() for x in """
         =INDEX($G$2:$G$4,D2) =INDEX($G$2:$I$2,,D2) =INDEX($G$2:$I$2,$A$6,D2)
@@ -707,7 +1197,7 @@ def test_multi_area_range_defined_name():
     assert (3, 10, 4) == excel_compiler.evaluate(output_addrs[0])
 
 
-def test_unbounded_countifs():
+def test_unbounded_countifs(tmpdir):
     wb = Workbook()
     ws = wb.active
     ws['A1'] = 1
@@ -730,8 +1220,9 @@ def test_unbounded_countifs():
     assert (2, 9) == excel_compiler.evaluate(output_addrs)
 
     # read the spreadsheet from pickle
-    excel_compiler.to_file(file_types=('pickle', ))
-    excel_compiler = ExcelCompiler.from_file(excel_compiler.filename)
+    pickle_name = os.path.join(tmpdir, 'test_unbounded_countifs.pickle')
+    excel_compiler.to_file(pickle_name)
+    excel_compiler = ExcelCompiler.from_file(pickle_name)
 
     # test evaluation
     assert (2, 9) == excel_compiler.evaluate(output_addrs)
@@ -21,11 +21,14 @@ from pycel.excelformula import (
     ExcelFormula,
     FormulaEvalError,
     FormulaParserError,
+    parse_cache,
     Token,
+    Tokenizer,
     UnknownFunction,
 )
 from pycel.excelutil import (
     AddressCell,
+    AddressRange,
     DIV0,
     NAME_ERROR,
     NULL_ERROR,
@@ -562,6 +565,57 @@ def test_descendants():
     }
 
 
+def test_ast_tree():
+    excel_formula = ExcelFormula('=SUM(A1, 2 * B1, C1)')
+    root = excel_formula.ast
+    assert root.parent is None
+    assert ['A1', '*', 'C1'] == [child.value for child in root.children]
+    assert ['2', 'B1'] == [child.value for child in root.children[1].children]
+    assert all(child.parent is root for child in root.children)
+    assert [('A1', 0), ('*', 1), ('2', 0), ('B1', 1), ('C1', 2)] == [
+        (node.value, pos) for node, pos in root.descendants]
+
+    # nodes have no per instance dict
+    assert not hasattr(root, '__dict__')
+
+    # rebuilding from the same rpn gives the same tree
+    excel_formula._ast = None
+    assert 3 == len(excel_formula.ast.children)
+
+
+@pytest.mark.parametrize(
+    'formula', (
+        '=1.5E+3-2e-2+A1',
+        '=[1]Sheet1!$A$1:$B$2+Sheet2!A1',
+        "='a sheet'!A1&\"a \"\"string\"\"\"",
+        '=Table1[[#This Row],[Col 1]]*2',
+        '=IF(ISERROR(A1/B1),#N/A,{1,2;3,4})',
+        '=SUM(A:A,1:1)%<>B1-1E3',
+        '=@A1+1',
+    )
+)
+def test_tokenizer_matches_openpyxl(formula):
+    from openpyxl.formula.tokenizer import Tokenizer as OpxTokenizer
+    assert [(t.value, t.type, t.subtype) for t in OpxTokenizer(formula).items] == [
+        (t.value, t.type, t.subtype) for t in Tokenizer(formula).items]
+
+
+def test_parse_cache(ATestCell):
+    parse_cache.clear()
+    formula = '=SUM(A1, 2 * B1, C1)'
+    rpn = ExcelFormula(formula).rpn
+    assert formula in parse_cache
+    assert (0, 1) == (parse_cache.hits, parse_cache.misses)
+
+    cached_rpn = ExcelFormula(formula, cell=ATestCell('B', 2)).rpn
+    assert (1, 1) == (parse_cache.hits, parse_cache.misses)
+    assert stringify_rpn(rpn) == stringify_rpn(cached_rpn)
+    assert cached_rpn[-1].num_args == 3
+    # the nodes are not shared, since they belong to a cell
+    assert all(a is not b for a, b in zip(rpn, cached_rpn))
+    assert all(node.cell is not None for node in cached_rpn)
+
+
 def test_ast_node():
     with pytest.raises(FormulaParserError):
         ASTNode.create(Token('a_value', None, None))
@@ -614,6 +668,29 @@ def test_needed_addresses():
                                  formula_is_python_code=True)
     assert excel_formula.needed_addresses == (AddressCell('S!A1'), )
 
+    # address functions inside of strings are not needed
+    excel_formula = ExcelFormula('="_C_(\\"A1\\")" & _R_("A2:A3") & _C_("C1")',
+                                 formula_is_python_code=True)
+    assert excel_formula.needed_addresses == (AddressRange('A2:A3'), AddressCell('C1'))
+
+
+def test_needed_addresses_from_emit(ATestCell):
+    # recorded while emitting the python code
+    excel_formula = ExcelFormula('=SUM(A1:B2, A1, Sheet2!C3) + ROW() + (A1:B2 C1:C3)',
+                                 cell=ATestCell('D', 4, sheet='S'))
+    excel_formula.python_code
+    assert excel_formula._needed_addresses == (
+        AddressRange('S!A1:B2'), AddressCell('S!A1'), AddressCell('Sheet2!C3'),
+        AddressCell('S!D4'), AddressRange('S!C1:C3'),
+    )
+    from_code = ExcelFormula('=' + excel_formula.python_code, formula_is_python_code=True)
+    assert excel_formula.needed_addresses == from_code.needed_addresses
+
+    # and serialized with the formula
+    excel_formula = ExcelFormula('=A1 + B1:B2')
+    loaded = pickle.loads(pickle.dumps(excel_formula))
+    assert (AddressCell('A1'), AddressRange('B1:B2')) == loaded._needed_addresses
+
 
 @pytest.mark.parametrize(
     'result, formula', (
@@ -1030,6 +1107,13 @@ def test_lineno_on_error_reporting(empty_eval_context):
         empty_eval_context(excel_formula)
 
 
+def test_code_location_without_text_file():
+    filename, lineno = ExcelFormula('=A1')._code_location()
+    with open(filename) as f:
+        line = f.readlines()[lineno - 1]
+    assert line.strip().startswith('### Traceback will show this line')
+
+
 @pytest.mark.parametrize(
     'msg, formula', (
         ("Function XYZZY is not implemented. "
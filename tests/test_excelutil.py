@@ -16,6 +16,7 @@ import pytest
 from openpyxl.utils import quote_sheetname
 
 from pycel.excelutil import (
+    address_cache,
     AddressCell,
     AddressMultiAreaRange,
     AddressRange,
@@ -36,6 +37,7 @@ from pycel.excelutil import (
     is_number,
     iterative_eval_tracker,
     list_like,
+    LruCache,
     MAX_COL,
     MAX_ROW,
     NULL_ERROR,
@@ -304,6 +306,39 @@ def test_address_pickle(tmpdir):
     assert addrs == new_addrs
 
 
+def test_address_create_interned(ATestCell):
+    address_cache.clear()
+    addr = AddressRange.create('sh!B1:C2')
+    assert addr is AddressRange('sh!B1:C2')
+    assert addr is AddressRange.create('B1:C2', sheet='sh')
+    assert AddressCell('sh!B1') is AddressRange('sh!B1')
+    assert addr is AddressRange.create('sh!B1:C2', cell=ATestCell('A', 1))
+
+    # relative addresses depend on the cell, so are not interned
+    rel_1 = AddressRange.create('R[1]C[1]', sheet='sh', cell=ATestCell('A', 1))
+    rel_2 = AddressRange.create('R[1]C[1]', sheet='sh', cell=ATestCell('B', 2))
+    assert rel_1 == AddressCell('sh!B2')
+    assert rel_2 == AddressCell('sh!C3')
+    assert ('R[1]C[1]', 'sh') not in address_cache
+
+
+def test_lru_cache():
+    cache = LruCache(maxsize=2)
+    cache['a'] = 1
+    cache['b'] = 2
+    assert 1 == cache.get('a')
+    cache['c'] = 3
+    assert 2 == len(cache)
+    assert 'b' not in cache
+    assert cache.get('b') is None
+    assert (1, 3) == (cache.get('a'), cache.get('c'))
+    assert (3, 1) == (cache.hits, cache.misses)
+
+    cache.clear()
+    assert 0 == len(cache)
+    assert (0, 0) == (cache.hits, cache.misses)
+
+
 @pytest.mark.parametrize(
     'sheet_name',
     [
@@ -1379,3 +1414,14 @@ def test_iterative_eval_tracker():
     do_test_tracker()
     thread.join()
     assert thread.result
+
+    # a new thread has the default tolerance before the tracker is inited
+    class DefaultsThread(threading.Thread):
+        def run(self):
+            self.result = (iterative_eval_tracker.ns.iterations,
+                           iterative_eval_tracker.tolerance)
+
+    thread = DefaultsThread()
+    thread.start()
+    thread.join()
+    assert (100, 0.001) == thread.result
@@ -7,16 +7,34 @@
 # You may obtain a copy of the Licence at:
 #   https://www.gnu.org/licenses/gpl-3.0.en.html
 
+import os
+import re
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
 import pytest
+from openpyxl import load_workbook, Workbook
 
-from pycel.excelutil import AddressRange
+from pycel.excelutil import AddressCell, AddressRange
 from pycel.excelwrapper import (
     _OpxRange,
+    _read_worksheet,
     ARRAY_FORMULA_FORMAT,
+    ExcelOpxWrapper,
     ExcelOpxWrapperNoData,
+    ExcelStreamWrapper,
 )
 
 
+@pytest.fixture
+def stream_excel(fixture_xls_path):
+    excel = ExcelStreamWrapper(fixture_xls_path)
+    excel.load()
+    return excel
+
+
 def test_set_and_get_active_sheet(excel):
     excel.set_sheet("Sheet2")
     assert excel.get_active_sheet_name() == 'Sheet2'
@@ -32,6 +50,48 @@ def test_get_range(excel):
     assert sum(map(len, excel_range.values)) == 6
 
 
+def test_get_range_cell_index(fixture_xls_path):
+    excel = ExcelOpxWrapper(fixture_xls_path)
+    excel.load()
+    assert excel._cell_stores == {}
+
+    assert excel.get_range('Sheet1!B2').formula == '=SUM(A2:A4)'
+    assert excel.get_range('Sheet1!B2').values == 9
+    assert tuple(excel._cell_stores) == ('Sheet1',)
+    assert excel.max_col_row('Sheet1') == (4, 18)
+
+
+def test_no_data_wrapper_reads_workbook(fixture_xls_path):
+    workbook = load_workbook(fixture_xls_path)
+    excel = ExcelOpxWrapperNoData(workbook)
+    assert excel.get_range('Sheet1!B2').formula == '=SUM(A2:A4)'
+    assert excel.get_range('Sheet1!A2').values == 2
+    assert excel.max_col_row('Sheet1') == (4, 18)
+
+    # the caller's changes to the workbook are seen
+    workbook['Sheet1']['B2'] = '=SUM(A3:A4)'
+    workbook['Sheet1']['A2'] = 5
+    workbook['Sheet1']['E20'] = '=A2'
+    assert excel.get_range('Sheet1!B2').formula == '=SUM(A3:A4)'
+    assert excel.get_range('Sheet1!A2').values == 5
+    assert excel.max_col_row('Sheet1') == (5, 20)
+    assert excel.get_range('Sheet1!E:E').formula[-1] == ('=A2', )
+    assert AddressCell('Sheet1!E20') in excel.formula_addresses('Sheet1')
+
+
+@pytest.mark.parametrize('wrapper', (ExcelOpxWrapper, ExcelOpxWrapperNoData))
+def test_get_ranges(fixture_xls_path, wrapper):
+    if wrapper is ExcelOpxWrapper:
+        excel = wrapper(fixture_xls_path)
+        excel.load()
+    else:
+        excel = wrapper(load_workbook(fixture_xls_path))
+    excel.set_sheet('Sheet1')
+    addresses = [AddressRange(addr) for addr in (
+        'Sheet1!B2', 'Sheet2!A5:B7', 'A2', 'Sheet1!B2', 'Sheet1!Z99')]
+    assert [excel.get_range(addr) for addr in addresses] == excel.get_ranges(addresses)
+
+
 def test_get_used_range(excel):
     excel.set_sheet("Sheet1")
     assert sum(map(len, excel.get_used_range())) == 72
@@ -264,7 +324,6 @@ def test_cell_to_formulax(value, formula, ATestCell):
 )
 def test_cell_to_formula(value, formula):
     """"""
-    from unittest import mock
     parent = mock.Mock()
     parent.title = 's'
     cell = mock.Mock()
@@ -273,3 +332,156 @@ def test_cell_to_formula(value, formula):
     cell.col_idx = 5
     cell.parent = parent
     assert _OpxRange.cell_to_formula(cell) == formula
+
+
+@pytest.mark.parametrize(
+    'filename', sorted(f for f in os.listdir(
+        os.path.join(os.path.dirname(__file__), 'fixtures')) if f.endswith('.xlsx'))
+)
+def test_stream_wrapper_matches_openpyxl(fixture_xls_copy, filename):
+    path = fixture_xls_copy(filename)
+    opx_excel = ExcelOpxWrapper(path)
+    opx_excel.load()
+    stream_excel = ExcelStreamWrapper(path)
+    stream_excel.load()
+
+    assert opx_excel.defined_names == stream_excel.defined_names
+    assert opx_excel.get_active_sheet_name() == stream_excel.get_active_sheet_name()
+    assert opx_excel.workbook.calculation.iterate == \
+        stream_excel.workbook.calculation.iterate
+
+    for ws in opx_excel.workbook:
+        sheet = ws.title
+        max_col, max_row = opx_excel.max_col_row(sheet)
+        assert (max_col, max_row) == stream_excel.max_col_row(sheet)
+
+        address = AddressRange((1, 1, max_col + 1, max_row + 1), sheet=sheet)
+        assert opx_excel.get_range(address) == stream_excel.get_range(address)
+        assert opx_excel.formula_addresses(sheet) == stream_excel.formula_addresses(sheet)
+
+        stream_ws = stream_excel.workbook[sheet]
+        assert [t.ref for t in opx_excel._worksheet_tables(ws)] == \
+            [t.ref for t in stream_excel._worksheet_tables(stream_ws)]
+
+        assert [(c.sqref, [(r.formula, r.dxf) for r in c.rules])
+                for c in ws.conditional_formatting] == \
+            [(c.sqref, [(r.formula, r.dxf) for r in c.rules])
+             for c in stream_ws.conditional_formatting]
+
+
+def test_stream_wrapper(stream_excel):
+    stream_excel.set_sheet('Sheet1')
+    assert stream_excel.get_active_sheet_name() == 'Sheet1'
+    assert sum(map(len, stream_excel.get_used_range())) == 72
+
+    assert 9 == stream_excel.get_range('B2').values
+    assert '=SUM(A2:A4)' == stream_excel.get_range('B2').formula
+    assert stream_excel.get_range('Sheet1!B:B') == stream_excel.get_range('Sheet1!B1:B18')
+
+    with pytest.raises(KeyError, match='Worksheet JUNK does not exist'):
+        stream_excel.get_range('JUNK!A1')
+
+
+def test_stream_wrapper_no_row_numbers(tmpdir):
+    # some tools write rows and cells without their optional 'r' attribute
+    wb = Workbook()
+    ws = wb.active
+    for row in range(1, 4):
+        ws[f'A{row}'] = row
+        ws[f'B{row}'] = f'=A{row} * 2'
+    path = str(tmpdir.join('no-row-numbers.xlsx'))
+    wb.save(path)
+
+    with zipfile.ZipFile(path) as src:
+        contents = {name: src.read(name) for name in src.namelist()}
+    sheet_xml = 'xl/worksheets/sheet1.xml'
+    stripped = re.sub(rb'(<(?:row|c)\b[^>]*?) r="[^"]*"', rb'\1', contents[sheet_xml])
+    assert b' r="' not in stripped
+    contents[sheet_xml] = stripped
+    with zipfile.ZipFile(path, 'w') as dest:
+        for name, data in contents.items():
+            dest.writestr(name, data)
+
+    stream_excel = ExcelStreamWrapper(path)
+    stream_excel.load()
+    assert (2, 3) == stream_excel.max_col_row('Sheet')
+    assert (('', '=A1 * 2'), ('', '=A2 * 2'), ('', '=A3 * 2')) == \
+        stream_excel.get_range('Sheet!A1:B3').formula
+    assert ((1, ), (2, ), (3, )) == stream_excel.get_range('Sheet!A1:A3').values
+
+    opx_excel = ExcelOpxWrapper(path)
+    opx_excel.load()
+    assert opx_excel.get_range('Sheet!A1:B4') == stream_excel.get_range('Sheet!A1:B4')
+
+
+def test_stream_wrapper_lazy(fixture_xls_path, stream_excel):
+    lazy_excel = ExcelStreamWrapper(fixture_xls_path, lazy=True)
+    lazy_excel.load()
+    assert lazy_excel.loaded_sheets == ()
+
+    # workbook metadata is available without parsing any worksheets
+    assert lazy_excel.defined_names == stream_excel.defined_names
+    assert lazy_excel.table('Table1').sheet_name == 'sref'
+    assert lazy_excel.loaded_sheets == ()
+
+    assert lazy_excel.get_range('Sheet2!A1:B3') == stream_excel.get_range('Sheet2!A1:B3')
+    assert lazy_excel.loaded_sheets == ('Sheet2',)
+
+    assert lazy_excel.formula_addresses('Sheet1') == stream_excel.formula_addresses('Sheet1')
+    assert lazy_excel.loaded_sheets == ('Sheet2', 'Sheet1')
+
+    with pytest.raises(KeyError, match='Worksheet JUNK does not exist'):
+        lazy_excel.get_range('JUNK!A1')
+
+
+def test_stream_wrapper_lazy_threads(fixture_xls_path, stream_excel):
+    lazy_excel = ExcelStreamWrapper(fixture_xls_path, lazy=True)
+    lazy_excel.load()
+
+    # slow parsing, so the threads all ask for the sheet while it loads
+    def read_worksheet(*args):
+        time.sleep(0.05)
+        return _read_worksheet(*args)
+
+    with mock.patch('pycel.excelwrapper._read_worksheet', read_worksheet):
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = tuple(executor.map(
+                lazy_excel.get_range, ('Sheet1!A1:B4', ) * 4))
+
+    expected = stream_excel.get_range('Sheet1!A1:B4')
+    assert all(expected == result for result in results)
+    assert lazy_excel.loaded_sheets == ('Sheet1',)
+
+
+def test_stream_wrapper_lazy_conditional_format(fixture_xls_copy):
+    lazy_excel = ExcelStreamWrapper(fixture_xls_copy('cond-format.xlsx'), lazy=True)
+    lazy_excel.load()
+    assert lazy_excel.loaded_sheets == ()
+
+    # the sheet is only seen as loaded once its conditional formats are attached
+    def attach(formatting):
+        for cf in formatting:
+            assert lazy_excel.loaded_sheets == ()
+            yield cf
+
+    def read_worksheet(*args):
+        cell_store, formatting = _read_worksheet(*args)
+        return cell_store, attach(formatting)
+
+    with mock.patch('pycel.excelwrapper._read_worksheet', read_worksheet):
+        assert [r.formula for r in lazy_excel.conditional_format('Sheet1!B2')] == [
+            '=B2=2', '=B2>1', '=B2>0', '=B2<0']
+    assert lazy_excel.loaded_sheets == ('Sheet1',)
+
+
+def test_stream_wrapper_workers(fixture_xls_path, stream_excel):
+    parallel_excel = ExcelStreamWrapper(fixture_xls_path, workers=2)
+    parallel_excel.load()
+    assert parallel_excel.loaded_sheets == stream_excel.loaded_sheets
+
+    for sheet in stream_excel.loaded_sheets:
+        max_col, max_row = stream_excel.max_col_row(sheet)
+        assert (max_col, max_row) == parallel_excel.max_col_row(sheet)
+        address = AddressRange((1, 1, max_col + 1, max_row + 1), sheet=sheet)
+        assert stream_excel.get_range(address) == parallel_excel.get_range(address)
+        assert stream_excel.formula_addresses(sheet) == parallel_excel.formula_addresses(sheet)
@@ -0,0 +1,203 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright 2011-2019 by Dirk Gorissen, Stephen Rauch and Contributors
+# All rights reserved.
+# This file is part of the Pycel Library, Licensed under GPLv3 (the 'License')
+# You may not use this work except in compliance with the License.
+# You may obtain a copy of the Licence at:
+#   https://www.gnu.org/licenses/gpl-3.0.en.html
+
+import ast
+
+import numpy as np
+import pytest
+from openpyxl import Workbook
+from openpyxl.workbook.properties import CalcProperties
+
+from pycel.excelcompiler import ExcelCompiler
+from pycel.excelutil import DIV0, NUM_ERROR
+from pycel.montecarlo import _is_vectorizable, simulate, summarize
+
+
+@pytest.fixture
+def excel_compiler():
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = 100
+    ws['A2'] = 0.05
+    ws['A3'] = 'text'
+    ws['B1'] = '=A1 * (1 + A2) ^ 3'
+    ws['B2'] = '=IF(B1 > 110, B1 - 110, -B1)'
+    ws['B3'] = '=ROUND(B1, 2)'
+    ws['B4'] = '=B3 / (A1 - 100)'
+    ws['B5'] = '=SUM(B1:B3) + MAX(A1, 100)'
+    ws['B6'] = '=LN(A2) + SQRT(ABS(A1)) + EXP(A2) + INT(A2)'
+    ws['B7'] = '=B4 * 2'
+    ws['B8'] = '=A1 > 100'
+    ws['B9'] = '=IF(A1 > 100, TRUE, 1)'
+    ws['C1'] = '=A3 & "!"'
+    return ExcelCompiler(excel=wb)
+
+
+OUTPUTS = tuple(f'Sheet!B{row}' for row in range(1, 10)) + ('Sheet!C1', )
+
+
+@pytest.mark.parametrize('formula, expected', (
+    ('=A1 + B1 * 2 ^ -C1', True),
+    ('=IF(A1 >= 1, MAX(A1, 2, B1), MIN(A1, 3))', True),
+    ('=POWER(A1, 2) - PI() + TRUE', True),
+    ('=A1 < B1 < C1', True),
+    ('=SUM(A1:A3)', False),
+    ('=ROUND(A1, 2)', False),
+    ('=A1 & "x"', False),
+    ('=IF(A1, 2)', False),
+    ('="text"', False),
+))
+def test_is_vectorizable(formula, expected):
+    from pycel.excelformula import ExcelFormula
+    python_code = ExcelFormula(formula).python_code
+    assert expected == _is_vectorizable(ast.parse(python_code, mode='eval'))
+
+
+def test_simulate(excel_compiler):
+    n = 1000
+    rng = np.random.default_rng(0)
+    distributions = {
+        'Sheet!A1': rng.integers(95, 105, n),
+        'Sheet!A2': ('uniform', -0.1, 0.2),
+    }
+    result = excel_compiler.simulate(distributions, OUTPUTS, n, seed=1, chunk_size=300)
+
+    assert {'Sheet!B1', 'Sheet!B2', 'Sheet!B4', 'Sheet!B6', 'Sheet!B7',
+            'Sheet!B8', 'Sheet!B9'} == result.vectorized
+    scalar_samples = result.scalar_samples
+    assert n == scalar_samples['Sheet!B3'] == scalar_samples['Sheet!B5']
+    assert 0 < scalar_samples['Sheet!B4'] == scalar_samples['Sheet!B7'] < n
+    assert 0 < scalar_samples['Sheet!B6'] < n
+    assert n == scalar_samples['Sheet!B9']
+    assert 'Sheet!B8' not in scalar_samples
+
+    # the same values as evaluating one sample at a time
+    for i in range(0, n, 37):
+        context = excel_compiler.value_context()
+        context.set_value('Sheet!A1', int(result.samples['Sheet!A1'][i]))
+        context.set_value('Sheet!A2', float(result.samples['Sheet!A2'][i]))
+        for address, expected in zip(OUTPUTS, context.evaluate(OUTPUTS)):
+            value = result.values[address][i]
+            if isinstance(expected, str):
+                assert expected == value
+            else:
+                assert expected == pytest.approx(value)
+                assert isinstance(expected, bool) == isinstance(value, (bool, np.bool_))
+
+    assert DIV0 in set(result.values['Sheet!B4'])
+    assert NUM_ERROR in set(result.values['Sheet!B6'])
+    assert {'text!'} == set(result.values['Sheet!C1'])
+    assert result.values['Sheet!B8'].dtype == bool
+
+    # the compiler values are not changed
+    assert 100 == excel_compiler.evaluate('Sheet!A1')
+    assert 100 * 1.05 ** 3 == pytest.approx(excel_compiler.evaluate('Sheet!B1'))
+
+    # the same seed gives the same samples
+    again = excel_compiler.simulate(distributions, OUTPUTS, n, seed=1)
+    np.testing.assert_array_equal(result.samples['Sheet!A2'], again.samples['Sheet!A2'])
+    np.testing.assert_array_equal(result.values['Sheet!B6'], again.values['Sheet!B6'])
+
+
+def test_simulate_stats(excel_compiler):
+    result = excel_compiler.simulate(
+        {'Sheet!A1': lambda rng, n: np.arange(n) + 91.0}, 'Sheet!B4', 20)
+    stats = result.stats['Sheet!B4']
+    assert 19 == stats['count']
+    assert 1 == stats['errors']
+    assert result.values['Sheet!B4'][9] == DIV0
+    assert {'mean', 'std', 'min', 'max', 'p5', 'p50', 'p95'} < set(stats)
+
+    stats = summarize(np.array([1.0, 2.0, 3.0]), percentiles=(50, ))
+    assert dict(count=3, errors=0, mean=2.0, std=pytest.approx(0.8164966), min=1.0,
+                max=3.0, p50=2.0) == stats
+    assert dict(count=0, errors=1) == summarize(np.array([DIV0], dtype=object))
+
+
+def test_simulate_errors(excel_compiler):
+    with pytest.raises(ValueError, match='Expected 10 samples'):
+        excel_compiler.simulate({'Sheet!A1': [1, 2]}, 'Sheet!B1', 10)
+
+    with pytest.raises(ValueError, match='not a cell in the cell map'):
+        excel_compiler.simulate({'Sheet!Z99': ('normal', 0, 1)}, 'Sheet!B1', 10)
+
+    wb = Workbook()
+    wb.calculation = CalcProperties(iterate=True)
+    with pytest.raises(NotImplementedError):
+        ExcelCompiler(excel=wb).simulate({}, 'Sheet!A1', 10)
+
+
+def test_simulate_booleans_in_arithmetic():
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = 1
+    ws['A2'] = 1
+    ws['B1'] = '=(A1 > 0) + (A2 > 0)'
+    ws['B2'] = '=(A1 > 0) * (A2 > 0) * 3'
+    ws['B3'] = '=-(A1 > 0) + POWER(A2 > 0, 2)'
+    ws['B4'] = '=ABS(A1 > 0) + EXP(A2 > 0)'
+    excel_compiler = ExcelCompiler(excel=wb)
+
+    outputs = ('Sheet!B1', 'Sheet!B2', 'Sheet!B3', 'Sheet!B4')
+    distributions = {'Sheet!A1': [1, 1, -1], 'Sheet!A2': [1, -1, -1]}
+    result = excel_compiler.simulate(distributions, outputs, 3)
+    assert set(outputs) == result.vectorized
+    assert [2, 1, 0] == list(result.values['Sheet!B1'])
+    assert [3, 0, 0] == list(result.values['Sheet!B2'])
+
+    # the same values as evaluating one sample at a time
+    for i in range(3):
+        context = excel_compiler.value_context()
+        context.set_value('Sheet!A1', distributions['Sheet!A1'][i])
+        context.set_value('Sheet!A2', distributions['Sheet!A2'][i])
+        for address, expected in zip(outputs, context.evaluate(outputs)):
+            assert expected == pytest.approx(result.values[address][i]), address
+
+
+def test_simulate_cycles():
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = 1
+    ws['B1'] = '=A1 + C1'
+    ws['C1'] = '=B1 / 2'
+    ws['D1'] = '=B1 * 2'
+
+    with pytest.raises(NotImplementedError):
+        simulate(ExcelCompiler(excel=wb, cycles=True), {'Sheet!A1': [1, 2]}, 'Sheet!D1', 2)
+
+    # a cycle with calculated values is not iterated, so it would not be evaluated
+    excel_compiler = ExcelCompiler(excel=wb, cycles=False)
+    excel_compiler._gen_graph('Sheet!D1')
+    for address, value in (('Sheet!B1', 2), ('Sheet!C1', 1), ('Sheet!D1', 4)):
+        excel_compiler.cell_map[address].value = value
+    with pytest.raises(ValueError, match='Circular references.*Sheet!B1, Sheet!C1, Sheet!D1'):
+        excel_compiler.simulate({'Sheet!A1': [1, 2]}, 'Sheet!D1', 2)
+
+
+def test_simulate_complex():
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = 1
+    ws['B1'] = '=A1 ^ 0.5'
+    excel_compiler = ExcelCompiler(excel=wb)
+
+    result = excel_compiler.simulate({'Sheet!A1': [2, -3, 0.3]}, 'Sheet!B1', 3)
+    values = result.values['Sheet!B1']
+    assert 1 == result.scalar_samples['Sheet!B1']
+    assert values.dtype == object
+    assert [2 ** 0.5, 0.3 ** 0.5] == pytest.approx([values[0], values[2]])
+
+    # complex results are not real numbers
+    stats = result.stats['Sheet!B1']
+    assert (2, 1) == (stats['count'], stats['errors'])
+    assert (2 ** 0.5 + 0.3 ** 0.5) / 2 == pytest.approx(stats['mean'])
+    assert 0.3 ** 0.5 == pytest.approx(stats['min'])
+
+    stats = summarize(np.array([1.0, 1j, True], dtype=object), percentiles=())
+    assert (1, 2) == (stats['count'], stats['errors'])
@@ -0,0 +1,187 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright 2011-2019 by Dirk Gorissen, Stephen Rauch and Contributors
+# All rights reserved.
+# This file is part of the Pycel Library, Licensed under GPLv3 (the 'License')
+# You may not use this work except in compliance with the License.
+# You may obtain a copy of the Licence at:
+#   https://www.gnu.org/licenses/gpl-3.0.en.html
+
+import itertools
+import os
+
+import pytest
+from openpyxl import Workbook
+from openpyxl.workbook.properties import CalcProperties
+
+from pycel.excelcompiler import ExcelCompiler
+from pycel.profiler import EvalStats, Profiler
+
+
+@pytest.fixture
+def excel_compiler():
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = 1
+    ws['A2'] = 2
+    ws['B1'] = '=SUM(A1:A2)'
+    ws['B2'] = '=ROUND(B1 / 3, 2) + ROUND(B1, 0)'
+    ws['B3'] = '=B1 + B2'
+    return ExcelCompiler(excel=wb)
+
+
+def test_profiler():
+    # each call of the clock advances one second
+    profiler = Profiler(clock=itertools.count().__next__)
+    profiler.enter('S!A1')
+    profiler.enter('S!B1')
+    profiler.wrap_function('f', lambda x: x)(1)
+    profiler.exit()
+    profiler.exit()
+
+    a1, b1 = profiler.cells['S!A1'], profiler.cells['S!B1']
+    assert (1, 3, 3) == (b1.count, b1.total_time, b1.own_time)
+    assert (1, 5, 2) == (a1.count, a1.total_time, a1.own_time)
+    assert {'f': 1} == b1.functions
+    assert [1, 1] == profiler.functions['f']
+
+    assert [('S!B1', b1), ('S!A1', a1)] == profiler.hot_cells()
+    assert ['S!A1 2000000', 'S!A1;S!B1 3000000'] == profiler.collapsed_stacks()
+
+    profiler.clear()
+    assert not profiler.cells
+    assert [] == profiler.collapsed_stacks()
+
+
+def test_compiler_profiler(excel_compiler, tmpdir):
+    excel_compiler.profiler = True
+    profiler = excel_compiler.profiler
+    assert isinstance(profiler, Profiler)
+
+    assert 7 == excel_compiler.evaluate('Sheet!B3')
+    assert 3 == len(profiler.cells)
+    profiler.clear()
+
+    excel_compiler.set_value('Sheet!A1', 4)
+    assert 14 == excel_compiler.evaluate('Sheet!B3')
+
+    assert {'Sheet!B1', 'Sheet!B2', 'Sheet!B3'} == set(profiler.cells)
+    assert all(1 == cell.count for cell in profiler.cells.values())
+    assert {'round_': 2} == profiler.cells['Sheet!B2'].functions
+    assert {'sum_': 1} == profiler.cells['Sheet!B1'].functions
+    b3 = profiler.cells['Sheet!B3']
+    assert b3.own_time < b3.total_time
+
+    report = profiler.report().splitlines()
+    assert report[0].split() == ['address', 'count', 'total', 's', 'own', 's', 'functions']
+    assert 4 == len(report)
+
+    stacks = [line.rsplit(' ', 1)[0] for line in profiler.collapsed_stacks()]
+    assert set(stacks) <= {
+        'Sheet!B3', 'Sheet!B3;Sheet!B1', 'Sheet!B3;Sheet!B2'}
+
+    filename = os.path.join(tmpdir, 'profile.folded')
+    profiler.write_collapsed(filename)
+    with open(filename) as f:
+        assert len(f.readlines()) == len(stacks)
+
+    # turning off the profiler removes the wrappers
+    excel_compiler.profiler = None
+    excel_compiler.set_value('Sheet!A1', 1)
+    assert 7 == excel_compiler.evaluate('Sheet!B3')
+    assert 1 == profiler.cells['Sheet!B3'].count
+
+
+def test_eval_stats():
+    class Cache:
+        hits = 2
+        misses = 3
+
+    cache = Cache()
+    stats = EvalStats(lambda: dict(cache=cache))
+    counted = stats.wrap_function('f', lambda x: x + 1)
+    assert 2 == counted(1)
+
+    cache.hits = 7
+    result = stats.as_dict()
+    assert {'f': 1} == result['function_calls']
+    assert {'cache': dict(hits=5, misses=0)} == result['caches']
+
+    stats.reset()
+    assert 0 == stats.as_dict()['caches']['cache']['hits']
+
+    # the wrapper counts into the same counter after a reset
+    counted(1)
+    assert {'f': 1} == stats.as_dict()['function_calls']
+    assert 0 == EvalStats().as_dict()['cells_evaluated']
+
+
+def test_compiler_stats(excel_compiler):
+    assert not excel_compiler.count_function_calls
+    assert 7 == excel_compiler.evaluate('Sheet!B3')
+    stats = excel_compiler.stats()
+    assert 3 == stats['cells_evaluated']
+    assert 1 == stats['ranges_evaluated']
+    assert 3 == stats['lambdas_compiled']
+    assert {} == stats['function_calls']
+    assert {'address_cache', 'parse_cache'} == set(stats['caches'])
+
+    # the library functions are not wrapped unless counted
+    name_space = excel_compiler.cell_map['Sheet!B1'].formula.compiled_lambda.__globals__
+    assert not hasattr(name_space['sum_'], '__wrapped__')
+
+    with excel_compiler.stats_context() as eval_stats:
+        assert excel_compiler.count_function_calls
+        excel_compiler.set_value('Sheet!A1', 4)
+        assert 14 == excel_compiler.evaluate('Sheet!B3')
+        name_space = excel_compiler.cell_map['Sheet!B1'].formula.compiled_lambda.__globals__
+        assert hasattr(name_space['sum_'], '__wrapped__')
+    assert not excel_compiler.count_function_calls
+    stats = eval_stats.as_dict()
+    assert stats == excel_compiler.stats()
+    assert (3, 1, 0, 3) == (
+        stats['cells_evaluated'], stats['ranges_evaluated'],
+        stats['gen_graph_calls'], stats['lambdas_compiled'])
+    assert {'round_': 2, 'sum_': 1} == stats['function_calls']
+
+    with excel_compiler.stats_context(count_function_calls=False) as eval_stats:
+        excel_compiler.set_value('Sheet!A1', 5)
+        assert 16.33 == excel_compiler.evaluate('Sheet!B3')
+    assert {} == eval_stats.as_dict()['function_calls']
+    # reloaded without the wrappers, after the counted context
+    assert 3 == eval_stats.as_dict()['lambdas_compiled']
+    name_space = excel_compiler.cell_map['Sheet!B1'].formula.compiled_lambda.__globals__
+    assert not hasattr(name_space['sum_'], '__wrapped__')
+
+    excel_compiler.count_function_calls = True
+    excel_compiler.set_value('Sheet!A1', 4)
+    assert 14 == excel_compiler.evaluate('Sheet!B3')
+    assert {'round_': 2, 'sum_': 1} == excel_compiler.stats()['function_calls']
+
+    excel_compiler.reset_stats()
+    assert 0 == excel_compiler.stats()['cells_evaluated']
+    assert {} == excel_compiler.stats()['function_calls']
+
+
+def test_compiler_stats_indirect_and_cycles():
+    wb = Workbook()
+    wb.calculation = CalcProperties(iterate=True, iterateCount=100, iterateDelta=0.001)
+    ws = wb.active
+    ws['A1'] = 10
+    ws['A2'] = 'C1'
+    ws['C1'] = 5
+    ws['B1'] = '=A1 + B2 / 2'
+    ws['B2'] = '=B1 / 2'
+    ws['B3'] = '=INDIRECT(A2)'
+    excel_compiler = ExcelCompiler(excel=wb)
+    excel_compiler.count_function_calls = True
+
+    assert 5 == excel_compiler.evaluate('Sheet!B3')
+    assert 1 == excel_compiler.stats()['gen_graph_calls']
+    assert {'indirect'} == set(excel_compiler.stats()['function_calls'])
+
+    with excel_compiler.stats_context() as stats:
+        assert excel_compiler.evaluate('Sheet!B1') == pytest.approx(40 / 3, rel=1e-3)
+    iterations = stats.as_dict()['cycle_iterations']
+    assert 1 == sum(iterations.values())
+    assert 2 < next(iter(iterations))
@@ -0,0 +1,122 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright 2011-2019 by Dirk Gorissen, Stephen Rauch and Contributors
+# All rights reserved.
+# This file is part of the Pycel Library, Licensed under GPLv3 (the 'License')
+# You may not use this work except in compliance with the License.
+# You may obtain a copy of the Licence at:
+#   https://www.gnu.org/licenses/gpl-3.0.en.html
+
+import pytest
+from openpyxl import Workbook
+from openpyxl.workbook.properties import CalcProperties
+
+from pycel.excelcompiler import ExcelCompiler
+from pycel.shards import partition, ShardedModel
+
+
+OUTPUTS = ('Out!A1', 'Out!A2', 'Out!A3', 'Calc!B3')
+
+
+def sharded_workbook(inputs=(1, 2, 3)):
+    wb = Workbook()
+    ws = wb.active
+    ws.title = 'In'
+    for row, value in enumerate(inputs, start=1):
+        ws[f'A{row}'] = value
+    ws = wb.create_sheet('Calc')
+    for row in range(1, 4):
+        ws[f'A{row}'] = f'=In!A{row} * 10'
+        ws[f'B{row}'] = f'=A{row} + SUM(In!A1:A3)'
+    ws = wb.create_sheet('Out')
+    ws['A1'] = '=SUM(Calc!B1:B3)'
+    ws['A2'] = '=A1 + Calc!A1 + In!A2'
+    ws['A3'] = '=SUM(Calc!A:A) + A2'
+    return wb
+
+
+def expected_outputs(inputs):
+    return ExcelCompiler(excel=sharded_workbook(inputs)).evaluate(OUTPUTS)
+
+
+@pytest.fixture
+def excel_compiler():
+    excel_compiler = ExcelCompiler(excel=sharded_workbook())
+    excel_compiler.evaluate(OUTPUTS)
+    return excel_compiler
+
+
+def test_partition(excel_compiler):
+    assignment = partition(excel_compiler, 3)
+    cells = {addr for addr, node in excel_compiler.cell_map.items()
+             if not node.address.is_range}
+    assert cells == set(assignment)
+    assert 3 == len(set(assignment.values()))
+    for sheet in ('In', 'Calc', 'Out'):
+        assert 1 == len({shard for addr, shard in assignment.items()
+                         if addr.startswith(sheet + '!')})
+
+    # more shards than sheets
+    assert {0, 1, 2} == set(partition(excel_compiler, 5).values())
+
+    assignment = partition(excel_compiler, 3, by='min_cut')
+    assert cells == set(assignment)
+    assert {0, 1, 2} == set(assignment.values())
+
+    with pytest.raises(ValueError, match='Unknown partition'):
+        partition(excel_compiler, 2, by='xyzzy')
+
+
+@pytest.mark.parametrize('by', ('sheet', 'min_cut'))
+def test_sharded_model(excel_compiler, by):
+    expected = excel_compiler.evaluate(OUTPUTS)
+    with ShardedModel(excel_compiler, shards=3, by=by) as model:
+        assert 3 == model.shards
+        assert expected == model.evaluate(OUTPUTS)
+        assert list(expected) == model.evaluate(list(OUTPUTS))
+        assert expected[0] == model.evaluate(OUTPUTS[0])
+
+        # the shards only hold a slice of the cell map
+        assert all(len(addresses) < len(excel_compiler.cell_map)
+                   for addresses in model._slices)
+
+        rounds = model.rounds
+        model.set_value('In!A1', 5)
+        expected = expected_outputs((5, 2, 3))
+        assert expected == model.evaluate(OUTPUTS)
+        assert model.rounds > rounds + 1
+        assert model.values_sent > 0
+
+        # nothing changed, so only one round
+        rounds = model.rounds
+        assert expected == model.evaluate(OUTPUTS)
+        assert rounds + 1 == model.rounds
+
+        with pytest.raises(KeyError, match='not a cell'):
+            model.evaluate('Out!Z99')
+        with pytest.raises(KeyError, match='not a cell'):
+            model.set_value('Out!Z99', 1)
+
+
+def test_sharded_model_spawn(excel_compiler):
+    assignment = {addr: int(addr.startswith('Out!'))
+                  for addr, node in excel_compiler.cell_map.items()
+                  if not node.address.is_range}
+    with ShardedModel(excel_compiler, by=assignment, mp_context='spawn') as model:
+        assert 2 == model.shards
+        model.set_value('In!A3', 10)
+        assert expected_outputs((1, 2, 10)) == model.evaluate(OUTPUTS)
+
+
+def test_sharded_model_errors(excel_compiler):
+    with ShardedModel(excel_compiler, shards=2) as model:
+        with pytest.raises(ValueError, match='Unknown command'):
+            model._request({0: ('xyzzy', )})
+
+        # the worker still answers after an error
+        assert excel_compiler.evaluate(OUTPUTS) == model.evaluate(OUTPUTS)
+
+    wb = Workbook()
+    wb.calculation = CalcProperties(iterate=True)
+    with pytest.raises(NotImplementedError):
+        ShardedModel(ExcelCompiler(excel=wb))
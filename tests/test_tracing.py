@@ -0,0 +1,120 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright 2011-2019 by Dirk Gorissen, Stephen Rauch and Contributors
+# All rights reserved.
+# This file is part of the Pycel Library, Licensed under GPLv3 (the 'License')
+# You may not use this work except in compliance with the License.
+# You may obtain a copy of the Licence at:
+#   https://www.gnu.org/licenses/gpl-3.0.en.html
+
+import logging
+import pickle
+
+import pytest
+from openpyxl import Workbook
+
+from pycel.excelcompiler import ExcelCompiler
+from pycel.excelformula import ExcelFormula
+from pycel.excelutil import DIV0
+from pycel.tracing import format_error, LoggingTracer, Tracer
+
+
+class RecordingTracer(Tracer):
+
+    def __init__(self):
+        self.calls = []
+
+    def cell_start(self, cell):
+        self.calls.append(('cell_start', cell.address.address))
+
+    def cell_end(self, cell, value):
+        self.calls.append(('cell_end', cell.address.address, value))
+
+    def range_start(self, cell_range):
+        self.calls.append(('range_start', cell_range.address.address))
+
+    def range_end(self, cell_range, value):
+        self.calls.append(('range_end', cell_range.address.address, value))
+
+    def error_captured(self, level, trace, python_code, msg=None):
+        self.calls.append(('error_captured', level, python_code, msg))
+
+
+@pytest.fixture
+def excel_compiler():
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = 1
+    ws['A2'] = 2
+    ws['B1'] = '=SUM(A1:A2)'
+    ws['B2'] = '=B1 / 0'
+    return ExcelCompiler(excel=wb)
+
+
+def test_format_error():
+    assert 'trace\nEval: a + b' == format_error('trace\n', 'a + b')
+    assert 'Eval: a + b\nmsg' == format_error('', 'a + b', 'msg')
+
+
+def test_tracer(excel_compiler):
+    tracer = excel_compiler.tracer = RecordingTracer()
+    assert DIV0 == excel_compiler.evaluate('Sheet!B2')
+    # the range is evaluated when building the graph
+    assert [
+        ('range_start', 'Sheet!A1:A2'),
+        ('range_end', 'Sheet!A1:A2', ((1,), (2,))),
+        ('cell_start', 'Sheet!B2'),
+        ('cell_start', 'Sheet!B1'),
+        ('cell_end', 'Sheet!B1', 3),
+        ('error_captured', 'warning', '_C_("Sheet!B1") / 0', 'Values: 3 Div 0'),
+        ('cell_end', 'Sheet!B2', DIV0),
+    ] == tracer.calls
+
+    # no tracer, no calls
+    excel_compiler.tracer = None
+    excel_compiler.set_value('Sheet!A1', 2)
+    assert DIV0 == excel_compiler.evaluate('Sheet!B2')
+    assert 7 == len(tracer.calls)
+
+
+def test_logging_tracer(excel_compiler, caplog):
+    assert isinstance(excel_compiler.tracer, LoggingTracer)
+    assert 'pycel' == excel_compiler.tracer.log.name
+
+    # other tests mock methods of the pycel logger
+    excel_compiler.tracer = LoggingTracer(logging.getLogger('pycel_x'))
+    caplog.set_level(logging.WARNING)
+    assert DIV0 == excel_compiler.evaluate('Sheet!B2')
+    assert ['WARNING'] == [r.levelname for r in caplog.records]
+    assert 'Values: 3 Div 0' in caplog.records[0].message
+
+    caplog.clear()
+    caplog.set_level(logging.DEBUG)
+    excel_compiler.set_value('Sheet!A1', 2)
+    assert DIV0 == excel_compiler.evaluate('Sheet!B2')
+    messages = [r.message for r in caplog.records]
+    assert 'Evaluating: Sheet!B2, _C_("Sheet!B1") / 0' in messages
+    assert "Range Sheet!A1:A2 evaluated to '((2,), (2,))'" in messages
+    assert "Cell Sheet!B1 evaluated to '4' (int)" in messages
+
+    # the default tracer survives pickling
+    excel_compiler = pickle.loads(pickle.dumps(excel_compiler))
+    assert 'pycel' == excel_compiler.tracer.log.name
+    tracer = pickle.loads(pickle.dumps(LoggingTracer(logging.getLogger('pycel_x'))))
+    assert 'pycel_x' == tracer.log.name
+
+
+def test_eval_context_tracer():
+    tracer = RecordingTracer()
+    eval_ctx = ExcelFormula.build_eval_context(
+        lambda x: DIV0, lambda x: [[1, 1], [1, DIV0]], tracer=tracer)
+    assert 3 == eval_ctx(ExcelFormula('=iferror(1/0,3)'))
+    assert [('error_captured', 'info', 'iferror(1 / 0, 3)', 'Values: 1 Div 0')] \
+        == tracer.calls
+
+    # without a tracer the errors are still raised
+    eval_ctx = ExcelFormula.build_eval_context(
+        lambda x: DIV0, lambda x: [[1, 1], [1, DIV0]], tracer=False)
+    assert DIV0 == eval_ctx(ExcelFormula('=1/0'))
+    with pytest.raises(Exception, match='Eval: unknown_function'):
+        eval_ctx(ExcelFormula('=UNKNOWN_FUNCTION(1)'))